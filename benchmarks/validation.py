@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compares the jsonschema validation of flask-restx with the compiled validation
+of createBlueprint(..., fast_validation=True) for forecasts and measurements
+of a day, a week and a month in 15 minute resolution.
+
+    pip install -e . && python benchmarks/validation.py
+"""
+
+from __future__ import annotations
+
+import timeit
+from datetime import datetime, timedelta
+
+from flask import Blueprint, Flask
+from flask_restx import Api, Model
+from werkzeug.exceptions import BadRequest
+
+from oscp.cp_endpoints import cap_provider_ns
+from oscp.validation import compileValidators, expected_models
+
+
+def forecast(blocks: int) -> dict:
+    start = datetime(2023, 1, 1)
+    step = timedelta(minutes=15)
+    return {
+        "group_id": "group-1",
+        "type": "CONSUMPTION",
+        "forecasted_blocks": [
+            {
+                "capacity": 11.0 + i % 7,
+                "phase": "ALL",
+                "unit": "KW",
+                "start_time": (start + i * step).isoformat(),
+                "end_time": (start + (i + 1) * step).isoformat(),
+            }
+            for i in range(blocks)
+        ],
+    }
+
+
+def measurements(count: int) -> dict:
+    start = datetime(2023, 1, 1)
+    return {
+        "group_id": "group-1",
+        "measurements": [
+            {
+                "value": 2.5 + i % 3,
+                "phase": "ONE",
+                "unit": "KWH",
+                "energy_type": "TOTAL",
+                "direction": "IMPORT",
+                "measure_time": (start + i * timedelta(minutes=15)).isoformat(),
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def invalid(payload: dict) -> dict:
+    payload = dict(payload)
+    key = "forecasted_blocks" if "forecasted_blocks" in payload else "measurements"
+    payload[key] = [dict(item, phase="BAD") for item in payload[key]]
+    return payload
+
+
+def measure(model: Model, payload: dict, resolver, number: int) -> float:
+    def validate():
+        try:
+            model.validate(payload, resolver)
+        except BadRequest:
+            pass
+
+    return min(timeit.repeat(validate, number=number, repeat=5)) / number
+
+
+def main():
+    app = Flask(__name__)
+    # the same setup as createBlueprint(..., fast_validation=True)
+    blueprint = Blueprint("api", __name__, url_prefix="/oscp")
+    api = Api(blueprint)
+    api.add_namespace(cap_provider_ns)
+    compileValidators(api)
+    app.register_blueprint(blueprint)
+
+    with app.test_request_context():
+        resolver = api.refresolver
+        # the expected models use the compiled checks, their copies do not
+        expected = {model.name: model for model in expected_models(api)}
+
+        print(f"{'payload':<36}{'jsonschema':>12}{'compiled':>12}{'speedup':>9}")
+        for name, model, payload in [
+            ("forecast, day", "GroupCapacityForecast", forecast(96)),
+            ("forecast, week", "GroupCapacityForecast", forecast(672)),
+            ("forecast, month", "GroupCapacityForecast", forecast(2976)),
+            ("measurements, day", "UpdateGroupMeasurements", measurements(96)),
+            ("measurements, week", "UpdateGroupMeasurements", measurements(672)),
+            ("invalid forecast, day", "GroupCapacityForecast", invalid(forecast(96))),
+        ]:
+            model = expected[model]
+            number = max(1, 10000 // len(payload[list(payload)[-1]]))
+            slow = measure(Model(model.name, model), payload, resolver, number)
+            fast = measure(model, payload, resolver, number)
+            print(
+                f"{name:<36}{slow * 1000:>10.3f}ms{fast * 1000:>10.3f}ms"
+                f"{slow / fast:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,38 @@
 from __future__ import annotations
 
+import atexit
+import inspect
 import json
 import logging
+import os
 import secrets
+import sqlite3
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from multiprocessing import Lock
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import requests
 from dateutil import parser
-from flask import request
+from flask import has_request_context, request
 from packaging import version
 from werkzeug.exceptions import BadRequest, Forbidden, Unauthorized
 
 import oscp.json_models as oj
+from oscp.auth import TokenCache
+from oscp.client import OscpClient, createOscpHeader  # noqa: F401
+from oscp.correlation import CorrelationStore, ForecastSummary
+from oscp.dedup import RequestDedup
+from oscp.dispatch import current_message
+from oscp.election import LeaderElection
+from oscp.liveness import LivenessTracker
+from oscp.outbox import Outbox
+from oscp.records import EndpointRecord, EtoS, toEpoch
+from oscp.scheduler import DeadlineScheduler
+from oscp.segmentation import SegmentBuffer
 
 log = logging.getLogger("oscp")
 
@@ -47,22 +65,26 @@ def _getLatestVersion(version_urls: List[str]) -> Tuple[str, str]:
     return str(latest), baseUrl
 
 
-def createOscpHeader(token: str, correlation: str = None):
+def scheduled_job(func):
     """
-    creates the http header to authenticate with the other participant
-
-    token must be provided, optional correlation ID can be given,
-    if the message refers to a previous message sent
+    marks a _background_job which takes the due tokens and reschedules the
+    endpoints with _schedule_endpoint.
+    Background jobs without this mark are run every background_interval
+    seconds without arguments, like before the scheduler was introduced.
     """
-    if not token:
-        raise Exception("token must be provided")
-    headers = {
-        "Authorization": "Token " + token,
-        "X-Request-ID": secrets.token_urlsafe(8),
-    }
-    if correlation:
-        headers["X-Correlation-ID"] = correlation
-    return headers
+    func.scheduled = True
+    return func
+
+
+def _requires_arguments(method) -> bool:
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(
+        p.default is p.empty and p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+        for p in parameters
+    )
 
 
 class RegistrationMan(object):
@@ -70,44 +92,239 @@ class RegistrationMan(object):
     Base Registration manager independent of persistance technology
     """
 
-    def __init__(self, version_urls: list, background_interval: int = 5, **kwds):
+    # if the registry can be modified by other processes, e.g. forked workers
+    # sharing a file, registered tokens are not cached by default
+    shared_registry = True
+
+    def __init__(
+        self,
+        version_urls: list,
+        background_interval: int = 5,
+        max_concurrency: int = 8,
+        client: OscpClient = None,
+        outbox: Outbox = None,
+        token_cache: TokenCache = None,
+        liveness_interval: float = 60,
+        leader_lock: str = None,
+        segments: SegmentBuffer = None,
+        dedup: RequestDedup = None,
+        correlations: CorrelationStore = None,
+        **kwds,
+    ):
         self.version_urls = version_urls
-        # run background job every 5 seconds
+        # pooled http sessions to the peers,
+        # can also be used by the managers to send messages
+        self.client = client or OscpClient()
+        # if given, outbound messages are queued and retried by the outbox
+        self.outbox = outbox
+        if outbox is not None and outbox.client is None:
+            # share the circuit breakers with the outbox
+            outbox.client = self.client
+        # caches the results of isRegistered for _check_access_token
+        if token_cache is None:
+            # other processes can remove tokens, which would not be
+            # noticed while a registered token is cached
+            shared = leader_lock or self.shared_registry
+            token_cache = TokenCache(ttl=0) if shared else TokenCache()
+        self.token_cache = token_cache
+        # buffers the segments of inbound messages until they are complete
+        self.segments = segments or SegmentBuffer()
+        # if given, retried requests are answered with the first response
+        self.dedup = dedup
+        # if given, sent forecasts are recorded to resolve X-Correlation-IDs
+        self.correlations = correlations
+        # received heartbeats are kept in memory and persisted at the
+        # heartbeat interval of the peers, at least every liveness_interval seconds
+        self.liveness = LivenessTracker()
+        self.liveness_interval = liveness_interval
+        # with multiple worker processes sharing the registry,
+        # only the process holding the leader_lock sends messages
+        self.election = LeaderElection(leader_lock) if leader_lock else None
+        # failed acks and registers are retried every 5 seconds
+        self.background_interval = background_interval
         self.__stop_thread = False
+        self.scheduler = DeadlineScheduler()
+        # at most max_concurrency endpoints are contacted at the same time
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="OSCP Sender"
+        )
         base_url, version = self._getSupportedVersion(
             [{"version": "2.0", "base_url": "http://127.0.0.1:5000/oscp/cp"}]
         )
 
         super().__init__(**kwds)
 
-        # and ['group_id1'] from dso1.json
+        # custom managers might still implement the periodic _background_job()
+        self._scheduled = getattr(self._background_job, "scheduled", False)
 
         def bck_job():
-            ticker = threading.Event()
-            while not ticker.wait(background_interval):
+            # sleeps until the next endpoint is due
+            while True:
+                tokens = self.scheduler.wait()
                 if self.__stop_thread:
                     break
-                self._background_job()
+                try:
+                    if _PERSIST_LIVENESS in tokens:
+                        tokens.remove(_PERSIST_LIVENESS)
+                        self.persistLiveness()
+                        self.scheduler.schedule(
+                            _PERSIST_LIVENESS, time.monotonic() + liveness_interval
+                        )
+                    if _ELECTION in tokens:
+                        tokens.remove(_ELECTION)
+                        self._elect()
+                        self.scheduler.schedule(
+                            _ELECTION, time.monotonic() + background_interval
+                        )
+                    if _TICK in tokens:
+                        tokens.remove(_TICK)
+                        self.scheduler.schedule(
+                            _TICK, time.monotonic() + background_interval
+                        )
+                        if self.isLeader():
+                            self._run_periodic_job()
+                    elif tokens and self.isLeader():
+                        if self._scheduled:
+                            self._background_job(tokens)
+                        else:
+                            # e.g. a handshake was received
+                            self._run_periodic_job()
+                except Exception:
+                    log.exception("OSCP background job failed")
 
         self.t = threading.Thread(target=bck_job, daemon=True, name="OSCP Worker")
 
     def start(self):
         log.info("starting oscp background job")
+        if self.election:
+            # the endpoints are scheduled once this process is elected
+            self.scheduler.schedule(_ELECTION)
+        elif self._scheduled:
+            for token in self.getRecords():
+                self.scheduler.schedule(token)
+        if not self._scheduled:
+            self.scheduler.schedule(_TICK, time.monotonic() + self.background_interval)
+        self.scheduler.schedule(
+            _PERSIST_LIVENESS, time.monotonic() + self.liveness_interval
+        )
         self.t.start()
+        if self.outbox:
+            self.outbox.start()
 
     def stop(self):
         log.info("stopping oscp background job")
         self.__stop_thread = True
+        self.scheduler.stop()
+        self.persistLiveness()
+        if self.election:
+            self.election.release()
+        if self.outbox:
+            self.outbox.stop()
+
+    def isLeader(self) -> bool:
+        """
+        returns if this process runs the background job
+        """
+        return self.election is None or self.election.is_leader
+
+    def _run_periodic_job(self):
+        """
+        runs a _background_job which does not use the scheduler for all endpoints
+        """
+        if _requires_arguments(self._background_job):
+            self._background_job(None)
+        else:
+            self._background_job()
+
+    def _elect(self):
+        """
+        tries to become the leader. A new leader reschedules all endpoints,
+        as they might have been changed by other processes, afterwards
+        only the endpoints returned by _changedTokens are rescheduled.
+        """
+        was_leader = self.election.is_leader
+        if not self.election.acquire() or not self._scheduled:
+            return
+        if was_leader:
+            for token in self._changedTokens():
+                self.scheduler.schedule(token)
+            return
+        # changes from now on are found by the next election
+        self._changedTokens()
+        for token, endpoint in self.getRecords().items():
+            self._schedule_endpoint(token, endpoint)
+
+    def _changedTokens(self) -> List[str]:
+        """
+        returns the tokens of the endpoints which were added or modified by
+        other processes since the last call.
+        Managers which can be shared by multiple processes implement this.
+        """
+        return []
 
     def _check_access_token(self):
         authHeader = request.headers.get("Authorization")
         if not authHeader:
             raise Unauthorized(description="Unauthorized")
         token = authHeader.replace("Token ", "").strip()
-        if not self.isRegistered(token):
+        registered = self.token_cache.get(token)
+        if registered is None:
+            registered = self.isRegistered(token)
+            self.token_cache.put(token, registered)
+        if not registered:
             raise Forbidden("invalid token")
         return token
 
+    def reassemble(self, payload: dict, token: str = None) -> Optional[dict]:
+        """
+        returns the complete message of a segmented request
+        or None while segments are missing.
+        Requests without X-Segment-Count are returned unchanged.
+        """
+        count = request.headers.get("X-Segment-Count")
+        if count is None:
+            return payload
+        try:
+            count = int(count)
+            index = int(request.headers.get("X-Segment-Index", ""))
+        except ValueError:
+            raise BadRequest("invalid X-Segment-Index or X-Segment-Count")
+        segment_id = request.headers.get("X-Segment-ID")
+        if count > 1 and not segment_id:
+            raise BadRequest("segmented messages require a X-Segment-ID")
+        # the length of chunked requests is not known in advance
+        size = len(request.get_data())
+        return self.segments.add((token, segment_id), index, count, payload, size)
+
+    def getCorrelatedForecast(
+        self, token: str = None, correlation: str = None
+    ) -> Optional[ForecastSummary]:
+        """
+        returns the sent forecast referred to by the X-Correlation-ID of the
+        handled message, e.g. in handleGroupCapacityComplianceError.
+        Returns None without a CorrelationStore or if the forecast is unknown
+        or expired.
+        """
+        if self.correlations is None:
+            return None
+        if correlation is None:
+            message = current_message()
+            if message is not None:
+                correlation = message.correlation_id
+                token = token or message.token
+            elif has_request_context():
+                correlation = request.headers.get("X-Correlation-ID")
+        if not correlation:
+            return None
+        return self.correlations.get(correlation, token)
+
+    def _invalidateTokens(self, *tokens: str):
+        """
+        must be called by the implementations when tokens are added or removed
+        """
+        self.token_cache.invalidate(*tokens)
+
     def handleRegister(self, payload: oj.Register):
         """
         handles a registration message, if registered with tokenA
@@ -142,6 +359,8 @@ class RegistrationMan(object):
             tokenC = secrets.token_urlsafe(32)
             # remove tokenA, send new tokenC to enduser
             self._replaceToken(tokenA, tokenC, payload["token"], base_url, version)
+            self.scheduler.cancel(tokenA)
+            self.liveness.forget(tokenA)
 
             try:
                 self._send_register(base_url, tokenC, client_tokenB, req_id)
@@ -167,22 +386,88 @@ class RegistrationMan(object):
         token = self._check_access_token()
         log.info(f"unregistering {token}. Goodbye")
         self._removeService(token)
+        self.scheduler.cancel(token)
+        self.liveness.forget(token)
 
     def handleHandshake(self, payload: oj.Handshake):
         token = self._check_access_token()
         self._setRequiredBehavior(token, payload["required_behaviour"], new=True)
+        self.scheduler.schedule(token)
         log.info("handshake request for token " + str(token))
 
     def handleHandshakeAck(self, payload: oj.HandshakeAcknowledgement):
         token = self._check_access_token()
         self._setRequiredBehavior(token, payload["required_behaviour"], new=False)
+        self.scheduler.schedule(token)
         log.info("handshake_ack received for token " + str(token))
 
     def handleHeartbeat(self, payload: oj.Heartbeat):
         token = self._check_access_token()
-        offline_at = datetime.strptime(payload["offline_mode_at"], "%Y-%m-%d %H:%M:%S")
-        self._setOfflineAt(token, offline_at)
-        log.info(f"got a heartbeat from {token}. Will be offline at: {offline_at}")
+        offline_at = parseOfflineModeAt(payload["offline_mode_at"])
+        # persisted later by persistLiveness
+        interval = self.liveness.beat(token, offline_at)
+        # other processes see the heartbeat once it is persisted,
+        # which has to happen before the peer sends the next one
+        delay = min(self.liveness_interval, interval or self.liveness_interval)
+        self.scheduler.schedule(_PERSIST_LIVENESS, time.monotonic() + delay)
+        if self.client.health.any_open():
+            base_url, _ = self.getURL(token)
+            self.client.health.online(base_url)
+        # check for the offline deadline, an earlier deadline is kept
+        self.scheduler.schedule(token, _toMonotonic(offline_at))
+        log.info(
+            f"got a heartbeat from {token}. "
+            f"Will be offline at: {payload['offline_mode_at']}"
+        )
+
+    def isOnline(self, token: str) -> bool:
+        """
+        returns if the endpoint with the given token sent a heartbeat
+        and its offline_mode_at is not reached yet
+        """
+        online = self.liveness.is_online(token)
+        if online is None:
+            record = self.getRecord(token)
+            offline_at = record.offline_at if record else None
+            online = offline_at is not None and offline_at > time.time()
+        return online
+
+    def persistLiveness(self):
+        """
+        saves the offline_at of the endpoints which sent a heartbeat
+        since the last call
+        """
+        changes = self.liveness.take_changes()
+        if changes:
+            self._setOfflineAts(changes)
+
+    def _setOfflineAts(self, offline_ats: Dict[str, float]):
+        """
+        saves the offline_at of multiple endpoints, unknown tokens are skipped.
+        Managers which can write them at once override this.
+        """
+        for token, offline_at in offline_ats.items():
+            try:
+                self._setOfflineAt(token, offline_at)
+            except KeyError:
+                # unregistered in the meantime
+                pass
+
+    def _offlineAt(
+        self, endpoint_token: str, endpoint: EndpointRecord
+    ) -> Tuple[Optional[float], float]:
+        """
+        returns the latest offline_at of the endpoint and the seconds after it
+        at which the endpoint is considered offline
+        """
+        offline_at = self.liveness.offline_at(endpoint_token)
+        stored = endpoint.offline_at
+        # persisted timestamps are rounded to microseconds
+        if offline_at is not None and (stored is None or offline_at >= stored - 1e-6):
+            return offline_at, 0
+        # the heartbeat might have been received by another process,
+        # which persists the next one within liveness_interval
+        return stored, self.liveness_interval
 
     def _getSupportedVersion(self, version_urls: List) -> Tuple[str, str]:
         for my_version in self.version_urls:
@@ -200,10 +485,7 @@ class RegistrationMan(object):
         offline_at = datetime.now() + 3 * timedelta(seconds=interval)
         data = {"offline_mode_at": offline_at.strftime("%Y-%m-%d %H:%M:%S")}
         try:
-            response = requests.post(
-                base_url + "/heartbeat", headers=createOscpHeader(token), json=data
-            )
-            response.raise_for_status()
+            self._post(base_url, "/heartbeat", token, data)
         except Exception:
             log.warning(f"sent heartbeat failed, URL: {base_url}")
 
@@ -215,30 +497,37 @@ class RegistrationMan(object):
 
         data = {}  # not interested in heartbeats
         data = {"required_behaviour": {"heartbeat_interval": interval}}
-        response = requests.post(
-            base_url + "/handshake_acknowledgment",
-            headers=createOscpHeader(token),
-            json=data,
-        )
-        response.raise_for_status()
+        self._post(base_url, "/handshake_acknowledgment", token, data)
 
     def _send_register(
         self, base_url: str, new_token: str, client_token: str, correlation: str = None
     ):
-        url = base_url + "/register"
-        log.debug(f"send register to {url} with auth: {client_token}")
+        log.debug(f"send register to {base_url}/register with auth: {client_token}")
 
         data = {"token": new_token, "version_url": self.version_urls}
 
-        response = requests.post(
-            url, headers=createOscpHeader(client_token, correlation), json=data
-        )
-        response.raise_for_status()
+        self._post(base_url, "/register", client_token, data, correlation)
 
-    def _background_job(self):
+    def _post(
+        self,
+        base_url: str,
+        path: str,
+        token: str,
+        data: dict,
+        correlation: str = None,
+    ):
+        """
+        sends a message to the peer, or queues it if an outbox is used
+        """
+        if self.outbox:
+            self.outbox.put(base_url, path, token, data, correlation)
+        else:
+            self.client.post(base_url, path, token, data, correlation)
+
+    def _background_job(self, tokens: List[str] = None):
         log.debug("run backgroundjob")
 
-        # for all endpoints
+        # for all endpoints (or the given due tokens)
         # if endpoint has handshaked
         #     self._send_ack(base_url, interval, token)
         # if endpoint heartbeat is due -> send heartbeat
@@ -249,16 +538,160 @@ class RegistrationMan(object):
         # send register for new tokens (whatever new means)
         #     self._send_register(base_url, new_token, client_token)
 
+        # schedule the next run for the endpoint
+        #     self._schedule_endpoint(token, endpoint)
+
+    def _process_endpoint(self, endpoint_token: str, endpoint: EndpointRecord) -> dict:
+        """
+        sends the messages which are due for a single endpoint.
+        Can be used by the implementations in _background_job.
+
+        Parameters
+        ----------
+        endpoint_token : str
+            the token which is used by the endpoint to access this api
+        endpoint : EndpointRecord
+            the endpoint as returned by getRecords, it is not modified
+
+        Returns
+        -------
+        dict
+            the fields of the endpoint which have to be updated
+
+        """
+        changes = {}
+        base_url = endpoint.base_url
+        if not self.client.health.available(base_url):
+            # skip the peer until its circuit breaker lets a probe through
+            log.debug(f"skipping {base_url}, circuit breaker is open")
+            interval = endpoint.heartbeat_interval
+            nb = endpoint.next_heartbeat
+            if interval and (nb is None or nb <= time.time()):
+                changes["next_heartbeat"] = time.time() + interval
+            return changes
+        try:
+            if endpoint.new == True:
+                # send ack for new handshakes
+
+                interval = endpoint.required_behavior["heartbeat_interval"]
+                token = endpoint.client_token
+                try:
+                    self._send_ack(base_url, interval, token)
+                    changes["new"] = False
+                except requests.exceptions.ConnectionError:
+                    log.error(f"Connection failed: {base_url}")
+
+            if endpoint.required_behavior != None:
+                nb = endpoint.next_heartbeat
+                if nb is None or nb <= time.time():
+                    # next heartbeat is due, send it
+
+                    interval = endpoint.required_behavior["heartbeat_interval"]
+                    token = endpoint.client_token
+                    changes["next_heartbeat"] = self._send_heartbeat(
+                        base_url, interval, token
+                    ).timestamp()
+
+            if endpoint.should_register == True:
+                client_token = endpoint.client_token
+                try:
+                    self._send_register(base_url, endpoint_token, client_token)
+                    changes["should_register"] = False
+                    changes["new"] = True
+                except requests.exceptions.ConnectionError:
+                    log.error(f"Connection failed: {base_url}")
+                except Exception as e:
+                    log.exception(e)
+
+            offline_at, grace = self._offlineAt(endpoint_token, endpoint)
+            if offline_at != None and offline_at + grace < time.time():
+                log.warning(
+                    f"{base_url} endpoint is offline. No Heartbeat received before {EtoS(offline_at)}"
+                )
+                self.client.health.offline(base_url, offline_at)
+        except Exception:
+            log.exception(f"OSCP background job failed for {base_url}")
+        return changes
+
+    def _next_deadline(
+        self, endpoint_token: str, endpoint: EndpointRecord
+    ) -> Optional[float]:
+        """
+        returns the monotonic time at which the endpoint has to be processed
+        again or None if nothing is pending
+        """
+        now = time.time()
+        deadlines = []
+        if endpoint.new == True or endpoint.should_register == True:
+            # retry failed acks and registers
+            deadlines.append(now + self.background_interval)
+        if endpoint.heartbeat_interval:
+            nb = endpoint.next_heartbeat
+            deadlines.append(nb if nb else now)
+        offline_at, grace = self._offlineAt(endpoint_token, endpoint)
+        if offline_at != None and offline_at + grace > now:
+            deadlines.append(offline_at + grace)
+        if not deadlines:
+            return None
+        return _toMonotonic(min(deadlines), now)
+
+    def _schedule_endpoint(self, endpoint_token: str, endpoint: EndpointRecord):
+        deadline = self._next_deadline(endpoint_token, endpoint)
+        if deadline is not None:
+            self.scheduler.schedule(endpoint_token, deadline)
+
+    def _conflictingChanges(
+        self,
+        endpoint_token: str,
+        snapshot: EndpointRecord,
+        endpoint: EndpointRecord,
+        changes: dict,
+    ) -> dict:
+        """
+        returns the changes of _process_endpoint which can still be applied
+        after the endpoint was modified while the messages were sent.
+
+        Only the heartbeat time is kept, the endpoint is processed again
+        right away, so acks and registers are sent for the current state.
+        """
+        self.scheduler.schedule(endpoint_token)
+        if (
+            "next_heartbeat" in changes
+            and endpoint.next_heartbeat == snapshot.next_heartbeat
+        ):
+            return {"next_heartbeat": changes["next_heartbeat"]}
+        return {}
+
+    def _process_endpoints(self, endpoints: dict) -> Dict[str, dict]:
+        """
+        runs _process_endpoint for the given endpoints in parallel.
+        Returns the changed fields for each endpoint token once all
+        messages are sent.
+        """
+        futures = {
+            endpoint_token: self._executor.submit(
+                self._process_endpoint, endpoint_token, endpoint
+            )
+            for endpoint_token, endpoint in endpoints.items()
+        }
+        return {
+            endpoint_token: future.result()
+            for endpoint_token, future in futures.items()
+        }
+
     def getURL(self, token: str = None, group_id: str = None):
         """
         returns the Client URL and the related Token to access the client
-        using the given token to access this api
+        using the given token to access this api.
+        If no token is given, the client serving the group_id is used.
 
         returns none if token could not be found
         """
         url = None
         client_token = None
-        if token == None:
+        if token == None and group_id != None:
+            token = self._token_by_group_id(group_id)
+        elif token == None:
             log.error("Token argument must be given.")
 
         if token:
@@ -270,7 +703,39 @@ class RegistrationMan(object):
         return url, client_token
 
     def getEndpoints(self):
-        raise NotImplementedError()
+        """
+        returns all endpoints by the token they use to access this api,
+        including the state of their circuit breaker.
+        Timestamps are formatted as ISO strings.
+        """
+        endpoints = {}
+        for token, record in self.getRecords().items():
+            endpoint = record.to_dict(iso=True)
+            endpoint["breaker"] = self.client.health.state(record.base_url)
+            endpoints[token] = endpoint
+        return endpoints
+
+    def getRecords(self) -> Dict[str, EndpointRecord]:
+        """
+        returns all endpoints by the token they use to access this api.
+        The records are copies, modifying them does not change the registry.
+
+        Managers written before EndpointRecord implement getEndpoints,
+        which returns the endpoints in the JSON layout of the registry.
+        For those, the records are converted from getEndpoints.
+        """
+        if type(self).getEndpoints is RegistrationMan.getEndpoints:
+            raise NotImplementedError("implement getRecords or getEndpoints")
+        return {
+            token: EndpointRecord.from_dict(entry)
+            for token, entry in self.getEndpoints().items()
+        }
+
+    def getRecord(self, token: str) -> Optional[EndpointRecord]:
+        """
+        returns the endpoint using the given token or None if it is not registered
+        """
+        return self.getRecords().get(token)
 
     def isRegistered(self, token):
         raise NotImplementedError()
@@ -294,15 +759,25 @@ class RegistrationMan(object):
     def _isAuthorized(self, token: str):
         raise NotImplementedError()
 
-    def _setOfflineAt(self, token: str, offline_at: datetime):
+    def _setOfflineAt(self, token: str, offline_at: float):
         raise NotImplementedError()
 
     def _token_by_group_id(self, group_id: str):
         raise NotImplementedError()
 
-    def _url_by_token(self, token: str) -> Tuple[str, str]:
+    def tokens_by_group_ids(self, group_ids: Iterable[str]) -> Dict[str, Set[str]]:
+        """
+        returns the tokens of the endpoints serving each of the given group_ids.
+        Unknown group_ids are mapped to an empty set.
+        """
         raise NotImplementedError()
 
+    def _url_by_token(self, token: str) -> Tuple[str, str]:
+        record = self.getRecord(token)
+        if record is None:
+            raise KeyError(token)
+        return record.base_url, record.client_token
+
 
 def StoD(string: str):
     return parser.parse(string)
@@ -312,15 +787,127 @@ def DtoS(date):
     return date.isoformat()
 
 
+@lru_cache(maxsize=1024)
+def parseOfflineModeAt(value: str) -> float:
+    """
+    returns the epoch seconds of an offline_mode_at "%Y-%m-%d %H:%M:%S" string.
+    Peers send the same value with many heartbeats, so the results are cached.
+    """
+    if (
+        len(value) == 19
+        and value[4] == value[7] == "-"
+        and value[10] == " "
+        and value[13] == value[16] == ":"
+        and value[:4].isdigit()
+    ):
+        try:
+            return datetime(
+                int(value[:4]),
+                int(value[5:7]),
+                int(value[8:10]),
+                int(value[11:13]),
+                int(value[14:16]),
+                int(value[17:19]),
+            ).timestamp()
+        except ValueError:
+            pass
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def _toMonotonic(epoch: float, now: float = None) -> float:
+    """
+    converts epoch seconds to the time.monotonic() clock
+    """
+    if now is None:
+        now = time.time()
+    return time.monotonic() + epoch - now
+
+
+# only shared with forked child processes, the dict based managers
+# can not be used by independent worker processes
 lock = Lock()
 
+# scheduler key to persist the received heartbeats
+_PERSIST_LIVENESS = ("oscp", "persist_liveness")
+# scheduler key to try to become the leader
+_ELECTION = ("oscp", "election")
+# scheduler key of the periodic run of background jobs without @scheduled_job
+_TICK = ("oscp", "tick")
+
+
+def _toJson(endpoints: Dict[str, EndpointRecord]) -> dict:
+    """
+    returns the endpoint records in the layout of the JSON registry,
+    timestamps are persisted as ISO strings
+    """
+    return {token: endpoint.to_dict(iso=True) for token, endpoint in endpoints.items()}
+
+
+def _toIso(epoch: Optional[float]) -> Optional[str]:
+    return EtoS(epoch) if epoch is not None else None
+
+
+class GroupIndex(object):
+    """
+    Inverted index from group_id to the tokens of the endpoints serving it.
+
+    Tokens are kept in the order in which they were assigned to a group.
+    Modifications must be synchronized by the caller.
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, Dict[str, None]] = {}
+        self._groups: Dict[str, Tuple[str, ...]] = {}
+
+    def rebuild(self, endpoints: Dict[str, EndpointRecord]):
+        self._tokens.clear()
+        self._groups.clear()
+        for token, endpoint in endpoints.items():
+            self.set(token, endpoint.group_ids or [])
+
+    def set(self, token: str, group_ids: Iterable[str]):
+        self.remove(token)
+        group_ids = tuple(dict.fromkeys(group_ids))
+        if not group_ids:
+            return
+        self._groups[token] = group_ids
+        for group_id in group_ids:
+            self._tokens.setdefault(group_id, {})[token] = None
+
+    def remove(self, token: str):
+        for group_id in self._groups.pop(token, ()):
+            tokens = self._tokens[group_id]
+            tokens.pop(token, None)
+            if not tokens:
+                del self._tokens[group_id]
+
+    def lookup(self, group_id: str) -> List[str]:
+        return list(self._tokens.get(group_id, ()))
+
 
 class RegistrationDictMan(RegistrationMan):
-    def __init__(self, version_urls, filename="./endpoints.json"):
+    def __init__(
+        self, version_urls, filename="./endpoints.json", reset: bool = True, **kwds
+    ):
         self.filename = filename
-
-        self.writeJson({})
-        super().__init__(version_urls)
+        # if False, the endpoints of the previous run are kept
+        self.reset = reset
+        self._group_index = GroupIndex()
+        # version of each endpoint, changed whenever the endpoint is modified
+        self._versions: Dict[str, int] = {}
+        self._version_counter = 0
+
+        self._initStorage()
+        super().__init__(version_urls, **kwds)
+
+    def _initStorage(self):
+        if self.reset or not os.path.exists(self.filename):
+            # every start begins with an empty registry
+            self.writeJson({})
+        else:
+            endpoints = self._readRecords()
+            self._group_index.rebuild(endpoints)
+            log.info(f"loaded {len(endpoints)} endpoints from {self.filename}")
 
     def readJson(self):
         with open(self.filename, "r") as f:
@@ -330,113 +917,701 @@ class RegistrationDictMan(RegistrationMan):
         with open(self.filename, "w") as f:
             json.dump(endpoints, f, indent=4, sort_keys=False)
 
+    def _readRecords(self) -> Dict[str, EndpointRecord]:
+        return {
+            token: EndpointRecord.from_dict(entry)
+            for token, entry in self.readJson().items()
+        }
+
+    def _load(self) -> Dict[str, EndpointRecord]:
+        """
+        returns the endpoint records which are modified by the hooks
+        """
+        return self._readRecords()
+
+    def _store(self, endpoints: Dict[str, EndpointRecord], *tokens: str):
+        """
+        persists the endpoint records after the entries of the given tokens
+        were modified by a hook
+        """
+        self.writeJson(_toJson(endpoints))
+
+    def _commit(self, endpoints: Dict[str, EndpointRecord], *tokens: str):
+        """
+        increments the version of the modified endpoints and stores them
+        """
+        for token in tokens:
+            if token in endpoints:
+                self._version_counter += 1
+                self._versions[token] = self._version_counter
+            else:
+                self._versions.pop(token, None)
+        self._store(endpoints, *tokens)
+
     def _updateService(self, token, client_token=None, client_url=None, version=None):
         with lock:
-            endpoints = self.readJson()
-            data = {"register": {"token": client_token, "base_url": client_url}}
-            if endpoints.get(token):
+            endpoints = self._load()
+            endpoint = endpoints.get(token)
+            if endpoint:
                 # updates client_token and version_url without touching other stuff
-                endpoints[token].update(data)
+                endpoint.client_token = client_token
+                endpoint.base_url = client_url
             else:
-                endpoints[token] = data
-            self.writeJson(endpoints)
+                endpoints[token] = EndpointRecord(client_token, client_url)
+            self._commit(endpoints, token)
+            self._invalidateTokens(token)
 
     def _setGroupIds(self, token, group_ids):
         with lock:
-            endpoints = self.readJson()
-            endpoints[token].update({"group_ids": group_ids})
-            self.writeJson(endpoints)
+            endpoints = self._load()
+            endpoints[token].group_ids = group_ids
+            self._commit(endpoints, token)
+            self._group_index.set(token, group_ids)
 
     def _setRequiredBehavior(self, token, required_behavior, new=True):
         with lock:
-            endpoints = self.readJson()
-            endpoints[token]["new"] = new
-            endpoints[token]["required_behavior"] = required_behavior
-            self.writeJson(endpoints)
+            endpoints = self._load()
+            endpoints[token].new = new
+            endpoints[token].required_behavior = required_behavior
+            self._commit(endpoints, token)
 
     def _removeService(self, token):
         with lock:
-            endpoints = self.readJson()
+            endpoints = self._load()
             endpoints.pop(token)
-            self.writeJson(endpoints)
+            self._commit(endpoints, token)
+            self._group_index.remove(token)
+            self._invalidateTokens(token)
 
-    def getEndpoints(self):
-        return self.readJson()
+    def _replaceToken(self, token_old, token_new, client_token, client_url, version):
+        with lock:
+            endpoints = self._load()
+            endpoints.pop(token_old)
+            endpoints[token_new] = EndpointRecord(client_token, client_url)
+            self._commit(endpoints, token_old, token_new)
+            self._group_index.remove(token_old)
+            self._group_index.remove(token_new)
+            self._invalidateTokens(token_old, token_new)
+
+    def getRecords(self):
+        return self._load()
+
+    def getRecord(self, token):
+        return self._load().get(token)
 
     def isRegistered(self, token):
         with lock:
-            endpoints = self.readJson()
+            endpoints = self._load()
         return token in endpoints
 
     def _setOfflineAt(self, token, offline_at):
         with lock:
-            endpoints = self.readJson()
-            endpoints[token]["offline_at"] = DtoS(offline_at)
-            self.writeJson(endpoints)
+            endpoints = self._load()
+            endpoints[token].offline_at = offline_at
+            # the background job does not touch offline_at,
+            # so the version is kept to not discard its changes
+            self._store(endpoints, token)
+
+    def _setOfflineAts(self, offline_ats):
+        with lock:
+            endpoints = self._load()
+            # unregistered in the meantime
+            tokens = [token for token in offline_ats if token in endpoints]
+            for token in tokens:
+                endpoints[token].offline_at = offline_ats[token]
+            if tokens:
+                self._store(endpoints, *tokens)
 
     def _token_by_group_id(self, group_id):
-        token = None
-        endpoints = self.readJson()
-        for t, v in endpoints.items():
-            if group_id in v["group_ids"]:
-                log.debug(f"Found token: {t} for group_id: {group_id}")
-                token = t
-        if token == None:
+        tokens = self._group_index.lookup(group_id)
+        if not tokens:
             log.error(f"No token found for group_id: {group_id}")
-        return token
+            return None
+        if len(tokens) > 1:
+            log.warning(f"{len(tokens)} tokens found for group_id: {group_id}")
+        log.debug(f"Found token: {tokens[0]} for group_id: {group_id}")
+        return tokens[0]
+
+    def tokens_by_group_ids(self, group_ids):
+        return {
+            group_id: set(self._group_index.lookup(group_id)) for group_id in group_ids
+        }
+
+    @scheduled_job
+    def _background_job(self, tokens=None):
+        # copy the due endpoints, so the lock is not held while sending
+        with lock:
+            endpoints = self._load()
+            if tokens is None:
+                tokens = list(endpoints)
+            due = {t: endpoints[t].copy() for t in tokens if t in endpoints}
+            versions = {t: self._versions.get(t) for t in due}
 
-    def _url_by_token(self, token) -> Tuple[str, str]:
-        endpoints = self.readJson()
-        base_url = endpoints[token]["register"]["base_url"]
-        token = endpoints[token]["register"]["token"]
-        return base_url, token
+        results = self._process_endpoints(due)
 
-    def _background_job(self):
         with lock:
+            endpoints = self._load()
+            changed = []
+            for endpoint_token, changes in results.items():
+                endpoint = endpoints.get(endpoint_token)
+                if endpoint is None:
+                    # removed in the meantime
+                    continue
+                if self._versions.get(endpoint_token) != versions[endpoint_token]:
+                    # modified in the meantime, the sent messages might be outdated
+                    changes = self._conflictingChanges(
+                        endpoint_token, due[endpoint_token], endpoint, changes
+                    )
+                if changes:
+                    endpoint.update(changes)
+                    changed.append(endpoint_token)
+            if changed:
+                self._commit(endpoints, *changed)
+            for endpoint_token in due:
+                if endpoint_token in endpoints:
+                    self._schedule_endpoint(endpoint_token, endpoints[endpoint_token])
+
+
+class RegistrationMemoryMan(RegistrationDictMan):
+    """
+    Registration manager which keeps the endpoints in memory.
+
+    The in-memory dict is the source of truth, so lookups do not touch the disk.
+    Changes are written to `filename` by a background thread every
+    `flush_interval` seconds, or as soon as `flush_threshold` changes are pending.
+    The file is replaced atomically, so it always contains a complete state.
+    The endpoints of the previous run are loaded from `filename`,
+    unless `reset` is True.
+    """
+
+    # the in-memory dict is only modified by this process
+    shared_registry = False
+
+    def __init__(
+        self,
+        version_urls,
+        filename="./endpoints.json",
+        flush_interval: float = 5,
+        flush_threshold: int = 100,
+        reset: bool = False,
+        **kwds,
+    ):
+        self.endpoints = {}
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._dirty = 0
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self.__stop_flush = False
+        super().__init__(version_urls, filename, reset=reset, **kwds)
+
+        self.flush_thread = threading.Thread(
+            target=self._flush_job, daemon=True, name="OSCP Flush"
+        )
+        self.flush_thread.start()
+        atexit.register(self.flush)
+
+    def writeJson(self, endpoints):
+        # write to a temporary file and rename it,
+        # so that a crash never leaves a truncated file behind
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(endpoints, f, indent=4, sort_keys=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+
+    def _initStorage(self):
+        super()._initStorage()
+        self.endpoints = self._readRecords()
+
+    def _load(self):
+        return self.endpoints
+
+    def _store(self, endpoints, *tokens):
+        self.endpoints = endpoints
+        self._dirty += 1
+        if self._dirty >= self.flush_threshold:
+            self._flush_event.set()
+
+    def getRecords(self):
+        with lock:
+            return {token: record.copy() for token, record in self.endpoints.items()}
+
+    def getRecord(self, token):
+        record = self.endpoints.get(token)
+        return record.copy() if record else None
+
+    def isRegistered(self, token):
+        return token in self.endpoints
+
+    def flush(self):
+        """
+        writes the endpoints to disk if there are unsaved changes
+        """
+        with self._flush_lock:
+            with lock:
+                if not self._dirty:
+                    return
+                self._dirty = 0
+                endpoints = _toJson(self.endpoints)
+            self.writeJson(endpoints)
+            log.debug(f"flushed {len(endpoints)} endpoints to {self.filename}")
+
+    def _flush_job(self):
+        while not self.__stop_flush:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception(f"flushing endpoints to {self.filename} failed")
+
+    def stop(self):
+        super().stop()
+        self.__stop_flush = True
+        self._flush_event.set()
+        self.flush()
+        # flushed now, so the instance does not have to be kept until exit
+        atexit.unregister(self.flush)
+
+
+class RegistrationJournalMan(RegistrationMemoryMan):
+    """
+    Registration manager which keeps the endpoints in memory and appends
+    every change as a compact record to a journal file.
+
+    A record contains the token and the complete new entry of the changed
+    endpoint (or null if it was removed), so replaying a record is idempotent.
+    At startup the registry is rebuilt from the snapshot in `filename` and the
+    journal, unless `reset` is True. Once `compact_threshold` records are
+    written, the background thread writes a new snapshot and starts an empty
+    journal. As the snapshot is only written when compacting, there is no
+    `flush_threshold`.
+    """
+
+    def __init__(
+        self,
+        version_urls,
+        filename="./endpoints.json",
+        flush_interval: float = 5,
+        compact_threshold: int = 1000,
+        **kwds,
+    ):
+        self.journal_filename = filename + ".journal"
+        self.compact_threshold = compact_threshold
+        self._journal_records = 0
+        super().__init__(version_urls, filename, flush_interval=flush_interval, **kwds)
+
+    def _initStorage(self):
+        if self.reset:
+            # every start begins with an empty registry
+            for filename in (
+                self.filename,
+                self.journal_filename,
+                self.journal_filename + ".old",
+            ):
+                if os.path.exists(filename):
+                    os.remove(filename)
+        endpoints = {}
+        if os.path.exists(self.filename):
             endpoints = self.readJson()
-            for endpoint_token, endpoint in endpoints.items():
+        # the rotated journal exists if compacting was interrupted
+        old_journal = self.journal_filename + ".old"
+        interrupted = os.path.exists(old_journal)
+        for filename in (old_journal, self.journal_filename):
+            if os.path.exists(filename):
+                self._journal_records += self._replay(endpoints, filename)
+        self.endpoints = {
+            token: EndpointRecord.from_dict(entry) for token, entry in endpoints.items()
+        }
+        self._group_index.rebuild(self.endpoints)
+        log.info(
+            f"loaded {len(endpoints)} endpoints from {self.filename} "
+            f"and {self._journal_records} journal records"
+        )
+        if interrupted:
+            # finish the compaction, the next one would overwrite the old journal
+            self.writeJson(_toJson(self.endpoints))
+            os.remove(old_journal)
+            self._journal = open(self.journal_filename, "w")
+            self._journal_records = 0
+        else:
+            self._journal = open(self.journal_filename, "a")
+
+    def _replay(self, endpoints: dict, filename: str) -> int:
+        records = 0
+        with open(filename, "r") as f:
+            for line in f:
                 try:
-                    base_url = endpoint["register"]["base_url"]
-                    if endpoint.get("new") == True:
-                        # send ack for new handshakes
-
-                        interval = endpoint["required_behavior"]["heartbeat_interval"]
-                        token = endpoint["register"]["token"]
-                        try:
-                            self._send_ack(base_url, interval, token)
-                            endpoint["new"] = False
-                        except requests.exceptions.ConnectionError:
-                            log.error(f"Connection failed: {base_url}")
-
-                    if endpoint.get("required_behavior") != None:
-                        nb = endpoint.get("next_heartbeat")
-                        if nb is None or (StoD(nb) < datetime.now()):
-                            # next heartbeat is due, send it
-
-                            interval = endpoint["required_behavior"][
-                                "heartbeat_interval"
-                            ]
-                            token = endpoint["register"]["token"]
-                            endpoint["next_heartbeat"] = DtoS(
-                                self._send_heartbeat(base_url, interval, token)
-                            )
-
-                    if endpoint.get("should_register") == True:
-                        client_token = endpoint["register"]["token"]
-                        try:
-                            self._send_register(base_url, endpoint_token, client_token)
-                            endpoint["should_register"] = False
-                            endpoint["new"] = True
-                        except requests.exceptions.ConnectionError:
-                            log.error(f"Connection failed: {base_url}")
-                        except Exception as e:
-                            log.exception(e)
-
-                    offline_at = endpoint.get("offline_at")
-                    if offline_at != None and StoD(offline_at) < datetime.now():
-                        log.warning(
-                            f"{base_url} endpoint is offline. No Heartbeat received before {offline_at}"
-                        )
-                except Exception:
-                    log.exception(f"OSCP background job failed for {base_url}")
+                    token, entry = json.loads(line)
+                except ValueError:
+                    # the last record might be incomplete after a crash
+                    log.warning(f"skipping invalid journal record in {filename}")
+                    continue
+                if entry is None:
+                    endpoints.pop(token, None)
+                else:
+                    endpoints[token] = entry
+                records += 1
+        return records
+
+    def _store(self, endpoints, *tokens):
+        self.endpoints = endpoints
+        for token in tokens:
+            endpoint = endpoints.get(token)
+            record = [token, endpoint.to_dict(iso=True) if endpoint else None]
+            self._journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._journal.flush()
+        self._journal_records += len(tokens)
+        if self._journal_records >= self.compact_threshold:
+            self._flush_event.set()
+
+    def flush(self):
+        if self._journal_records >= self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        """
+        writes a snapshot of the endpoints and truncates the journal
+        """
+        old_journal = self.journal_filename + ".old"
+        with self._flush_lock:
+            with lock:
+                if not self._journal_records:
+                    return
+                endpoints = _toJson(self.endpoints)
+                # records written from now on go to a new journal
+                self._journal.close()
+                os.replace(self.journal_filename, old_journal)
+                self._journal = open(self.journal_filename, "a")
+                self._journal_records = 0
             self.writeJson(endpoints)
+            os.remove(old_journal)
+            log.debug(f"compacted journal into {self.filename}")
+
+    def stop(self):
+        super().stop()
+        self.compact()
+        with lock:
+            self._journal.close()
+
+
+class RegistrationSQLiteMan(RegistrationMan):
+    """
+    Registration manager which stores the endpoints in a SQLite database.
+
+    The database runs in WAL mode, so that multiple processes can use the same
+    file while readers do not block the writer.
+    Every thread uses its own connection, whose statement cache keeps the
+    queries below prepared.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS endpoints (
+            token TEXT PRIMARY KEY,
+            client_token TEXT,
+            base_url TEXT,
+            oscp_version TEXT,
+            required_behavior TEXT,
+            new INTEGER,
+            should_register INTEGER,
+            next_heartbeat TEXT,
+            offline_at TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS group_ids (
+            group_id TEXT NOT NULL,
+            token TEXT NOT NULL
+                REFERENCES endpoints(token) ON DELETE CASCADE ON UPDATE CASCADE,
+            PRIMARY KEY (group_id, token)
+        );
+        CREATE INDEX IF NOT EXISTS group_ids_token ON group_ids(token);
+    """
+    SELECT_REGISTERED = "SELECT 1 FROM endpoints WHERE token = ?"
+    SELECT_URL = "SELECT base_url, client_token FROM endpoints WHERE token = ?"
+    SELECT_TOKEN_BY_GROUP = "SELECT token FROM group_ids WHERE group_id = ?"
+    SELECT_TOKENS_BY_GROUPS = (
+        "SELECT group_id, token FROM group_ids WHERE group_id IN ({})"
+    )
+    # stay below the default SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions
+    MAX_VARIABLES = 999
+    SELECT_ENDPOINTS = "SELECT * FROM endpoints"
+    SELECT_ENDPOINT = "SELECT * FROM endpoints WHERE token = ?"
+    SELECT_ENDPOINTS_BY_TOKENS = "SELECT * FROM endpoints WHERE token IN ({})"
+    SELECT_GROUP_IDS = "SELECT token, group_id FROM group_ids"
+    SELECT_VERSIONS = "SELECT token, version FROM endpoints"
+    SELECT_TOKEN_GROUPS = "SELECT group_id FROM group_ids WHERE token = ?"
+    UPSERT_SERVICE = """
+        INSERT INTO endpoints (token, client_token, base_url, oscp_version)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(token) DO UPDATE SET
+            client_token = excluded.client_token,
+            base_url = excluded.base_url,
+            oscp_version = excluded.oscp_version,
+            version = version + 1
+    """
+    UPDATE_REQUIRED_BEHAVIOR = """
+        UPDATE endpoints SET new = ?, required_behavior = ?, version = version + 1
+        WHERE token = ?
+    """
+    # the background job does not touch offline_at, so the version is kept
+    UPDATE_OFFLINE_AT = "UPDATE endpoints SET offline_at = ? WHERE token = ?"
+    # the background job only updates endpoints which were not modified
+    UPDATE_BACKGROUND = """
+        UPDATE endpoints SET new = ?, should_register = ?, next_heartbeat = ?
+        WHERE token = ? AND version = ?
+    """
+    UPDATE_NEXT_HEARTBEAT = """
+        UPDATE endpoints SET next_heartbeat = ? WHERE token = ? AND next_heartbeat IS ?
+    """
+    DELETE_SERVICE = "DELETE FROM endpoints WHERE token = ?"
+    DELETE_GROUP_IDS = "DELETE FROM group_ids WHERE token = ?"
+    INSERT_GROUP_ID = "INSERT OR IGNORE INTO group_ids (group_id, token) VALUES (?, ?)"
+
+    def __init__(
+        self, version_urls, filename="./endpoints.db", timeout: float = 5, **kwds
+    ):
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+        # last seen state of the database for _changedTokens
+        self._data_version = None
+        self._seen_versions: Dict[str, int] = {}
+        # the manager is usually created before the workers are forked,
+        # so no connection is kept open here
+        con = self._connect()
+        try:
+            con.executescript(self.SCHEMA)
+        finally:
+            con.close()
+        super().__init__(version_urls, **kwds)
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode, transactions are started explicitly
+        con = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA foreign_keys=ON")
+        return con
+
+    def _connection(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        # a connection must not be used after fork(), the child opens its own
+        if con is None or self._local.pid != os.getpid():
+            con = self._local.con = self._connect()
+            self._local.pid = os.getpid()
+        return con
+
+    def _transaction(self):
+        con = self._connection()
+        con.execute("BEGIN IMMEDIATE")
+        return con
+
+    def _endpoint_from_row(self, row: sqlite3.Row) -> EndpointRecord:
+        required_behavior = row["required_behavior"]
+        return EndpointRecord(
+            row["client_token"],
+            row["base_url"],
+            json.loads(required_behavior) if required_behavior is not None else None,
+            None,
+            bool(row["new"]) if row["new"] is not None else None,
+            (
+                bool(row["should_register"])
+                if row["should_register"] is not None
+                else None
+            ),
+            toEpoch(row["next_heartbeat"]),
+            toEpoch(row["offline_at"]),
+        )
+
+    def getRecords(self):
+        con = self._connection()
+        # both queries read the same snapshot, even if other processes write
+        con.execute("BEGIN")
+        try:
+            endpoints = {
+                row["token"]: self._endpoint_from_row(row)
+                for row in con.execute(self.SELECT_ENDPOINTS)
+            }
+            group_rows = con.execute(self.SELECT_GROUP_IDS).fetchall()
+        finally:
+            con.execute("COMMIT")
+        for token, group_id in group_rows:
+            endpoint = endpoints[token]
+            if endpoint.group_ids is None:
+                endpoint.group_ids = []
+            endpoint.group_ids.append(group_id)
+        return endpoints
+
+    def getRecord(self, token):
+        con = self._connection()
+        row = con.execute(self.SELECT_ENDPOINT, (token,)).fetchone()
+        if row is None:
+            return None
+        endpoint = self._endpoint_from_row(row)
+        group_ids = [
+            group_id for (group_id,) in con.execute(self.SELECT_TOKEN_GROUPS, (token,))
+        ]
+        if group_ids:
+            endpoint.group_ids = group_ids
+        return endpoint
+
+    def isRegistered(self, token):
+        cur = self._connection().execute(self.SELECT_REGISTERED, (token,))
+        return cur.fetchone() is not None
+
+    def _isAuthorized(self, token):
+        return self.isRegistered(token)
+
+    def _updateService(self, token, client_token=None, client_url=None, version=None):
+        self._connection().execute(
+            self.UPSERT_SERVICE, (token, client_token, client_url, version)
+        )
+        self._invalidateTokens(token)
+
+    def _setGroupIds(self, token, group_ids):
+        con = self._transaction()
+        try:
+            if not con.execute(self.SELECT_REGISTERED, (token,)).fetchone():
+                raise KeyError(token)
+            con.execute(self.DELETE_GROUP_IDS, (token,))
+            con.executemany(
+                self.INSERT_GROUP_ID, [(group_id, token) for group_id in group_ids]
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def _setRequiredBehavior(self, token, required_behavior, new=True):
+        cur = self._connection().execute(
+            self.UPDATE_REQUIRED_BEHAVIOR,
+            (new, json.dumps(required_behavior), token),
+        )
+        if cur.rowcount == 0:
+            raise KeyError(token)
+
+    def _removeService(self, token):
+        # group_ids are removed by the foreign key
+        cur = self._connection().execute(self.DELETE_SERVICE, (token,))
+        self._invalidateTokens(token)
+        if cur.rowcount == 0:
+            raise KeyError(token)
+
+    def _replaceToken(self, token_old, token_new, client_token, client_url, version):
+        con = self._transaction()
+        try:
+            if con.execute(self.DELETE_SERVICE, (token_old,)).rowcount == 0:
+                raise KeyError(token_old)
+            con.execute(
+                self.UPSERT_SERVICE, (token_new, client_token, client_url, version)
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        self._invalidateTokens(token_old, token_new)
+
+    def _setOfflineAt(self, token, offline_at):
+        cur = self._connection().execute(
+            self.UPDATE_OFFLINE_AT, (_toIso(offline_at), token)
+        )
+        if cur.rowcount == 0:
+            raise KeyError(token)
+
+    def _changedTokens(self):
+        con = self._connection()
+        # only changes if another connection committed
+        (data_version,) = con.execute("PRAGMA data_version").fetchone()
+        if data_version == self._data_version:
+            return []
+        self._data_version = data_version
+        versions = dict(con.execute(self.SELECT_VERSIONS).fetchall())
+        changed = [
+            token
+            for token, version in versions.items()
+            if self._seen_versions.get(token) != version
+        ]
+        self._seen_versions = versions
+        return changed
+
+    def _token_by_group_id(self, group_id):
+        rows = (
+            self._connection()
+            .execute(self.SELECT_TOKEN_BY_GROUP, (group_id,))
+            .fetchall()
+        )
+        if not rows:
+            log.error(f"No token found for group_id: {group_id}")
+            return None
+        if len(rows) > 1:
+            log.warning(f"{len(rows)} tokens found for group_id: {group_id}")
+        log.debug(f"Found token: {rows[0][0]} for group_id: {group_id}")
+        return rows[0][0]
+
+    def tokens_by_group_ids(self, group_ids):
+        group_ids = list(dict.fromkeys(group_ids))
+        result = {group_id: set() for group_id in group_ids}
+        con = self._connection()
+        for i in range(0, len(group_ids), self.MAX_VARIABLES):
+            chunk = group_ids[i : i + self.MAX_VARIABLES]
+            query = self.SELECT_TOKENS_BY_GROUPS.format(", ".join("?" * len(chunk)))
+            for group_id, token in con.execute(query, chunk):
+                result[group_id].add(token)
+        return result
+
+    def _url_by_token(self, token) -> Tuple[str, str]:
+        row = self._connection().execute(self.SELECT_URL, (token,)).fetchone()
+        if row is None:
+            raise KeyError(token)
+        return row["base_url"], row["client_token"]
+
+    def _rows_by_tokens(self, tokens: List[str] = None) -> Dict[str, sqlite3.Row]:
+        con = self._connection()
+        if tokens is None:
+            return {row["token"]: row for row in con.execute(self.SELECT_ENDPOINTS)}
+        rows = {}
+        for i in range(0, len(tokens), self.MAX_VARIABLES):
+            chunk = tokens[i : i + self.MAX_VARIABLES]
+            query = self.SELECT_ENDPOINTS_BY_TOKENS.format(", ".join("?" * len(chunk)))
+            for row in con.execute(query, chunk):
+                rows[row["token"]] = row
+        return rows
+
+    @scheduled_job
+    def _background_job(self, tokens=None):
+        con = self._connection()
+        rows = self._rows_by_tokens(None if tokens is None else list(tokens))
+        endpoints = {token: self._endpoint_from_row(row) for token, row in rows.items()}
+        results = self._process_endpoints(endpoints)
+        for endpoint_token, changes in results.items():
+            snapshot = endpoints[endpoint_token]
+            endpoint = snapshot.copy()
+            endpoint.update(changes)
+            if changes:
+                cur = con.execute(
+                    self.UPDATE_BACKGROUND,
+                    (
+                        endpoint.new,
+                        endpoint.should_register,
+                        _toIso(endpoint.next_heartbeat),
+                        endpoint_token,
+                        rows[endpoint_token]["version"],
+                    ),
+                )
+                if cur.rowcount == 0:
+                    # modified in the meantime, the sent messages might be outdated
+                    if "next_heartbeat" in changes:
+                        con.execute(
+                            self.UPDATE_NEXT_HEARTBEAT,
+                            (
+                                _toIso(changes["next_heartbeat"]),
+                                endpoint_token,
+                                rows[endpoint_token]["next_heartbeat"],
+                            ),
+                        )
+                    self.scheduler.schedule(endpoint_token)
+                    continue
+            self._schedule_endpoint(endpoint_token, endpoint)
@@ -19,9 +19,13 @@ from oscp.epc_endpoints import addForPriceCalculation
 
 # from oscp.forecasts import forecast_ns
 from oscp.fp_endpoints import flex_provider_ns
+from oscp.serialization import ResponseSerializer
+from oscp.validation import compileValidators
 
 
-def createBlueprint(injected_objects, actor):
+def createBlueprint(
+    injected_objects, actor, fast_validation=False, response_encoding=None
+):
     """
     Creates API blueprint with injected Objects.
     Must contain a forecastmanager and others...
@@ -30,6 +34,9 @@ def createBlueprint(injected_objects, actor):
     ----------
     :param injected_objects: Providing endpoint managers
     :param actors: 'cp', 'fp', 'co' for Capacity Provider, Flexibility Provider and Capacity Optimizer
+    :param fast_validation: validate payloads with checks compiled from the models instead of jsonschema
+    :param response_encoding: None, 'compat' or 'fast', marshal responses with prebuilt serializers,
+        'compat' keeps the output identical, 'fast' encodes it with orjson if installed
 
     Returns
     -------
@@ -54,6 +61,10 @@ def createBlueprint(injected_objects, actor):
         default_label="Python OSCP Framework",
     )
 
+    if response_encoding is not None:
+        serializer = ResponseSerializer(response_encoding)
+        injected_objects = dict(injected_objects, serializer=serializer)
+
     # inject objects through class kwargs
     # (small hack, must be done for new namespaces too)
 
@@ -82,4 +93,9 @@ def createBlueprint(injected_objects, actor):
         addForPriceCalculation(flex_provider_ns)
         addInjected(flex_provider_ns)
 
+    if fast_validation:
+        compileValidators(api)
+    if response_encoding is not None:
+        serializer.install(api)
+
     return blueprint
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+import requests
+
+from oscp.client import OscpClient
+from oscp.correlation import FORECAST_PATHS
+from oscp.segmentation import segment_headers, split_message
+
+log = logging.getLogger("oscp")
+
+
+@dataclass
+class SendResult:
+    """
+    Result of a message sent to a single peer
+    """
+
+    # token used by the peer to access this api
+    token: Optional[str]
+    request_id: str
+    status_code: Optional[int] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class AsyncOscpClient(object):
+    """
+    asyncio API to send OSCP messages to the registered peers.
+
+    The peer url and token are resolved through the RegistrationMan, the
+    messages are sent over the pooled sessions of the OscpClient in a thread
+    pool, so at most `max_concurrency` messages are in flight at the same time.
+
+    Messages with more than `segment_size` forecasted blocks or measurements
+    are split into segments, which are sent one after another with the same
+    X-Segment-ID.
+    """
+
+    def __init__(
+        self,
+        registrationmanager,
+        client: OscpClient = None,
+        max_concurrency: int = 32,
+        segment_size: int = 500,
+    ):
+        self.registrationmanager = registrationmanager
+        self.client = client or registrationmanager.client
+        self.max_concurrency = max_concurrency
+        self.segment_size = segment_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="OSCP Async"
+        )
+
+    def _send(
+        self,
+        path: str,
+        data: dict,
+        token: str = None,
+        group_id: str = None,
+        correlation: str = None,
+    ) -> SendResult:
+        request_id = secrets.token_urlsafe(8)
+        if token is None and group_id is not None:
+            token = self.registrationmanager._token_by_group_id(group_id)
+        result = SendResult(token, request_id)
+        base_url, client_token = self.registrationmanager.getURL(token=token)
+        if base_url is None:
+            result.error = KeyError(f"no peer found for token {token}")
+            return result
+        segments = split_message(data, self.segment_size) if data else [data]
+        correlations = getattr(self.registrationmanager, "correlations", None)
+        if correlations is not None and path in FORECAST_PATHS:
+            # recorded before sending, the answer may arrive at any time
+            summary = correlations.record(request_id, data, token)
+        else:
+            correlations = None
+        try:
+            for index, segment in enumerate(segments, 1):
+                # the result contains the X-Request-ID of the first segment
+                segment_id = request_id if index == 1 else secrets.token_urlsafe(8)
+                if correlations is not None and index > 1:
+                    # peers may refer to any segment of the forecast
+                    correlations.add(summary, segment_id)
+                headers = {"X-Request-ID": segment_id}
+                if len(segments) > 1:
+                    # the segments are reassembled by the X-Request-ID of the first
+                    headers.update(segment_headers(index, len(segments), request_id))
+                response = self.client.post(
+                    base_url, path, client_token, segment, correlation, headers=headers
+                )
+                result.status_code = response.status_code
+        except requests.exceptions.RequestException as e:
+            if e.response is not None:
+                result.status_code = e.response.status_code
+            result.error = e
+            log.warning(f"sending {path} to {base_url} failed: {e}")
+        return result
+
+    async def send(
+        self,
+        path: str,
+        data: dict,
+        token: str = None,
+        group_id: str = None,
+        correlation: str = None,
+    ) -> SendResult:
+        """
+        sends data to the path of the peer with the given token
+        or the peer serving the given group_id.
+
+        Parameters
+        ----------
+        path : str
+            path of the OSCP message below the base_url, e.g. /heartbeat
+        data : dict
+            the payload of the message
+        token : str, optional
+            token which is used by the peer to access this api
+        group_id : str, optional
+            used to find the peer if no token is given
+        correlation : str, optional
+            X-Request-ID of the message this message refers to
+
+        Returns
+        -------
+        SendResult
+            contains the X-Request-ID of the sent message and the error if it failed
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._send, path, data, token, group_id, correlation
+        )
+
+    async def send_many(
+        self, path: str, messages: Iterable[Tuple[str, dict]], correlation: str = None
+    ) -> List[SendResult]:
+        """
+        sends the same message type to many peers concurrently.
+
+        messages is an iterable of (token, data) tuples,
+        returns the results in the same order.
+        """
+        return await asyncio.gather(
+            *(
+                self.send(path, data, token, None, correlation)
+                for token, data in messages
+            )
+        )
+
+    async def update_group_capacity_forecast(
+        self, forecast: dict, token: str = None, correlation: str = None
+    ) -> SendResult:
+        return await self.send(
+            "/update_group_capacity_forecast",
+            forecast,
+            token,
+            forecast.get("group_id"),
+            correlation,
+        )
+
+    async def update_group_capacity_forecasts(
+        self, forecasts: Iterable[dict]
+    ) -> List[SendResult]:
+        """
+        sends each forecast to all peers serving its group_id.
+        The tokens of all groups are resolved with a single lookup.
+        """
+        forecasts = list(forecasts)
+        tokens = self.registrationmanager.tokens_by_group_ids(
+            {forecast["group_id"] for forecast in forecasts}
+        )
+        messages = []
+        for forecast in forecasts:
+            group_tokens = tokens[forecast["group_id"]]
+            if not group_tokens:
+                log.error(f"No token found for group_id: {forecast['group_id']}")
+            messages.extend((token, forecast) for token in group_tokens)
+        return await self.send_many("/update_group_capacity_forecast", messages)
+
+    async def update_group_measurements(
+        self, measurements: dict, token: str = None, correlation: str = None
+    ) -> SendResult:
+        return await self.send(
+            "/update_group_measurements",
+            measurements,
+            token,
+            measurements.get("group_id"),
+            correlation,
+        )
+
+    async def adjust_group_capacity_forecast(
+        self, forecast: dict, token: str = None, correlation: str = None
+    ) -> SendResult:
+        return await self.send(
+            "/adjust_group_capacity_forecast",
+            forecast,
+            token,
+            forecast.get("group_id"),
+            correlation,
+        )
+
+    async def group_capacity_compliance_error(
+        self, error: dict, token: str, correlation: str = None
+    ) -> SendResult:
+        return await self.send(
+            "/group_capacity_compliance_error", error, token, None, correlation
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
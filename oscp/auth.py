@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenCache(object):
+    """
+    Bounded cache of authentication results.
+
+    Tokens are not stored, the cache is keyed by a HMAC-SHA256 of the token
+    with a random per-process key. Looking up an unknown token therefore
+    takes the same time no matter how much it shares with a valid token.
+
+    Registered tokens are kept for `ttl` seconds. Tokens removed or replaced
+    by another process are therefore still accepted for up to `ttl` seconds,
+    a `ttl` of 0 disables caching registered tokens.
+    Unknown tokens are kept for `negative_ttl` seconds, so repeated requests
+    with invalid tokens do not hit the storage.
+    Both are limited to `maxsize` entries, the least recently used are evicted.
+    Changes made by this process are applied at once with `invalidate`.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30, negative_ttl: float = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._key = secrets.token_bytes(32)
+        self._positive = OrderedDict()
+        self._negative = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, token: str) -> bytes:
+        return hmac.new(self._key, token.encode(), hashlib.sha256).digest()
+
+    def get(self, token: str) -> Optional[bool]:
+        """
+        returns if the token is registered or None if the result is unknown
+        """
+        digest = self._digest(token)
+        now = time.monotonic()
+        with self._lock:
+            for entries, registered in (
+                (self._positive, True),
+                (self._negative, False),
+            ):
+                expires = entries.get(digest)
+                if expires is None:
+                    continue
+                if expires < now:
+                    del entries[digest]
+                    return None
+                entries.move_to_end(digest)
+                return registered
+        return None
+
+    def put(self, token: str, registered: bool):
+        digest = self._digest(token)
+        if registered:
+            entries, ttl = self._positive, self.ttl
+        else:
+            entries, ttl = self._negative, self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            entries[digest] = time.monotonic() + ttl
+            entries.move_to_end(digest)
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+    def invalidate(self, *tokens: str):
+        digests = [self._digest(token) for token in tokens if token is not None]
+        with self._lock:
+            for digest in digests:
+                self._positive.pop(digest, None)
+                self._negative.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._positive.clear()
+            self._negative.clear()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import logging
+import secrets
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from oscp.health import PeerHealth, PeerUnavailable
+
+log = logging.getLogger("oscp")
+
+
+def createOscpHeader(token: str, correlation: str = None):
+    """
+    creates the http header to authenticate with the other participant
+
+    token must be provided, optional correlation ID can be given,
+    if the message refers to a previous message sent
+    """
+    if not token:
+        raise Exception("token must be provided")
+    headers = {
+        "Authorization": "Token " + token,
+        "X-Request-ID": secrets.token_urlsafe(8),
+    }
+    if correlation:
+        headers["X-Correlation-ID"] = correlation
+    return headers
+
+
+class OscpClient(object):
+    """
+    Sends OSCP messages to other participants.
+
+    One requests.Session is kept per base_url, so connections to long-lived
+    peers are kept alive and reused between messages.
+    Failed connections and 503 responses are retried with an exponential
+    backoff. Read errors, 502 and 504 responses are not retried, as the
+    peer might already have processed the message.
+    The outcome of every message is recorded in the circuit breaker of the
+    peer, messages to peers with an open breaker fail with PeerUnavailable
+    without touching the network.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10,
+        retries: int = 2,
+        backoff_factor: float = 0.5,
+        pool_maxsize: int = 10,
+        health: PeerHealth = None,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.health = health or PeerHealth()
+        self.retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            # a gateway error might come after the peer processed the message
+            status_forcelist=(503,),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, base_url: str) -> requests.Session:
+        """
+        returns the session used for the peer with the given base_url
+        """
+        session = self._sessions.get(base_url)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(base_url)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        max_retries=self.retry,
+                        pool_connections=1,
+                        pool_maxsize=self.pool_maxsize,
+                    )
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._sessions[base_url] = session
+        return session
+
+    def post(
+        self,
+        base_url: str,
+        path: str,
+        token: str,
+        data: dict = None,
+        correlation: str = None,
+        headers: dict = None,
+    ) -> requests.Response:
+        """
+        sends data to the path below the base_url of the peer
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            if the connection fails or the peer does not answer with a 2xx status
+        PeerUnavailable
+            if the circuit breaker of the peer is open
+        """
+        oscp_headers = createOscpHeader(token, correlation)
+        if headers:
+            oscp_headers.update(headers)
+        if not self.health.acquire(base_url):
+            raise PeerUnavailable(f"circuit breaker of {base_url} is open")
+        try:
+            response = self.session(base_url).post(
+                base_url + path, headers=oscp_headers, json=data, timeout=self.timeout
+            )
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            # the peer answered, only server errors count as failure
+            if e.response.status_code >= 500:
+                self.health.failure(base_url)
+            else:
+                self.health.success(base_url)
+            raise
+        except Exception:
+            self.health.failure(base_url)
+            raise
+        self.health.success(base_url)
+        return response
+
+    def close(self, base_url: str = None):
+        """
+        closes the connections to the given peer or to all peers
+        """
+        with self._lock:
+            if base_url is None:
+                sessions = list(self._sessions.values())
+                self._sessions.clear()
+            else:
+                sessions = [self._sessions.pop(base_url)] if base_url in self else []
+        for session in sessions:
+            session.close()
+
+    def __contains__(self, base_url: str):
+        return base_url in self._sessions
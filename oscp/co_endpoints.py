@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from flask_restx import Namespace, Resource  # ,add_models_to__namespace
 
+from oscp.dedup import idempotent
+from oscp.dispatch import dispatch
 from oscp.json_models import (
     ForecastedBlock,
     GroupCapacityForecast,
@@ -29,20 +31,27 @@ class updateGroupCapacityForecast(Resource):
     def __init__(self, api=None, *args, **kwargs):
         self.capacityoptimizer = kwargs["capacityoptimizer"]
         self.registrationmanager = kwargs["registrationmanager"]
+        self.dispatcher = kwargs.get("dispatcher")
         super().__init__(api, *args, **kwargs)
 
     @cap_optimizer_ns.expect(GroupCapacityForecast)
+    @idempotent
     # @forecast_ns.response(204, 'No Content')
     def post(self):
         """
         The message is sent from Capacity Provider to the Flexibility Provider and from Flexibility Provider to Capacity Optimizer which
         should generate an Optimum capacity forecast for the capacity that should be used in the specific group.
         """
-
-        self.capacityoptimizer.handleUpdateGroupCapacityForecast(
-            cap_optimizer_ns.payload
+        token = self.registrationmanager._check_access_token()
+        payload = self.registrationmanager.reassemble(cap_optimizer_ns.payload, token)
+        if payload is None:
+            # waiting for the other segments
+            return "", 204
+        return dispatch(
+            self.dispatcher,
+            self.capacityoptimizer.handleUpdateGroupCapacityForecast,
+            payload,
         )
-        return "", 204
 
 
 @cap_optimizer_ns.route(
@@ -55,10 +64,19 @@ class updateAssetMeasurements(Resource):
     def __init__(self, api=None, *args, **kwargs):
         self.capacityoptimizer = kwargs["capacityoptimizer"]
         self.registrationmanager = kwargs["registrationmanager"]
+        self.dispatcher = kwargs.get("dispatcher")
         super().__init__(api, *args, **kwargs)
 
     @cap_optimizer_ns.expect(GroupCapacityForecast)
+    @idempotent
     def post(self):
-        self.registrationmanager._check_access_token()
-        self.capacityoptimizer.handleUpdateAssetMeasurements(cap_optimizer_ns.payload)
-        return "", 204
+        token = self.registrationmanager._check_access_token()
+        payload = self.registrationmanager.reassemble(cap_optimizer_ns.payload, token)
+        if payload is None:
+            # waiting for the other segments
+            return "", 204
+        return dispatch(
+            self.dispatcher,
+            self.capacityoptimizer.handleUpdateAssetMeasurements,
+            payload,
+        )
@@ -0,0 +1,327 @@
+"""
+Columnar view of forecasts and measurements for vectorized processing.
+
+Requires numpy, which can be installed with `pip install pyoscp[numpy]`.
+
+    forecast = ColumnarForecast.from_payload(payload)
+    mask = forecast.blocks.unit == UNITS.index("KW")
+    total = forecast.blocks.capacity[mask].sum()
+    payload = forecast.to_payload()
+"""
+
+from __future__ import annotations
+
+import warnings
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence
+
+from dateutil import parser
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from oscp.ep_models import ext_forecasted_block_unit
+from oscp.json_models import (
+    energy_flow_direction,
+    energy_type,
+    instantaneous_measurement_unit,
+    phase_indicator,
+)
+
+# categories of the code arrays, missing values have the code -1
+PHASES = tuple(phase_indicator)
+UNITS = tuple(
+    dict.fromkeys(list(ext_forecasted_block_unit) + instantaneous_measurement_unit)
+)
+ENERGY_TYPES = tuple(energy_type)
+DIRECTIONS = tuple(energy_flow_direction)
+
+MISSING = -1
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(
+            "numpy is required for the columnar view, install pyoscp[numpy]"
+        )
+
+
+def encode(values: Sequence[Optional[str]], categories: Sequence[str]) -> np.ndarray:
+    """
+    returns the index of each value in categories as int8 array, -1 for None
+
+    Raises
+    ------
+    ValueError
+        if a value is not one of the categories
+    """
+    index = {category: code for code, category in enumerate(categories)}
+    index[None] = MISSING
+    try:
+        return np.array([index[value] for value in values], dtype=np.int8)
+    except KeyError as e:
+        raise ValueError(f"unknown value {e.args[0]!r}, expected one of {categories}")
+
+
+def decode(codes: np.ndarray, categories: Sequence[str]) -> List[Optional[str]]:
+    """
+    reverse of encode
+    """
+    return [categories[code] if code != MISSING else None for code in codes.tolist()]
+
+
+def _parse_slow(value: Optional[str]) -> np.datetime64:
+    if value is None:
+        return np.datetime64("NaT", "ms")
+    if value.endswith(("Z", "z")):
+        # fromisoformat only accepts the UTC designator since Python 3.11
+        value = value[:-1] + "+00:00"
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        # e.g. fractions other than 3 or 6 digits before Python 3.11
+        date = parser.isoparse(value)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(date, "ms")
+
+
+def parse_times(values: Sequence[Optional[str]]) -> np.ndarray:
+    """
+    parses ISO 8601 strings into a datetime64[ms] array, None becomes NaT.
+    Times with a timezone are converted to UTC, naive times are kept as they are,
+    utc_mask tells them apart.
+    """
+    try:
+        with warnings.catch_warnings():
+            # numpy only warns about timezones
+            warnings.simplefilter("error", DeprecationWarning)
+            warnings.simplefilter("error", UserWarning)
+            return np.array(values, dtype="datetime64[ms]")
+    except (ValueError, DeprecationWarning, UserWarning):
+        return np.array(
+            [_parse_slow(value) for value in values], dtype="datetime64[ms]"
+        )
+
+
+def _has_timezone(value: Optional[str]) -> bool:
+    if value is None:
+        return False
+    # the date has dashes as well, offsets only appear after it
+    tail = value[10:]
+    return tail.endswith(("Z", "z")) or "+" in tail or "-" in tail
+
+
+def utc_mask(values: Sequence[Optional[str]]) -> np.ndarray:
+    """
+    returns a bool array which is True for the ISO 8601 strings with a timezone,
+    which parse_times converts to UTC
+    """
+    return np.array([_has_timezone(value) for value in values], dtype=bool)
+
+
+def format_times(times: np.ndarray, utc: np.ndarray = None) -> List[Optional[str]]:
+    """
+    formats a datetime64 array as ISO 8601 strings, NaT becomes None.
+    Milliseconds are only written for the times which have them.
+    Times for which `utc` is True are written with the UTC designator Z,
+    the others as naive times.
+    """
+    strings = np.datetime_as_string(times.astype("datetime64[ms]"), unit="ms")
+    valid = ~np.isnat(times)
+    if utc is None:
+        utc = np.zeros(len(times), dtype=bool)
+    formatted = []
+    for string, ok, z in zip(strings.tolist(), valid.tolist(), utc.tolist()):
+        if not ok:
+            formatted.append(None)
+            continue
+        if string.endswith(".000"):
+            string = string[:-4]
+        formatted.append(string + "Z" if z else string)
+    return formatted
+
+
+def _floats(values: Sequence[Optional[float]]) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _set(item: dict, key: str, value):
+    if value is not None:
+        item[key] = value
+
+
+@dataclass
+class BlockColumns:
+    """
+    forecasted_blocks as columns, capacity is NaN if missing.
+    start_utc and end_utc mark the times which were given with a timezone.
+    """
+
+    start: np.ndarray
+    end: np.ndarray
+    capacity: np.ndarray
+    phase: np.ndarray
+    unit: np.ndarray
+    start_utc: Optional[np.ndarray] = None
+    end_utc: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_blocks(cls, blocks: List[dict]) -> BlockColumns:
+        _require_numpy()
+        start = [b.get("start_time") for b in blocks]
+        end = [b.get("end_time") for b in blocks]
+        return cls(
+            parse_times(start),
+            parse_times(end),
+            _floats([b.get("capacity") for b in blocks]),
+            encode([b.get("phase") for b in blocks], PHASES),
+            encode([b.get("unit") for b in blocks], UNITS),
+            utc_mask(start),
+            utc_mask(end),
+        )
+
+    def to_blocks(self) -> List[dict]:
+        blocks = []
+        for capacity, phase, unit, start, end in zip(
+            self.capacity.tolist(),
+            decode(self.phase, PHASES),
+            decode(self.unit, UNITS),
+            format_times(self.start, self.start_utc),
+            format_times(self.end, self.end_utc),
+        ):
+            block = {}
+            _set(block, "capacity", None if capacity != capacity else capacity)
+            _set(block, "phase", phase)
+            _set(block, "unit", unit)
+            _set(block, "start_time", start)
+            _set(block, "end_time", end)
+            blocks.append(block)
+        return blocks
+
+    def __len__(self):
+        return len(self.capacity)
+
+
+@dataclass
+class ColumnarForecast:
+    """
+    GroupCapacityForecast, GroupCapacityPrice or GroupCapacityComplianceError
+    with the forecasted_blocks as columns
+    """
+
+    blocks: BlockColumns
+    group_id: Optional[str] = None
+    type: Optional[str] = None
+    message: Optional[str] = None
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> ColumnarForecast:
+        return cls(
+            BlockColumns.from_blocks(payload.get("forecasted_blocks") or []),
+            payload.get("group_id"),
+            payload.get("type"),
+            payload.get("message"),
+        )
+
+    def to_payload(self) -> dict:
+        payload = {}
+        _set(payload, "group_id", self.group_id)
+        _set(payload, "type", self.type)
+        _set(payload, "message", self.message)
+        payload["forecasted_blocks"] = self.blocks.to_blocks()
+        return payload
+
+
+@dataclass
+class MeasurementColumns:
+    """
+    EnergyMeasurements as columns, value is NaN if missing.
+    measure_time_utc and initial_measure_time_utc mark the times which were
+    given with a timezone.
+    """
+
+    value: np.ndarray
+    phase: np.ndarray
+    unit: np.ndarray
+    energy_type: np.ndarray
+    direction: np.ndarray
+    measure_time: np.ndarray
+    initial_measure_time: np.ndarray
+    measure_time_utc: Optional[np.ndarray] = None
+    initial_measure_time_utc: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_measurements(cls, measurements: List[dict]) -> MeasurementColumns:
+        _require_numpy()
+        measure_time = [m.get("measure_time") for m in measurements]
+        initial_measure_time = [m.get("initial_measure_time") for m in measurements]
+        return cls(
+            _floats([m.get("value") for m in measurements]),
+            encode([m.get("phase") for m in measurements], PHASES),
+            encode([m.get("unit") for m in measurements], UNITS),
+            encode([m.get("energy_type") for m in measurements], ENERGY_TYPES),
+            encode([m.get("direction") for m in measurements], DIRECTIONS),
+            parse_times(measure_time),
+            parse_times(initial_measure_time),
+            utc_mask(measure_time),
+            utc_mask(initial_measure_time),
+        )
+
+    def to_measurements(self) -> List[dict]:
+        measurements = []
+        for values in zip(
+            self.value.tolist(),
+            decode(self.phase, PHASES),
+            decode(self.unit, UNITS),
+            decode(self.energy_type, ENERGY_TYPES),
+            decode(self.direction, DIRECTIONS),
+            format_times(self.measure_time, self.measure_time_utc),
+            format_times(self.initial_measure_time, self.initial_measure_time_utc),
+        ):
+            value, *rest = values
+            measurement = {}
+            _set(measurement, "value", None if value != value else value)
+            for key, item in zip(
+                (
+                    "phase",
+                    "unit",
+                    "energy_type",
+                    "direction",
+                    "measure_time",
+                    "initial_measure_time",
+                ),
+                rest,
+            ):
+                _set(measurement, key, item)
+            measurements.append(measurement)
+        return measurements
+
+    def __len__(self):
+        return len(self.value)
+
+
+@dataclass
+class ColumnarMeasurements:
+    """
+    UpdateGroupMeasurements with the measurements as columns
+    """
+
+    measurements: MeasurementColumns
+    group_id: Optional[str] = None
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> ColumnarMeasurements:
+        return cls(
+            MeasurementColumns.from_measurements(payload.get("measurements") or []),
+            payload.get("group_id"),
+        )
+
+    def to_payload(self) -> dict:
+        payload = {}
+        _set(payload, "group_id", self.group_id)
+        payload["measurements"] = self.measurements.to_measurements()
+        return payload
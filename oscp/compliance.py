@@ -0,0 +1,394 @@
+"""
+Compliance of measured groups with their capacity forecasts.
+
+Requires numpy, which can be installed with `pip install pyoscp[numpy]`.
+
+    checker = ComplianceChecker()
+    checker.update_forecast(forecast, token)
+    for report in checker.check(measurements):
+        log.warning(f"{report.group_id} exceeds {len(report.blocks())} blocks")
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from oscp.columnar import (
+    DIRECTIONS,
+    ENERGY_TYPES,
+    MISSING,
+    PHASES,
+    BlockColumns,
+    MeasurementColumns,
+)
+from oscp.correlation import CorrelationStore
+from oscp.units import SINGLE_PHASES, UnitConverter, durations
+
+log = logging.getLogger("oscp")
+
+# sign of the measured energy per direction for the forecast types which
+# limit the measured power, measurements without direction are imports
+LIMITS = {
+    "CONSUMPTION": {"IMPORT": 1, "NET": 1, None: 1},
+    "GENERATION": {"EXPORT": 1, "NET": -1},
+    "FALLBACK_CONSUMPTION": {"IMPORT": 1, "NET": 1, None: 1},
+    "FALLBACK_GENERATION": {"EXPORT": 1, "NET": -1},
+}
+
+# blocks and measurements of all other phases are compared as ALL
+ALL = PHASES.index("ALL")
+
+
+def _table(values: Dict[str, object], categories: Sequence[str], default):
+    # the last entry is looked up by missing codes
+    return np.array([values.get(c, default) for c in categories] + [default])
+
+
+def _lookup(table: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    return table[np.where(codes == MISSING, len(table) - 1, codes)]
+
+
+def _phase_keys(phases: np.ndarray) -> np.ndarray:
+    single = np.isin(phases, [PHASES.index(p) for p in SINGLE_PHASES])
+    return np.where(single, phases, ALL).astype(np.int8)
+
+
+class _Limits(object):
+    """
+    The active forecast of a group and type as sorted interval arrays per phase.
+    """
+
+    __slots__ = ("blocks", "token", "request_id", "updated", "phases", "reported")
+
+    def __init__(
+        self,
+        blocks: List[dict],
+        token: str = None,
+        request_id: str = None,
+        units: UnitConverter = None,
+    ):
+        self.blocks = blocks
+        self.token = token
+        self.request_id = request_id
+        self.updated = time.time()
+        # blocks which were already sent in a GroupCapacityComplianceError
+        self.reported = set()
+        columns = BlockColumns.from_blocks(blocks)
+        hours = durations(columns.start, columns.end)
+        watts = (units or UnitConverter()).convert(
+            columns.capacity, columns.unit, "W", columns.phase, hours
+        )
+        # blocks without times, capacity or electrical unit are not checked
+        valid = ~np.isnan(watts) & ~np.isnan(hours)
+        start = columns.start.astype(np.int64)
+        end = columns.end.astype(np.int64)
+        keys = _phase_keys(columns.phase)
+        self.phases: Dict[int, Tuple[np.ndarray, ...]] = {}
+        for key in np.unique(keys[valid]).tolist():
+            index = np.flatnonzero(valid & (keys == key))
+            index = index[np.argsort(start[index], kind="stable")]
+            self.phases[key] = (start[index], end[index], watts[index], index)
+
+    def lookup(
+        self, phase: int, at: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        returns the block index and capacity in W of the block of the phase
+        containing each epoch millisecond, and the mask of times within a block
+        """
+        start, end, watts, index = self.phases[phase]
+        position = np.searchsorted(start, at, side="right") - 1
+        clipped = np.maximum(position, 0)
+        hit = (position >= 0) & (at < end[clipped])
+        return index[clipped], watts[clipped], hit
+
+
+@dataclass
+class ComplianceReport:
+    """
+    Measurements of a group exceeding the capacity of its forecast in W.
+    `block` is the index of the exceeded block in `forecasted_blocks`,
+    `measure_time` is the end of the measured interval.
+    Measurements of single phases compared with a block for all phases
+    are summed up per interval.
+    """
+
+    group_id: Optional[str]
+    type: str
+    forecasted_blocks: List[dict]
+    block: np.ndarray
+    phase: np.ndarray
+    measure_time: np.ndarray
+    measured: np.ndarray
+    capacity: np.ndarray
+    token: Optional[str] = None
+    request_id: Optional[str] = None
+
+    def blocks(self) -> List[dict]:
+        """
+        returns the exceeded forecasted blocks
+        """
+        return [self.forecasted_blocks[i] for i in np.unique(self.block).tolist()]
+
+    def to_payload(self, message: str = None) -> dict:
+        """
+        returns a GroupCapacityComplianceError for the exceeded blocks
+        """
+        if message is None:
+            message = (
+                f"measured {self.measured.max():.0f} W exceeds the "
+                f"{self.type.lower()} capacity of group {self.group_id}"
+            )
+        return {"message": message, "forecasted_blocks": self.blocks()}
+
+    def __len__(self):
+        return len(self.block)
+
+
+class ComplianceChecker(object):
+    """
+    Compares the UpdateGroupMeasurements of a group with the active
+    forecast of each type in `types` and reports the exceeded blocks.
+
+    The energy measurements are averaged over the interval from their
+    initial_measure_time to their measure_time and compared with the block
+    containing the middle of the interval, measurements without
+    initial_measure_time are ignored. Blocks of a single phase are compared
+    with the measurements of that phase, blocks for all phases with the
+    measurements for all phases and the sum of the single phases.
+    A measurement exceeds a block if it is larger than the capacity
+    times (1 + `tolerance`), `energy_types` restricts the compared
+    measurements, e.g. to ("TOTAL", None).
+
+    Forecasts are set with `update_forecast`. With a CorrelationStore,
+    the latest forecasts sent to the group are used as well.
+    With a `registrationmanager`, a GroupCapacityComplianceError for newly
+    exceeded blocks is sent to `path` of the peer of the forecast with the
+    X-Request-ID of the forecast as X-Correlation-ID. Blocks whose message
+    could not be sent (or queued in the outbox) are sent with the next check.
+    OSCP 2.0 only defines this message from the Flexibility Provider to the
+    Capacity Provider, so the `fp` endpoints of pyoscp do not accept it.
+    """
+
+    def __init__(
+        self,
+        voltage: float = 230.0,
+        phase_count: int = 3,
+        tolerance: float = 0.0,
+        types: Sequence[str] = ("CONSUMPTION", "GENERATION"),
+        energy_types: Sequence[Optional[str]] = None,
+        correlations: CorrelationStore = None,
+        registrationmanager=None,
+        path: str = "/group_capacity_compliance_error",
+    ):
+        if np is None:
+            raise ImportError(
+                "numpy is required for the compliance checker, install pyoscp[numpy]"
+            )
+        unsupported = [type for type in types if type not in LIMITS]
+        if unsupported:
+            raise ValueError(
+                f"unsupported forecast types {unsupported}, "
+                f"expected one of {tuple(LIMITS)}"
+            )
+        self.units = UnitConverter(voltage, phase_count)
+        self.tolerance = tolerance
+        self.types = tuple(types)
+        self.energy_types = energy_types
+        self.correlations = correlations
+        self.registrationmanager = registrationmanager
+        self.path = path
+        self._signs = {
+            type: _table(LIMITS[type], DIRECTIONS, 0).astype(np.float64)
+            for type in self.types
+        }
+        self._limits: Dict[Optional[str], Dict[str, _Limits]] = {}
+        self._lock = threading.Lock()
+
+    def update_forecast(
+        self, forecast: dict, token: str = None, request_id: str = None
+    ):
+        """
+        sets the forecast as active forecast of its group and type.
+        `token` and `request_id` identify the peer and X-Request-ID of the
+        forecast, to send GroupCapacityComplianceErrors.
+        """
+        limits = self._build(forecast.get("forecasted_blocks") or [], token, request_id)
+        with self._lock:
+            group = self._limits.setdefault(forecast.get("group_id"), {})
+            group[forecast.get("type")] = limits
+
+    def remove(self, group_id: str, type: str = None):
+        """
+        removes the active forecasts of the group, or only of the given type
+        """
+        with self._lock:
+            if type is None:
+                self._limits.pop(group_id, None)
+            else:
+                self._limits.get(group_id, {}).pop(type, None)
+
+    def _build(self, blocks: List[dict], token: str, request_id: str) -> _Limits:
+        return _Limits(blocks, token, request_id, self.units)
+
+    def _active(self, group_id: Optional[str]) -> Dict[str, _Limits]:
+        with self._lock:
+            active = dict(self._limits.get(group_id, {}))
+        if self.correlations is None:
+            return active
+        for type in self.types:
+            summary = self.correlations.latest(group_id, type=type)
+            if summary is None:
+                continue
+            current = active.get(type)
+            if current is None or summary.sent > current.updated:
+                limits = self._build(summary.blocks, summary.token, summary.request_id)
+                active[type] = limits
+                with self._lock:
+                    self._limits.setdefault(group_id, {})[type] = limits
+        return active
+
+    def check(self, measurements: dict) -> List[ComplianceReport]:
+        """
+        compares an UpdateGroupMeasurements with the active forecasts of its group.
+        Returns a report per forecast type with exceeded blocks.
+        """
+        group_id = measurements.get("group_id")
+        active = self._active(group_id)
+        if not active:
+            return []
+        columns = MeasurementColumns.from_measurements(
+            measurements.get("measurements") or []
+        )
+        hours = durations(columns.initial_measure_time, columns.measure_time)
+        watts = self.units.convert(
+            columns.value, columns.unit, "W", columns.phase, hours
+        )
+        valid = ~np.isnan(watts) & ~np.isnan(hours)
+        start = columns.initial_measure_time.astype(np.int64)
+        end = columns.measure_time.astype(np.int64)
+        if self.energy_types is not None:
+            valid &= np.isin(
+                columns.energy_type,
+                [
+                    MISSING if e is None else ENERGY_TYPES.index(e)
+                    for e in self.energy_types
+                ],
+            )
+
+        reports = []
+        for type in self.types:
+            limits = active.get(type)
+            if limits is None:
+                continue
+            signs = _lookup(self._signs[type], columns.direction)
+            power = watts * signs
+            valid_type = valid & (signs != 0)
+            report = self._compare(
+                group_id, type, limits, columns, start, end, power, valid_type
+            )
+            if report is not None:
+                reports.append(report)
+                if self.registrationmanager is not None:
+                    self._send(report, limits)
+        return reports
+
+    def _compare(
+        self,
+        group_id: Optional[str],
+        type: str,
+        limits: _Limits,
+        columns: MeasurementColumns,
+        start: np.ndarray,
+        end: np.ndarray,
+        power: np.ndarray,
+        valid: np.ndarray,
+    ) -> Optional[ComplianceReport]:
+        keys = _phase_keys(columns.phase)
+        single = np.flatnonzero(valid & (keys != ALL))
+        parts = []
+        for phase in limits.phases:
+            index = np.flatnonzero(valid & (keys == phase))
+            interval_end = end[index]
+            middle = start[index] + (end[index] - start[index]) // 2
+            measured = power[index]
+            if phase == ALL and len(single):
+                # sum up the single phases of each interval
+                intervals = np.stack(
+                    (
+                        start[single],
+                        end[single],
+                        columns.direction[single],
+                        columns.energy_type[single],
+                    ),
+                    axis=1,
+                )
+                unique, inverse = np.unique(intervals, axis=0, return_inverse=True)
+                sums = np.bincount(inverse.ravel(), weights=power[single])
+                interval_end = np.concatenate((interval_end, unique[:, 1]))
+                middle = np.concatenate(
+                    (middle, unique[:, 0] + (unique[:, 1] - unique[:, 0]) // 2)
+                )
+                measured = np.concatenate((measured, sums))
+            block, capacity, hit = limits.lookup(phase, middle)
+            exceeded = np.flatnonzero(
+                hit & (measured > capacity * (1 + self.tolerance))
+            )
+            if len(exceeded):
+                parts.append(
+                    (
+                        block[exceeded],
+                        np.full(len(exceeded), phase, dtype=np.int8),
+                        interval_end[exceeded].astype("datetime64[ms]"),
+                        measured[exceeded],
+                        capacity[exceeded],
+                    )
+                )
+        if not parts:
+            return None
+        return ComplianceReport(
+            group_id,
+            type,
+            limits.blocks,
+            *(np.concatenate(column) for column in zip(*parts)),
+            token=limits.token,
+            request_id=limits.request_id,
+        )
+
+    def _send(self, report: ComplianceReport, limits: _Limits):
+        with self._lock:
+            new = [
+                i for i in np.unique(report.block).tolist() if i not in limits.reported
+            ]
+            # reserved, so concurrent checks do not send them too
+            limits.reported.update(new)
+        if not new:
+            return
+        if report.token is None:
+            log.warning(f"no peer known for the forecast of group {report.group_id}")
+            return
+        rm = self.registrationmanager
+        base_url, client_token = rm.getURL(token=report.token)
+        if base_url is None:
+            log.warning(f"no url found for the forecast of group {report.group_id}")
+            return
+        payload = report.to_payload()
+        payload["forecasted_blocks"] = [limits.blocks[i] for i in new]
+        try:
+            rm._post(base_url, self.path, client_token, payload, report.request_id)
+        except requests.exceptions.RequestException as e:
+            log.error(f"sending compliance error to {base_url} failed: {e}")
+            # sent again by the next check
+            with self._lock:
+                limits.reported.difference_update(new)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from oscp.records import toEpoch
+
+# outbound messages which are recorded by the AsyncOscpClient
+FORECAST_PATHS = ("/update_group_capacity_forecast", "/adjust_group_capacity_forecast")
+
+
+class ForecastSummary(object):
+    """
+    A forecast sent to a peer, as recorded by the CorrelationStore.
+    `start` and `end` are the epoch seconds of the first and last block,
+    None if the forecast has no blocks.
+    """
+
+    __slots__ = (
+        "request_id",
+        "token",
+        "group_id",
+        "type",
+        "start",
+        "end",
+        "blocks",
+        "sent",
+    )
+
+    def __init__(self, request_id: str, forecast: dict, token: str = None):
+        self.request_id = request_id
+        self.token = token
+        self.group_id = forecast.get("group_id")
+        self.type = forecast.get("type")
+        self.blocks: List[dict] = forecast.get("forecasted_blocks") or []
+        starts = [toEpoch(b["start_time"]) for b in self.blocks if b.get("start_time")]
+        ends = [toEpoch(b["end_time"]) for b in self.blocks if b.get("end_time")]
+        self.start = min(starts) if starts else None
+        self.end = max(ends) if ends else None
+        self.sent = time.time()
+
+    def covers(self, at: float) -> bool:
+        if self.start is None or at < self.start:
+            return False
+        return self.end is None or at < self.end
+
+    def __repr__(self):
+        return (
+            f"ForecastSummary({self.request_id!r}, group_id={self.group_id!r}, "
+            f"blocks={len(self.blocks)})"
+        )
+
+
+class CorrelationStore(object):
+    """
+    Remembers the forecasts sent to the peers by their X-Request-ID, so that
+    messages referring to them with a X-Correlation-ID can be resolved.
+
+    The forecasts are kept in the order they were sent, for at most `ttl`
+    seconds and at most `maxsize` of them, older ones are dropped first.
+    Resolving a X-Correlation-ID is a dict lookup, `latest` returns the last
+    forecast of a group, e.g. to compare it with received measurements.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 2 * 24 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._by_request: OrderedDict[str, ForecastSummary] = OrderedDict()
+        self._by_group: Dict[str, Deque[ForecastSummary]] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self, request_id: str, forecast: dict, token: str = None
+    ) -> ForecastSummary:
+        """
+        records a forecast which was sent with the given X-Request-ID to
+        the peer using `token` to access this api
+        """
+        summary = ForecastSummary(request_id, forecast, token)
+        self.add(summary)
+        return summary
+
+    def add(self, summary: ForecastSummary, request_id: str = None):
+        """
+        adds a summary, also under another request_id,
+        e.g. the X-Request-ID of another segment of the forecast
+        """
+        request_id = request_id or summary.request_id
+        with self._lock:
+            self._expire(time.time())
+            old = self._by_request.pop(request_id, None)
+            if old is not None:
+                self._unlink(request_id, old)
+            self._by_request[request_id] = summary
+            if summary.group_id is not None and request_id == summary.request_id:
+                self._by_group.setdefault(summary.group_id, deque()).append(summary)
+            while len(self._by_request) > self.maxsize:
+                self._drop_oldest()
+
+    def get(self, request_id: str, token: str = None) -> Optional[ForecastSummary]:
+        """
+        returns the forecast sent with the given X-Request-ID.
+        If a token is given, only forecasts sent to this peer are returned.
+        """
+        summary = self._by_request.get(request_id)
+        if summary is None or time.time() - summary.sent > self.ttl:
+            return None
+        if token is not None and summary.token not in (None, token):
+            return None
+        return summary
+
+    def latest(
+        self, group_id: str, at: float = None, type: str = None
+    ) -> Optional[ForecastSummary]:
+        """
+        returns the last forecast sent for the group,
+        which covers the given epoch seconds if `at` is given
+        and has the given forecast type if `type` is given
+        """
+        with self._lock:
+            for summary in reversed(self._by_group.get(group_id, ())):
+                if type is not None and summary.type != type:
+                    continue
+                if at is None or summary.covers(at):
+                    return summary
+        return None
+
+    def _expire(self, now: float):
+        while self._by_request:
+            summary = next(iter(self._by_request.values()))
+            if now - summary.sent <= self.ttl:
+                break
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        self._unlink(*self._by_request.popitem(last=False))
+
+    def _unlink(self, request_id: str, summary: ForecastSummary):
+        group = self._by_group.get(summary.group_id)
+        # summaries added under another request_id are not in the group
+        if request_id == summary.request_id and group and summary in group:
+            group.remove(summary)
+            if not group:
+                del self._by_group[summary.group_id]
+
+    def __len__(self):
+        return len(self._by_request)
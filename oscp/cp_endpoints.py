@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from flask_restx import Namespace, Resource  # ,add_models_to__namespace
 
+from oscp.dedup import idempotent
+from oscp.dispatch import dispatch
 from oscp.json_models import (
     EnergyMeasurement,
     ForecastedBlock,
@@ -41,9 +43,11 @@ class adjustGroupCapacityForecast(Resource):
     def __init__(self, api=None, *args, **kwargs):
         self.capacityprovider = kwargs["capacityprovider"]
         self.registrationmanager = kwargs["registrationmanager"]
+        self.dispatcher = kwargs.get("dispatcher")
         super().__init__(api, *args, **kwargs)
 
     @cap_provider_ns.expect(GroupCapacityForecast)
+    @idempotent
     def post(self):
         """
         Demands do not match the capacity limits
@@ -55,10 +59,16 @@ class adjustGroupCapacityForecast(Resource):
         within a UpdateGroupCapacityForecast message.
         """
         token = self.registrationmanager._check_access_token()
-        self.capacityprovider.handleAdjustGroupCapacityForecast(
-            cap_provider_ns.payload, token
+        payload = self.registrationmanager.reassemble(cap_provider_ns.payload, token)
+        if payload is None:
+            # waiting for the other segments
+            return "", 204
+        return dispatch(
+            self.dispatcher,
+            self.capacityprovider.handleAdjustGroupCapacityForecast,
+            payload,
+            token,
         )
-        return "", 204
 
 
 @cap_provider_ns.route(
@@ -71,9 +81,11 @@ class groupCapacityComplianceError(Resource):
     def __init__(self, api=None, *args, **kwargs):
         self.capacityprovider = kwargs["capacityprovider"]
         self.registrationmanager = kwargs["registrationmanager"]
+        self.dispatcher = kwargs.get("dispatcher")
         super().__init__(api, *args, **kwargs)
 
     @cap_provider_ns.expect(GroupCapacityComplianceError)
+    @idempotent
     def post(self):
         """
         FP can not comply to the Capacity Forecast
@@ -83,10 +95,16 @@ class groupCapacityComplianceError(Resource):
         The Capacity Forecast referred to by the Flexibility Provider SHALL be indicated by the X-Correlation-ID header.
         """
         token = self.registrationmanager._check_access_token()
-        self.capacityprovider.handleGroupCapacityComplianceError(
-            cap_provider_ns.payload, token
+        payload = self.registrationmanager.reassemble(cap_provider_ns.payload, token)
+        if payload is None:
+            # waiting for the other segments
+            return "", 204
+        return dispatch(
+            self.dispatcher,
+            self.capacityprovider.handleGroupCapacityComplianceError,
+            payload,
+            token,
         )
-        return "", 204
 
 
 @cap_provider_ns.route(
@@ -99,9 +117,11 @@ class updateGroupMeasurements(Resource):
     def __init__(self, api=None, *args, **kwargs):
         self.capacityprovider = kwargs["capacityprovider"]
         self.registrationmanager = kwargs["registrationmanager"]
+        self.dispatcher = kwargs.get("dispatcher")
         super().__init__(api, *args, **kwargs)
 
     @cap_provider_ns.expect(UpdateGroupMeasurements)
+    @idempotent
     def post(self):
         """
         Updating aggregated group measurements
@@ -113,7 +133,13 @@ class updateGroupMeasurements(Resource):
         The total usage can be 'nothing'. Therefore, the measurements field can be empty.
         """
         token = self.registrationmanager._check_access_token()
-        self.capacityprovider.handleUpdateGroupMeasurements(
-            cap_provider_ns.payload, token
+        payload = self.registrationmanager.reassemble(cap_provider_ns.payload, token)
+        if payload is None:
+            # waiting for the other segments
+            return "", 204
+        return dispatch(
+            self.dispatcher,
+            self.capacityprovider.handleUpdateGroupMeasurements,
+            payload,
+            token,
         )
-        return "", 204
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Optional, Tuple
+
+from flask import request
+from flask_restx.utils import unpack
+from werkzeug.exceptions import HTTPException
+
+log = logging.getLogger("oscp")
+
+Response = Tuple[object, int, dict]
+
+
+class RequestDedup(object):
+    """
+    Bounded cache of the responses to inbound messages, keyed by the token
+    and the X-Request-ID of the request.
+
+    Peers retry messages with the same X-Request-ID, e.g. after a timeout.
+    A retried message is answered with the response of the first one, without
+    calling the managers again. Only successful (2xx) responses are kept,
+    failed messages are processed again when retried.
+    A retry arriving while the first message is still processed waits up to
+    `wait` seconds for its response, and is answered with 503 if the first
+    message is still not done.
+
+    Responses are kept for `ttl` seconds and at most `maxsize` of them,
+    the least recently used are evicted. Like the TokenCache, the keys are
+    HMACs of the token, so tokens are not stored.
+    With a `filename`, the responses are also stored in a SQLite database,
+    which can be shared by multiple worker processes. The HMAC key is then
+    stored in the database too, it is only as secret as the database file.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dedup_key (key BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS dedup (
+            key BLOB PRIMARY KEY,
+            response TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS dedup_expires ON dedup(expires);
+    """
+    SELECT_KEY = "SELECT key FROM dedup_key"
+    INSERT_KEY = "INSERT INTO dedup_key (key) VALUES (?)"
+    SELECT = "SELECT response FROM dedup WHERE key = ? AND expires > ?"
+    UPSERT = "INSERT OR REPLACE INTO dedup (key, response, expires) VALUES (?, ?, ?)"
+    DELETE_EXPIRED = "DELETE FROM dedup WHERE expires <= ?"
+    # expired rows are deleted every CLEANUP_INTERVAL stored responses
+    CLEANUP_INTERVAL = 1000
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 600,
+        filename: str = None,
+        wait: float = 10,
+        timeout: float = 5,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.wait = wait
+        self.filename = filename
+        self.timeout = timeout
+        # expiry, response and whether the request removed its own token
+        self._responses: OrderedDict[bytes, Tuple[float, Response, bool]] = (
+            OrderedDict()
+        )
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stored = 0
+        if filename is None:
+            self._key = secrets.token_bytes(32)
+        else:
+            self._key = self._shared_key()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def _connection(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        # a connection must not be used after fork(), the child opens its own
+        if con is None or self._local.pid != os.getpid():
+            con = self._local.con = self._connect()
+            self._local.pid = os.getpid()
+        return con
+
+    def _shared_key(self) -> bytes:
+        # created before the workers are forked, so the connection is closed
+        con = self._connect()
+        try:
+            con.executescript(self.SCHEMA)
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                row = con.execute(self.SELECT_KEY).fetchone()
+                if row is None:
+                    row = (secrets.token_bytes(32),)
+                    con.execute(self.INSERT_KEY, row)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        finally:
+            con.close()
+        return row[0]
+
+    def key(self, token: str, request_id: str, path: str) -> bytes:
+        message = "\n".join((token, request_id, path)).encode()
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def get(self, key: bytes) -> Optional[Tuple[Response, bool]]:
+        """
+        returns the stored response of the request and whether the request
+        removed its own token, or None
+        """
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is not None:
+                if entry[0] >= time.monotonic():
+                    self._responses.move_to_end(key)
+                    return entry[1], entry[2]
+                del self._responses[key]
+        if self.filename is None:
+            return None
+        row = self._connection().execute(self.SELECT, (key, time.time())).fetchone()
+        if row is None:
+            return None
+        data, code, headers, *revoked = json.loads(row[0])
+        response = (data, code, headers)
+        revoked = bool(revoked and revoked[0])
+        self._remember(key, response, revoked)
+        return response, revoked
+
+    def put(self, key: bytes, response: Response, revoked: bool = False):
+        """
+        stores the response of the request, `revoked` is True if the request
+        removed the token it was sent with, e.g. a registration replacing it
+        """
+        self._remember(key, response, revoked)
+        if self.filename is None:
+            return
+        try:
+            encoded = json.dumps(list(response) + [revoked])
+        except TypeError:
+            # kept in memory only
+            return
+        con = self._connection()
+        now = time.time()
+        con.execute(self.UPSERT, (key, encoded, now + self.ttl))
+        self._stored += 1
+        if self._stored % self.CLEANUP_INTERVAL == 0:
+            con.execute(self.DELETE_EXPIRED, (now,))
+
+    def _remember(self, key: bytes, response: Response, revoked: bool):
+        with self._lock:
+            self._responses[key] = (time.monotonic() + self.ttl, response, revoked)
+            self._responses.move_to_end(key)
+            if len(self._responses) > self.maxsize:
+                self._responses.popitem(last=False)
+
+    def handle(self, func: Callable, authorize: Callable = None):
+        """
+        returns the stored response if the current request is a retry,
+        otherwise calls func and stores its response if it succeeded.
+
+        authorize raises if the token of the current request is not valid.
+        It is called before a stored response is returned, unless the first
+        request removed the token itself, and after func succeeded to find
+        out if it did.
+        """
+        token = request.headers.get("Authorization")
+        request_id = request.headers.get("X-Request-ID")
+        if not token or not request_id:
+            return func()
+        key = self.key(token, request_id, request.path)
+        cached = self.get(key)
+        if cached is None:
+            with self._lock:
+                done = self._in_flight.get(key)
+                if done is None:
+                    self._in_flight[key] = threading.Event()
+            if done is not None:
+                # the first request is still processed
+                if not done.wait(self.wait):
+                    log.warning(f"retried request {request_id} is still processed")
+                    headers = {"Retry-After": str(math.ceil(self.wait))}
+                    message = f"request {request_id} is still processed"
+                    return {"message": message}, 503, headers
+                cached = self.get(key)
+        if cached is not None:
+            response, revoked = cached
+            if not revoked and authorize is not None:
+                authorize()
+            log.info(f"answering retried request {request_id} from cache")
+            return response
+        if done is not None:
+            # the first request failed
+            return func()
+        try:
+            data, code, headers = unpack(func())
+            if 200 <= code < 300:
+                revoked = authorize is not None and not _authorized(authorize)
+                self.put(key, (data, code, dict(headers or {})), revoked)
+            return data, code, headers
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+
+
+def _authorized(authorize: Callable) -> bool:
+    try:
+        authorize()
+    except HTTPException:
+        return False
+    return True
+
+
+def idempotent(func):
+    """
+    answers retried requests of the decorated resource method with the
+    stored response, if the registration manager has a RequestDedup.
+    The token is checked before a stored response is returned, so removed
+    tokens can not replay it. Only the retries of the request which removed
+    the token, like a registration replacing it, are still answered.
+    """
+
+    @wraps(func)
+    def wrapper(resource, *args, **kwargs):
+        registrationmanager = resource.registrationmanager
+        dedup = getattr(registrationmanager, "dedup", None)
+        if dedup is None:
+            return func(resource, *args, **kwargs)
+        return dedup.handle(
+            lambda: func(resource, *args, **kwargs),
+            registrationmanager._check_access_token,
+        )
+
+    return wrapper
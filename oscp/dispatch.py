@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from flask import current_app, request
+from werkzeug.exceptions import ServiceUnavailable
+
+log = logging.getLogger("oscp")
+
+_STOP = object()
+_local = threading.local()
+
+
+class Message(object):
+    """
+    An inbound message which is handled by a worker of the Dispatcher.
+    """
+
+    __slots__ = (
+        "route",
+        "token",
+        "request_id",
+        "correlation_id",
+        "group_id",
+        "received",
+    )
+
+    def __init__(
+        self,
+        route: str,
+        token: str = None,
+        request_id: str = None,
+        correlation_id: str = None,
+        group_id: str = None,
+    ):
+        self.route = route
+        self.token = token
+        self.request_id = request_id
+        self.correlation_id = correlation_id
+        self.group_id = group_id
+        self.received = time.time()
+
+
+def current_message() -> Optional[Message]:
+    """
+    returns the message handled by the current worker thread,
+    e.g. to read its X-Correlation-ID in a handler, None outside of a worker
+    """
+    return getattr(_local, "message", None)
+
+
+class Dispatcher(object):
+    """
+    Runs the handlers of inbound messages in a pool of worker threads,
+    so the endpoints answer with 204 without waiting for the handler.
+
+    Every route (e.g. "update_group_measurements") holds at most `queue_size`
+    waiting messages, `queue_sizes` sets the size per route.
+    If the queue of a route is full, the endpoint answers with 503 and a
+    Retry-After header of `retry_after` seconds.
+    Messages with the same group_id (or from the same peer, if they have no
+    group_id) are handled by the same worker in the order they were received.
+
+    The workers are started with the first message, so the Dispatcher can be
+    created before forking the worker processes.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        queue_size: int = 100,
+        queue_sizes: Dict[str, int] = None,
+        retry_after: int = 5,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_sizes = queue_sizes or {}
+        self.retry_after = retry_after
+        self._pending: Dict[str, int] = {}
+        self._lanes: List[queue.SimpleQueue] = []
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def submit(self, handler: Callable, payload, token: str = None):
+        """
+        enqueues handler(payload, token), or handler(payload) without token,
+        with the headers of the current request
+
+        Raises
+        ------
+        ServiceUnavailable
+            if the queue of the route is full
+        """
+        route = request.path.rstrip("/").rsplit("/", 1)[-1]
+        group_id = payload.get("group_id") if isinstance(payload, dict) else None
+        message = Message(
+            route,
+            token,
+            request.headers.get("X-Request-ID"),
+            request.headers.get("X-Correlation-ID"),
+            group_id,
+        )
+        with self._lock:
+            if not self._threads:
+                self._start()
+            pending = self._pending.get(route, 0)
+            if pending >= self.queue_sizes.get(route, self.queue_size):
+                log.warning(f"queue of {route} is full, rejecting message")
+                raise ServiceUnavailable(
+                    f"too many pending {route} messages",
+                    retry_after=self.retry_after,
+                )
+            self._pending[route] = pending + 1
+            lane = self._lanes[self._lane(group_id or token or "")]
+            app = current_app._get_current_object()
+            lane.put((message, app, handler, payload))
+
+    def pending(self, route: str = None) -> int:
+        """
+        returns the number of waiting messages of the route, or of all routes
+        """
+        if route is None:
+            return sum(self._pending.values())
+        return self._pending.get(route, 0)
+
+    def close(self, wait: bool = True):
+        """
+        stops the workers after the waiting messages are handled
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            for lane in self._lanes:
+                lane.put(_STOP)
+            self._lanes = []
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _lane(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % self.workers
+
+    def _start(self):
+        self._lanes = [queue.SimpleQueue() for _ in range(self.workers)]
+        for index, lane in enumerate(self._lanes):
+            thread = threading.Thread(
+                target=self._work,
+                args=(lane,),
+                daemon=True,
+                name=f"OSCP Dispatcher {index}",
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self, lane: queue.SimpleQueue):
+        while True:
+            item = lane.get()
+            if item is _STOP:
+                return
+            message, app, handler, payload = item
+            with self._lock:
+                self._pending[message.route] -= 1
+            _local.message = message
+            try:
+                with app.app_context():
+                    if message.token is None:
+                        handler(payload)
+                    else:
+                        handler(payload, message.token)
+            except Exception:
+                log.exception(f"handling {message.route} {message.request_id} failed")
+            finally:
+                _local.message = None
+
+
+def dispatch(
+    dispatcher: Optional[Dispatcher], handler: Callable, payload, token: str = None
+):
+    """
+    calls the handler directly if no dispatcher is injected,
+    otherwise enqueues it at the dispatcher.
+    Returns the response of the endpoint.
+    """
+    if dispatcher is None:
+        if token is None:
+            handler(payload)
+        else:
+            handler(payload, token)
+        return "", 204
+    try:
+        dispatcher.submit(handler, payload, token)
+    except ServiceUnavailable as e:
+        # returned instead of raised, flask-restx logs raised 5xx errors
+        headers = {"Retry-After": str(e.retry_after)}
+        return {"message": e.description}, e.code, headers
+    return "", 204
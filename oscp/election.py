@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on windows
+    fcntl = None
+
+log = logging.getLogger("oscp")
+
+
+class LeaderElection(object):
+    """
+    Elects a single leader among the processes using the same lock file.
+
+    The leader holds an exclusive, non-blocking flock on `filename`.
+    The lock is released by the operating system when the leader process dies,
+    so one of the remaining processes takes over at its next `acquire()`.
+
+    The lock file is opened on the first `acquire()`, it must not be called
+    before forking the worker processes, as the children would share the lock.
+    Without fcntl (e.g. on windows) every process is its own leader.
+    """
+
+    def __init__(self, filename: str = "./oscp.leader"):
+        self.filename = filename
+        self._fd = None
+        self.is_leader = False
+
+    def acquire(self) -> bool:
+        """
+        tries to become the leader without blocking and returns if this
+        process is the leader
+        """
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            log.warning("fcntl is not available, every process is a leader")
+            self.is_leader = True
+            return True
+        if self._fd is None:
+            self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        # for debugging only, the lock is the source of truth
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, str(os.getpid()).encode(), 0)
+        self.is_leader = True
+        log.info(f"process {os.getpid()} is the oscp leader")
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            if fcntl is not None and self.is_leader:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
@@ -5,12 +5,14 @@ from __future__ import annotations
 
 from flask_restx import Resource
 
+from oscp.dedup import idempotent
 from oscp.ep_models import ExtForecastedBlock, GroupCapacityPrice
 from oscp.json_models import (
     GroupCapacityForecast,
     add_models_to_namespace,
     create_header_parser,
 )
+from oscp.serialization import marshal_with
 
 models = [ExtForecastedBlock, GroupCapacityPrice, GroupCapacityForecast]
 
@@ -28,10 +30,12 @@ def addPrice(namespace):
         def __init__(self, api=None, *args, **kwargs):
             self.capacityprovider = kwargs["capacityprovider"]
             self.registrationmanager = kwargs["registrationmanager"]
+            self.serializer = kwargs.get("serializer")
             super().__init__(api, *args, **kwargs)
 
         @namespace.expect(GroupCapacityForecast)
-        @namespace.marshal_with(GroupCapacityPrice)
+        @idempotent
+        @marshal_with(namespace, GroupCapacityPrice)
         def post(self):
             """
             Get Price Series for the electricity of a given LoadSeries Request
@@ -5,10 +5,13 @@ Created on Thu May 27 15:55:51 2021
 
 @author: maurer
 """
+
 from __future__ import annotations
 
 from flask_restx import Resource
 
+from oscp.dedup import idempotent
+from oscp.dispatch import dispatch
 from oscp.ep_models import ExtForecastedBlock, GroupCapacityPrice
 from oscp.json_models import add_models_to_namespace, create_header_parser
 
@@ -27,14 +30,24 @@ def addForPriceCalculation(namespace):
         def __init__(self, api=None, *args, **kwargs):
             self.pricemanager = kwargs["pricemanager"]
             self.registrationmanager = kwargs["registrationmanager"]
+            self.dispatcher = kwargs.get("dispatcher")
             super().__init__(api, *args, **kwargs)
 
         @namespace.expect(GroupCapacityPrice)
+        @idempotent
         def post(self):
             """
             Update Load TimeSeries which can contain a Load or a Price (or both).
             Can be used by a EnergyProvider or a DSO to communicate a price series
             """
             token = self.registrationmanager._check_access_token()
-            self.pricemanager.handleUpdateGroupCapacityPrice(namespace.payload, token)
-            return "", 204
+            payload = self.registrationmanager.reassemble(namespace.payload, token)
+            if payload is None:
+                # waiting for the other segments
+                return "", 204
+            return dispatch(
+                self.dispatcher,
+                self.pricemanager.handleUpdateGroupCapacityPrice,
+                payload,
+                token,
+            )
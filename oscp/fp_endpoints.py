@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from flask_restx import Namespace, Resource  # ,add_models_to__namespace
 
+from oscp.dedup import idempotent
+from oscp.dispatch import dispatch
 from oscp.json_models import (
     ForecastedBlock,
     GroupCapacityForecast,
@@ -9,6 +11,7 @@ from oscp.json_models import (
     create_header_parser,
 )
 from oscp.registration import namespace_registration
+from oscp.serialization import marshal_with
 
 flex_provider_ns = Namespace(name="fp", validate=True, path="/fp/2.0")
 
@@ -31,10 +34,13 @@ class updateGroupCapacityForecast(Resource):
         # forecastmanager is a black box dependency, which contains the logic
         self.flexibilityprovider = kwargs["flexibilityprovider"]
         self.registrationmanager = kwargs["registrationmanager"]
+        self.dispatcher = kwargs.get("dispatcher")
+        self.serializer = kwargs.get("serializer")
         super().__init__(api, *args, **kwargs)
 
     @flex_provider_ns.expect(GroupCapacityForecast)
-    @flex_provider_ns.marshal_with(GroupCapacityForecast)
+    @idempotent
+    @marshal_with(flex_provider_ns, GroupCapacityForecast)
     # @forecast_ns.response(204, 'No Content')
     def post(self):
         """
@@ -42,7 +48,13 @@ class updateGroupCapacityForecast(Resource):
         should generate an Optimum capacity forecast for the capacity that should be used in the specific group.
         """
         token = self.registrationmanager._check_access_token()
-        self.flexibilityprovider.handleUpdateGroupCapacityForecast(
-            flex_provider_ns.payload, token
+        payload = self.registrationmanager.reassemble(flex_provider_ns.payload, token)
+        if payload is None:
+            # waiting for the other segments
+            return "", 204
+        return dispatch(
+            self.dispatcher,
+            self.flexibilityprovider.handleUpdateGroupCapacityForecast,
+            payload,
+            token,
         )
-        return "", 204
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Dict
+
+import requests
+
+log = logging.getLogger("oscp")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class PeerUnavailable(requests.exceptions.ConnectionError):
+    """
+    raised instead of sending a message to a peer with an open circuit breaker
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Health of a single peer.
+
+    The breaker opens after `failure_threshold` consecutive failures or when the
+    peer went offline. After `reset_timeout` seconds a single probe message is
+    let through (half-open); its success closes the breaker, its failure opens
+    it again.
+    """
+
+    __slots__ = (
+        "failure_threshold",
+        "reset_timeout",
+        "state",
+        "failures",
+        "opened_at",
+        "probing",
+        "offline_at",
+    )
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        # the missed offline deadline which opened the breaker
+        self.offline_at = None
+
+    def available(self, now: float) -> bool:
+        """
+        returns if a message could be sent, without changing the state
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return now - self.opened_at >= self.reset_timeout
+        return not self.probing
+
+    def acquire(self, now: float) -> bool:
+        """
+        returns if a message may be sent now,
+        moves an expired open breaker to half-open and reserves the probe
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def failure(self, now: float):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip(now)
+
+    def trip(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+
+    def to_dict(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+class PeerHealth(object):
+    """
+    Circuit breakers of all peers, identified by their base_url
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def _breaker(self, base_url: str) -> CircuitBreaker:
+        breaker = self._breakers.get(base_url)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            self._breakers[base_url] = breaker
+        return breaker
+
+    def _update(self, base_url: str, change):
+        with self._lock:
+            breaker = self._breaker(base_url)
+            was_closed = breaker.state == CLOSED
+            change(breaker)
+            is_closed = breaker.state == CLOSED
+            if was_closed != is_closed:
+                self._open += 1 if was_closed else -1
+                log.info(f"circuit breaker of {base_url} is {breaker.state}")
+            return breaker
+
+    def available(self, base_url: str) -> bool:
+        breaker = self._breakers.get(base_url)
+        return breaker is None or breaker.available(time.monotonic())
+
+    def acquire(self, base_url: str) -> bool:
+        if self._open == 0:
+            return True
+        result = []
+        self._update(base_url, lambda b: result.append(b.acquire(time.monotonic())))
+        return result[0]
+
+    def success(self, base_url: str):
+        breaker = self._breakers.get(base_url)
+        if breaker is None or (breaker.state == CLOSED and breaker.failures == 0):
+            return
+        self._update(base_url, CircuitBreaker.success)
+
+    def failure(self, base_url: str):
+        self._update(base_url, lambda b: b.failure(time.monotonic()))
+
+    def offline(self, base_url: str, offline_at=None):
+        """
+        opens the breaker, as the peer did not send a heartbeat before offline_at.
+        Every missed deadline opens the breaker only once.
+        """
+
+        def trip(breaker):
+            if offline_at is None or breaker.offline_at != offline_at:
+                breaker.offline_at = offline_at
+                breaker.trip(time.monotonic())
+
+        self._update(base_url, trip)
+
+    def online(self, base_url: str):
+        """
+        lets the next message probe an open breaker, as the peer is alive again
+        """
+
+        def reset(breaker):
+            if breaker.state == OPEN:
+                breaker.opened_at = time.monotonic() - breaker.reset_timeout
+
+        if self._open:
+            self._update(base_url, reset)
+
+    def any_open(self) -> bool:
+        return self._open > 0
+
+    def state(self, base_url: str) -> dict:
+        breaker = self._breakers.get(base_url)
+        if breaker is None:
+            return {"state": CLOSED, "failures": 0}
+        return breaker.to_dict()
@@ -247,6 +247,7 @@ def create_header_parser(namespace):
     header_parser.add_argument("Authorization", required=True, location="headers")
     header_parser.add_argument("X-Request-ID", required=True, location="headers")
     header_parser.add_argument("X-Correlation-ID", location="headers")
+    header_parser.add_argument("X-Segment-ID", location="headers")
     header_parser.add_argument("X-Segment-Index", location="headers")
     header_parser.add_argument("X-Segment-Count", location="headers")
     return header_parser
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Optional
+
+
+class LivenessTracker(object):
+    """
+    Keeps track of the heartbeats received from the peers in memory.
+
+    Last-seen and offline-at times are stored as time.monotonic() timestamps,
+    so recording a heartbeat and checking if a peer is online are dict operations.
+    The offline-at time is also kept in epoch seconds for persisting it.
+    Peers with a heartbeat since the last call to `take_changes` are marked
+    as changed, so their offline_at can be persisted periodically.
+    """
+
+    def __init__(self):
+        # token -> (last_seen, offline_at monotonic, offline_at epoch seconds)
+        self._peers = {}
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    def beat(self, token: str, offline_at: float) -> Optional[float]:
+        """
+        records a heartbeat of the peer and returns the seconds since its
+        previous heartbeat, None for the first one
+        """
+        now = time.monotonic()
+        offline_mono = now + offline_at - time.time()
+        with self._lock:
+            previous = self._peers.get(token)
+            self._peers[token] = (now, offline_mono, offline_at)
+            self._changed.add(token)
+        return None if previous is None else now - previous[0]
+
+    def is_online(self, token: str) -> Optional[bool]:
+        """
+        returns if the offline_at of the last heartbeat is not reached yet,
+        None if no heartbeat was received from the peer
+        """
+        peer = self._peers.get(token)
+        if peer is None:
+            return None
+        return time.monotonic() < peer[1]
+
+    def last_seen(self, token: str) -> Optional[float]:
+        """
+        returns the seconds since the last heartbeat of the peer
+        """
+        peer = self._peers.get(token)
+        if peer is None:
+            return None
+        return time.monotonic() - peer[0]
+
+    def offline_at(self, token: str) -> Optional[float]:
+        peer = self._peers.get(token)
+        if peer is None:
+            return None
+        return peer[2]
+
+    def forget(self, *tokens: str):
+        with self._lock:
+            for token in tokens:
+                self._peers.pop(token, None)
+                self._changed.discard(token)
+
+    def take_changes(self) -> Dict[str, float]:
+        """
+        returns the offline_at of all peers which sent a heartbeat
+        since the last call
+        """
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            return {
+                token: self._peers[token][2]
+                for token in changed
+                if token in self._peers
+            }
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import requests
+
+from oscp.client import OscpClient
+
+log = logging.getLogger("oscp")
+
+
+class _PeerState(object):
+    __slots__ = ("failures", "retry_at")
+
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class Outbox(object):
+    """
+    Durable queue for outbound OSCP messages.
+
+    Messages are stored in a SQLite database until they are delivered, so they
+    survive restarts. Every peer (base_url) has its own FIFO queue:
+
+    - at most `max_in_flight` messages are sent to a peer at the same time
+    - after a failed delivery the peer is backed off exponentially,
+      starting with `backoff` seconds up to `max_backoff` seconds
+    - a peer holds at most `max_queue` messages, the oldest ones are dropped
+    - a queued heartbeat is replaced by a newer heartbeat to the same peer
+
+    Several processes can share the database. A message is claimed in the
+    database before it is sent, so it is delivered by one process only.
+    Claims expire after `claim_timeout` seconds, so the messages of a
+    stopped or crashed process are picked up by the others, which look for
+    new messages every `poll_interval` seconds.
+
+    Without a `client`, the client of the registration manager is used,
+    so the outbox shares its circuit breakers. Peers with an open circuit
+    breaker are skipped until it half-opens.
+
+    Messages which are answered with a 4xx status (except 408 and 429) are
+    dropped, as sending them again would not change the answer.
+    The X-Request-ID of a message stays the same for all attempts.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            base_url TEXT NOT NULL,
+            path TEXT NOT NULL,
+            token TEXT NOT NULL,
+            data TEXT,
+            correlation TEXT,
+            request_id TEXT NOT NULL,
+            created REAL NOT NULL,
+            claimed_by TEXT,
+            claimed_until REAL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_base_url ON outbox(base_url, id);
+    """
+    # columns added to databases created by older versions
+    CLAIM_COLUMNS = {"claimed_by": "TEXT", "claimed_until": "REAL"}
+    INSERT = """
+        INSERT INTO outbox
+        (base_url, path, token, data, correlation, request_id, created)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    DELETE = "DELETE FROM outbox WHERE id = ?"
+    # messages which are claimed by a process are not touched by the others
+    DELETE_QUEUED_PATH = """
+        DELETE FROM outbox WHERE base_url = ? AND path = ?
+        AND (claimed_until IS NULL OR claimed_until < ?)
+    """
+    COUNT_PEER = "SELECT COUNT(*) FROM outbox WHERE base_url = ?"
+    DELETE_OLDEST = """
+        DELETE FROM outbox WHERE id IN (
+            SELECT id FROM outbox WHERE base_url = ?
+            AND (claimed_until IS NULL OR claimed_until < ?)
+            ORDER BY id LIMIT ?
+        )
+    """
+    SELECT_PEERS = "SELECT DISTINCT base_url FROM outbox"
+    COUNT_CLAIMED = """
+        SELECT COUNT(*) FROM outbox WHERE base_url = ? AND claimed_until >= ?
+    """
+    SELECT_NEXT = """
+        SELECT * FROM outbox WHERE base_url = ?
+        AND (claimed_until IS NULL OR claimed_until < ?)
+        ORDER BY id LIMIT ?
+    """
+    CLAIM = "UPDATE outbox SET claimed_by = ?, claimed_until = ? WHERE id = ?"
+    RELEASE = """
+        UPDATE outbox SET claimed_by = NULL, claimed_until = NULL
+        WHERE id = ? AND claimed_by = ?
+    """
+
+    def __init__(
+        self,
+        filename="./outbox.db",
+        client: OscpClient = None,
+        max_in_flight: int = 1,
+        max_queue: int = 1000,
+        backoff: float = 1,
+        max_backoff: float = 300,
+        coalesce_paths=("/heartbeat",),
+        max_workers: int = 8,
+        claim_timeout: float = 60,
+        poll_interval: float = 5,
+    ):
+        self.filename = filename
+        # set to the client of the registration manager if not given
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.coalesce_paths = set(coalesce_paths)
+        self.claim_timeout = claim_timeout
+        self.poll_interval = poll_interval
+        # identifies the claims of this outbox
+        self.owner = secrets.token_hex(8)
+
+        # the outbox is usually created before the workers are forked,
+        # so the connection is opened by the process using it
+        self._connection = None
+        self._pid = None
+        con = self._connect()
+        try:
+            con.executescript(self.SCHEMA)
+            self._migrate(con)
+        finally:
+            con.close()
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._peers: Dict[str, _PeerState] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="OSCP Outbox"
+        )
+        self.__stop = False
+        self.t = threading.Thread(target=self._run, daemon=True, name="OSCP Outbox")
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(
+            self.filename, isolation_level=None, check_same_thread=False
+        )
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    @property
+    def _con(self) -> sqlite3.Connection:
+        # a connection must not be used after fork(), the child opens its own
+        if self._pid != os.getpid():
+            self._connection = self._connect()
+            self._pid = os.getpid()
+        return self._connection
+
+    def _migrate(self, con: sqlite3.Connection):
+        columns = {row["name"] for row in con.execute("PRAGMA table_info(outbox)")}
+        for column, type in self.CLAIM_COLUMNS.items():
+            if column not in columns:
+                con.execute(f"ALTER TABLE outbox ADD COLUMN {column} {type}")
+
+    def start(self):
+        if self.client is None:
+            self.client = OscpClient()
+        self.t.start()
+
+    def stop(self):
+        with self._condition:
+            self.__stop = True
+            self._condition.notify_all()
+        # messages which were not sent yet are sent by the next process
+        # once their claims expired
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _peer(self, base_url: str) -> _PeerState:
+        peer = self._peers.get(base_url)
+        if peer is None:
+            peer = self._peers[base_url] = _PeerState()
+        return peer
+
+    def put(
+        self,
+        base_url: str,
+        path: str,
+        token: str,
+        data: dict = None,
+        correlation: str = None,
+        request_id: str = None,
+    ) -> str:
+        """
+        queues a message for the peer and returns its X-Request-ID
+        """
+        request_id = request_id or secrets.token_urlsafe(8)
+        with self._condition:
+            now = time.time()
+            self._con.execute("BEGIN IMMEDIATE")
+            try:
+                if path in self.coalesce_paths:
+                    self._con.execute(self.DELETE_QUEUED_PATH, (base_url, path, now))
+                queued = self._con.execute(self.COUNT_PEER, (base_url,)).fetchone()[0]
+                if queued >= self.max_queue:
+                    dropped = queued - self.max_queue + 1
+                    log.warning(f"outbox for {base_url} is full, dropping {dropped}")
+                    self._con.execute(self.DELETE_OLDEST, (base_url, now, dropped))
+                self._con.execute(
+                    self.INSERT,
+                    (
+                        base_url,
+                        path,
+                        token,
+                        json.dumps(data),
+                        correlation,
+                        request_id,
+                        now,
+                    ),
+                )
+                self._con.execute("COMMIT")
+            except BaseException:
+                self._con.execute("ROLLBACK")
+                raise
+            self._condition.notify()
+        return request_id
+
+    def _next_messages(self, now: float):
+        """
+        claims the messages which can be sent now and returns them
+        with the time at which the next backoff expires
+        """
+        messages = []
+        next_retry = None
+        # claims are compared across processes, so they use the epoch
+        epoch = time.time()
+        self._con.execute("BEGIN IMMEDIATE")
+        try:
+            for (base_url,) in self._con.execute(self.SELECT_PEERS).fetchall():
+                peer = self._peer(base_url)
+                if peer.retry_at > now:
+                    next_retry = min(next_retry or peer.retry_at, peer.retry_at)
+                    continue
+                if not self.client.health.available(base_url):
+                    continue
+                claimed = self._con.execute(
+                    self.COUNT_CLAIMED, (base_url, epoch)
+                ).fetchone()[0]
+                free = self.max_in_flight - claimed
+                if free <= 0:
+                    continue
+                rows = self._con.execute(
+                    self.SELECT_NEXT, (base_url, epoch, free)
+                ).fetchall()
+                for row in rows:
+                    self._con.execute(
+                        self.CLAIM, (self.owner, epoch + self.claim_timeout, row["id"])
+                    )
+                    messages.append(row)
+            self._con.execute("COMMIT")
+        except BaseException:
+            self._con.execute("ROLLBACK")
+            raise
+        return messages, next_retry
+
+    def _run(self):
+        with self._condition:
+            while not self.__stop:
+                now = time.monotonic()
+                messages, next_retry = self._next_messages(now)
+                for message in messages:
+                    self._executor.submit(self._deliver, message)
+                if not messages:
+                    timeout = self.poll_interval
+                    if next_retry is not None:
+                        timeout = min(timeout, next_retry - now)
+                    self._condition.wait(timeout)
+
+    def _deliver(self, message: sqlite3.Row):
+        base_url = message["base_url"]
+        try:
+            self.client.post(
+                base_url,
+                message["path"],
+                message["token"],
+                json.loads(message["data"]),
+                message["correlation"],
+                headers={"X-Request-ID": message["request_id"]},
+            )
+            delivered = True
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code
+            # the peer rejected the message, retrying would not help
+            delivered = 400 <= status < 500 and status not in (408, 429)
+            log.warning(f"{status} - delivering {message['path']} to {base_url}")
+        except requests.exceptions.RequestException as e:
+            delivered = False
+            log.warning(f"delivering {message['path']} to {base_url} failed: {e}")
+        except Exception:
+            delivered = False
+            log.exception(f"delivering {message['path']} to {base_url} failed")
+
+        with self._condition:
+            peer = self._peer(base_url)
+            if delivered:
+                self._con.execute(self.DELETE, (message["id"],))
+                peer.failures = 0
+                peer.retry_at = 0.0
+            else:
+                self._con.execute(self.RELEASE, (message["id"], self.owner))
+                peer.failures += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (peer.failures - 1))
+                # jitter spreads the retries of many peers
+                peer.retry_at = time.monotonic() + delay * random.uniform(0.5, 1)
+            self._condition.notify()
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import List, Optional
+
+from dateutil import parser
+
+# fields of the endpoints which are stored as epoch seconds
+TIMESTAMP_FIELDS = ("next_heartbeat", "offline_at")
+
+
+def EtoS(epoch: float) -> str:
+    """
+    formats epoch seconds as naive local ISO string
+    """
+    return datetime.fromtimestamp(epoch).isoformat()
+
+
+def toEpoch(value) -> Optional[float]:
+    """
+    returns the epoch seconds of a stored timestamp.
+    ISO strings written by older versions are parsed as well.
+    """
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return parser.parse(value).timestamp()
+
+
+class EndpointRecord(object):
+    """
+    An endpoint registered at this participant.
+
+    `client_token` and `base_url` are used to send messages to the endpoint.
+    Timestamps are epoch seconds, fields which are not set are None.
+    `to_dict` and `from_dict` convert from and to the layout of the JSON registry:
+
+    {"register": {"token": ..., "base_url": ...}, "required_behavior": ...,
+     "group_ids": ..., "new": ..., "should_register": ...,
+     "next_heartbeat": ..., "offline_at": ...}
+    """
+
+    __slots__ = (
+        "client_token",
+        "base_url",
+        "required_behavior",
+        "group_ids",
+        "new",
+        "should_register",
+        "next_heartbeat",
+        "offline_at",
+    )
+
+    def __init__(
+        self,
+        client_token: str = None,
+        base_url: str = None,
+        required_behavior: dict = None,
+        group_ids: List[str] = None,
+        new: bool = None,
+        should_register: bool = None,
+        next_heartbeat: float = None,
+        offline_at: float = None,
+    ):
+        self.client_token = client_token
+        self.base_url = base_url
+        self.required_behavior = required_behavior
+        self.group_ids = group_ids
+        self.new = new
+        self.should_register = should_register
+        self.next_heartbeat = next_heartbeat
+        self.offline_at = offline_at
+
+    @property
+    def heartbeat_interval(self) -> Optional[int]:
+        if not self.required_behavior:
+            return None
+        return self.required_behavior.get("heartbeat_interval")
+
+    def update(self, changes: dict):
+        """
+        sets the given fields, e.g. the changes of the background job
+        """
+        for field, value in changes.items():
+            setattr(self, field, value)
+
+    def copy(self) -> EndpointRecord:
+        record = EndpointRecord.__new__(EndpointRecord)
+        for field in self.__slots__:
+            setattr(record, field, getattr(self, field))
+        if self.required_behavior is not None:
+            record.required_behavior = dict(self.required_behavior)
+        if self.group_ids is not None:
+            record.group_ids = list(self.group_ids)
+        return record
+
+    @classmethod
+    def from_dict(cls, data: dict) -> EndpointRecord:
+        register = data.get("register") or {}
+        return cls(
+            register.get("token"),
+            register.get("base_url"),
+            data.get("required_behavior"),
+            data.get("group_ids"),
+            data.get("new"),
+            data.get("should_register"),
+            toEpoch(data.get("next_heartbeat")),
+            toEpoch(data.get("offline_at")),
+        )
+
+    def to_dict(self, iso: bool = False) -> dict:
+        """
+        returns the endpoint in the layout of the JSON registry,
+        with timestamps as ISO strings if iso is True
+        """
+        data = {"register": {"token": self.client_token, "base_url": self.base_url}}
+        for field in ("required_behavior", "group_ids", "new", "should_register"):
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        for field in TIMESTAMP_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = EtoS(value) if iso else value
+        return data
+
+    def __eq__(self, other):
+        if not isinstance(other, EndpointRecord):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __repr__(self):
+        return f"EndpointRecord({self.to_dict()!r})"
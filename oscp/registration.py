@@ -10,6 +10,7 @@ from __future__ import annotations
 
 from flask_restx import Resource
 
+from oscp.dedup import idempotent
 from oscp.json_models import (
     Handshake,
     HandshakeAcknowledgement,
@@ -48,6 +49,7 @@ def namespace_registration(namespace):
             super().__init__(api, *args, **kwargs)
 
         @namespace.expect(Register)
+        @idempotent
         def post(self):
             """
             Registering endpoints is needed in order to make sure the received messages on these endpoints actually come from the designated party(UND DAS HIER?!)
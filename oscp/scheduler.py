@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Hashable, List
+
+
+class DeadlineScheduler(object):
+    """
+    Keeps the next due time for each key in a priority queue.
+
+    Deadlines are given in `time.monotonic()` seconds.
+    A worker calls `wait()` which sleeps exactly until the earliest deadline
+    and returns all keys which are due by then.
+    Scheduling a key which already has an earlier deadline keeps the earlier one,
+    so a wake-up requested while the key is processed is never lost.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def schedule(self, key: Hashable, deadline: float = None):
+        """
+        schedules the key at the given deadline, defaults to now
+        """
+        if deadline is None:
+            deadline = time.monotonic()
+        with self._condition:
+            current = self._deadlines.get(key)
+            if current is not None and current <= deadline:
+                return
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._counter), key))
+            if self._heap[0][2] == key:
+                # the earliest deadline changed, the worker has to wake up earlier
+                self._condition.notify()
+
+    def cancel(self, key: Hashable):
+        with self._condition:
+            # the heap entry is skipped once it reaches the top
+            self._deadlines.pop(key, None)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def wait(self) -> List[Hashable]:
+        """
+        blocks until at least one key is due and returns the due keys.
+        Returns an empty list once the scheduler is stopped.
+        """
+        with self._condition:
+            while not self._stopped:
+                self._drop_cancelled()
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        deadline, _, key = heapq.heappop(self._heap)
+                        if self._deadlines.get(key) == deadline:
+                            del self._deadlines[key]
+                            due.append(key)
+                    return due
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._condition.wait(timeout)
+            return []
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _drop_cancelled(self):
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                break
+            heapq.heappop(self._heap)
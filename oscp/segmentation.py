@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+from werkzeug.exceptions import BadRequest
+
+log = logging.getLogger("oscp")
+
+
+def split_message(data: dict, segment_size: int) -> List[dict]:
+    """
+    splits the list fields of a message (e.g. forecasted_blocks or measurements)
+    into segments with at most segment_size items each.
+    The other fields are repeated in every segment.
+    """
+    lists = {key: value for key, value in data.items() if isinstance(value, list)}
+    longest = max((len(value) for value in lists.values()), default=0)
+    count = max(1, math.ceil(longest / segment_size))
+    if count == 1:
+        return [data]
+    segments = []
+    for index in range(count):
+        segment = dict(data)
+        start = index * segment_size
+        for key, value in lists.items():
+            segment[key] = value[start : start + segment_size]
+        segments.append(segment)
+    return segments
+
+
+def merge_segments(segments: List[dict]) -> dict:
+    """
+    reassembles the segments of a message in the given order,
+    the list fields are concatenated, the other fields are taken from the first segment
+    """
+    message = dict(segments[0])
+    for key, value in message.items():
+        if isinstance(value, list):
+            message[key] = [item for segment in segments for item in segment[key]]
+    return message
+
+
+def segment_headers(index: int, count: int, segment_id: str) -> dict:
+    """
+    returns the headers of the segment with the given index, starting at 1.
+    All segments of a message have the same segment_id.
+    """
+    return {
+        "X-Segment-ID": segment_id,
+        "X-Segment-Index": str(index),
+        "X-Segment-Count": str(count),
+    }
+
+
+class _Pending(object):
+    __slots__ = ("created", "count", "segments", "size")
+
+    def __init__(self, count: int):
+        self.created = time.monotonic()
+        self.count = count
+        self.segments = {}
+        self.size = 0
+
+
+class SegmentBuffer(object):
+    """
+    Buffers the segments of inbound messages until all segments are received.
+
+    Segments are identified by a key containing the X-Segment-ID and the
+    X-Segment-Index, which starts at 1. Receiving a segment twice replaces it,
+    so retried segments are harmless.
+    Incomplete messages are dropped after `ttl` seconds. If the buffered
+    segments exceed `max_size` bytes, the oldest incomplete messages are dropped.
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.size = 0
+        self._pending: OrderedDict[Hashable, _Pending] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(
+        self, key: Hashable, index: int, count: int, payload: dict, size: int = 0
+    ) -> Optional[dict]:
+        """
+        buffers a segment and returns the reassembled message
+        once all segments of the key were received, None otherwise
+
+        Raises
+        ------
+        BadRequest
+            if index is not between 1 and count
+        """
+        if count < 1 or not 1 <= index <= count:
+            raise BadRequest(f"invalid segment {index} of {count}")
+        if count == 1:
+            return payload
+        with self._lock:
+            self._expire(time.monotonic())
+            pending = self._pending.get(key)
+            if pending is None or pending.count != count:
+                if pending is not None:
+                    # the message was split again with another segment size
+                    self._drop(key)
+                pending = self._pending[key] = _Pending(count)
+            if index not in pending.segments:
+                pending.size += size
+                self.size += size
+            pending.segments[index] = payload
+            if len(pending.segments) < count:
+                self._evict()
+                return None
+            self._drop(key)
+        return merge_segments([pending.segments[i] for i in range(1, count + 1)])
+
+    def _drop(self, key: Hashable):
+        pending = self._pending.pop(key)
+        self.size -= pending.size
+
+    def _expire(self, now: float):
+        while self._pending:
+            key, pending = next(iter(self._pending.items()))
+            if now - pending.created < self.ttl:
+                break
+            # the key is not logged, it contains the token of the peer
+            log.warning(
+                "dropping incomplete message, "
+                f"received {len(pending.segments)} of {pending.count} segments"
+            )
+            self._drop(key)
+
+    def _evict(self):
+        while self.size > self.max_size and self._pending:
+            key = next(iter(self._pending))
+            log.warning("segment buffer is full, dropping incomplete message")
+            self._drop(key)
+
+    def __len__(self):
+        return len(self._pending)
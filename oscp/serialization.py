@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+from datetime import datetime
+from functools import lru_cache, wraps
+from typing import Callable, Dict
+
+from flask import current_app, make_response, request
+from flask_restx import Api, Namespace, fields, marshal
+from flask_restx.fields import MarshallingError
+from flask_restx.marshalling import marshal_with as restx_marshal_with
+from flask_restx.representations import output_json
+from flask_restx.utils import unpack
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+Serializer = Callable[[object], object]
+
+# fields whose format returns values of these types unchanged
+_UNCHANGED = {
+    fields.String: str,
+    fields.Float: float,
+    fields.Integer: int,
+    fields.Boolean: bool,
+    fields.Raw: object,
+}
+
+
+def _generic(key: str, field: fields.Raw) -> Serializer:
+    return lambda obj: field.output(key, obj)
+
+
+def _is_plain(key: str, field: fields.Raw) -> bool:
+    """
+    the value of the field is obj[key] for dicts, like get_value does
+    """
+    return (
+        field.attribute is None
+        and not field.mask
+        and not callable(field.default)
+        and "." not in key
+        # get_value falls back to the attributes of the dict
+        and not hasattr(dict, key)
+    )
+
+
+class ModelSerializer(object):
+    """
+    Builds a serializer for each model which returns the same output as
+    `flask_restx.marshal` without skip_none, envelope and mask.
+
+    The fields are resolved once, dicts and lists are handled by specialized
+    functions per field. Other values, e.g. objects or values which need
+    formatting, use the field itself, so the output and the errors are the same.
+    """
+
+    def __init__(self):
+        self._serializers: Dict[int, Serializer] = {}
+
+    def serializer(self, model) -> Serializer:
+        key = id(model)
+        if key not in self._serializers:
+            serializers = self._serializers
+            # used by recursive models while the serializer is built
+            serializers[key] = lambda obj: serializers[key](obj)
+            serializers[key] = self._build(model)
+        return self._serializers[key]
+
+    def marshal(self, data, model):
+        if isinstance(data, (list, tuple)):
+            serialize = self.serializer(model)
+            return [serialize(item) for item in data]
+        return self.serializer(model)(data)
+
+    def _build(self, model) -> Serializer:
+        resolved = getattr(model, "resolved", model)
+        if getattr(model, "__mask__", None) or any(
+            isinstance(field, (dict, fields.Wildcard)) for field in resolved.values()
+        ):
+            return lambda obj: marshal(obj, model)
+        items = [(key, self._field(key, field)) for key, field in resolved.items()]
+
+        def serialize(obj):
+            if type(obj) is not dict:
+                return marshal(obj, model)
+            return {key: serialize_field(obj) for key, serialize_field in items}
+
+        return serialize
+
+    def _field(self, key: str, field) -> Serializer:
+        if isinstance(field, type):
+            field = field()
+        if not _is_plain(key, field):
+            return _generic(key, field)
+        if isinstance(field, fields.List):
+            return self._list(key, field)
+        if isinstance(field, fields.Nested):
+            return self._nested(key, field)
+        if type(field) is fields.DateTime and field.dt_format == "iso8601":
+            return self._datetime(key, field)
+        expected = _UNCHANGED.get(type(field))
+        if expected is None:
+            return _generic(key, field)
+        default = field.format(field.default) if field.default else field.default
+
+        def serialize_field(obj):
+            value = obj.get(key)
+            if value is None:
+                return default
+            if expected is object or type(value) is expected:
+                return value
+            return field.output(key, obj)
+
+        return serialize_field
+
+    def _datetime(self, key: str, field: fields.DateTime) -> Serializer:
+        default = field.format(field.default) if field.default else field.default
+        # consecutive blocks share their start and end times
+        format_string = lru_cache(maxsize=4096)(field.format)
+
+        def serialize_datetime(obj):
+            value = obj.get(key)
+            if value is None:
+                return default
+            if type(value) is datetime:
+                return value.isoformat()
+            if type(value) is str:
+                try:
+                    return format_string(value)
+                except MarshallingError:
+                    # raised again with the key by output
+                    pass
+            return field.output(key, obj)
+
+        return serialize_datetime
+
+    def _nested_value(self, field: fields.Nested) -> Serializer:
+        if field.skip_none:
+            return lambda value: marshal(value, field.nested, skip_none=True)
+        serialize = self.serializer(field.nested)
+
+        def serialize_value(value):
+            if value is None:
+                if field.allow_null:
+                    return None
+                elif field.default is not None:
+                    return field.default
+            return serialize(value)
+
+        return serialize_value
+
+    def _nested(self, key: str, field: fields.Nested) -> Serializer:
+        serialize_value = self._nested_value(field)
+        return lambda obj: serialize_value(obj.get(key))
+
+    def _list(self, key: str, field: fields.List) -> Serializer:
+        container = field.container
+        if not isinstance(container, fields.Nested) or not _is_plain(key, container):
+            return _generic(key, field)
+        serialize_item = self._nested_value(container)
+
+        def serialize_list(obj):
+            value = obj.get(key)
+            if type(value) is not list:
+                return field.output(key, obj)
+            return [serialize_item(item) for item in value]
+
+        return serialize_list
+
+
+class ResponseSerializer(ModelSerializer):
+    """
+    Marshals the responses of the resources using `marshal_with` below.
+
+    In "compat" mode the responses are encoded by flask-restx as before,
+    so they are identical byte for byte.
+    In "fast" mode the responses of the api are encoded with orjson if it is
+    installed. The output is compact and floats can be formatted differently.
+    """
+
+    MODES = ("compat", "fast")
+
+    def __init__(self, mode: str = "compat"):
+        if mode not in self.MODES:
+            raise ValueError(
+                f"unknown response encoding {mode}, use one of {self.MODES}"
+            )
+        super().__init__()
+        self.mode = mode
+
+    def install(self, api: Api):
+        """
+        builds the serializers of the marshalled models of the api and
+        sets the json representation in fast mode
+        """
+        for ns in api.namespaces:
+            for resource in ns.resources:
+                for name in dir(resource.resource):
+                    method = getattr(resource.resource, name)
+                    model = getattr(method, "__oscp_marshal__", None)
+                    if model is not None:
+                        self.serializer(model)
+        if self.mode == "fast" and orjson is not None:
+            api.representations["application/json"] = output_orjson
+
+
+def output_orjson(data, code, headers=None):
+    """
+    like flask_restx.representations.output_json, but encoded with orjson.
+    Falls back to output_json if RESTX_JSON settings or debug indentation is used.
+    """
+    if current_app.config.get("RESTX_JSON") or current_app.debug:
+        return output_json(data, code, headers)
+    try:
+        dumped = orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    except TypeError:
+        # e.g. keys which are not strings
+        return output_json(data, code, headers)
+    resp = make_response(dumped, code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def marshal_with(namespace: Namespace, model, **kwargs):
+    """
+    Like `namespace.marshal_with(model)` and documented the same way.
+
+    If a ResponseSerializer is injected as `serializer` into the resource,
+    the response is marshalled with it, unless a X-Fields mask is requested.
+    Error responses returned by the resource, e.g. the 503 of a full
+    Dispatcher, are not marshalled.
+    """
+
+    if kwargs.keys() & {"envelope", "skip_none", "mask"}:
+        return namespace.marshal_with(model, **kwargs)
+
+    def decorator(func):
+        standard = namespace.marshal_with(model, **kwargs)(func)
+        marshaller = restx_marshal_with(model, ordered=namespace.ordered)
+
+        @wraps(standard)
+        def wrapper(resource, *args, **kw):
+            resp = func(resource, *args, **kw)
+            if isinstance(resp, tuple) and unpack(resp)[1] >= 400:
+                return resp
+            serializer = getattr(resource, "serializer", None)
+            mask_header = current_app.config["RESTX_MASK_HEADER"]
+            if (
+                serializer is None
+                or namespace.ordered
+                or request.headers.get(mask_header)
+            ):
+                return marshaller(lambda: resp)()
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return serializer.marshal(data, model), code, headers
+            return serializer.marshal(resp, model)
+
+        wrapper.__oscp_marshal__ = model
+        return wrapper
+
+    return decorator
@@ -0,0 +1,252 @@
+"""
+Vectorized conversion between the units of forecasted blocks and measurements.
+
+Requires numpy, which can be installed with `pip install pyoscp[numpy]`.
+
+    converter = UnitConverter(voltage=230, phase_count=3)
+    hours = durations(blocks.start, blocks.end)
+    kw = converter.convert(blocks.capacity, blocks.unit, "KW", blocks.phase, hours)
+    forecasts = converter.normalize_forecasts(forecasts, "KW")
+"""
+
+from __future__ import annotations
+
+from dataclasses import replace
+from typing import List, Optional, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from oscp.columnar import (
+    MISSING,
+    PHASES,
+    UNITS,
+    BlockColumns,
+    MeasurementColumns,
+    encode,
+)
+
+# dimensions of the units
+CURRENT, POWER, ENERGY, CURRENCY, ENERGY_PRICE, POWER_PRICE = range(6)
+# currents, powers and energies can be converted into each other
+ELECTRICAL = (CURRENT, POWER, ENERGY)
+
+# dimension and factor to the base unit of the dimension
+UNIT_TABLE = {
+    "A": (CURRENT, 1.0),
+    "W": (POWER, 1.0),
+    "KW": (POWER, 1000.0),
+    "WH": (ENERGY, 1.0),
+    "KWH": (ENERGY, 1000.0),
+    "EUR": (CURRENCY, 1.0),
+    "EUR/KWH": (ENERGY_PRICE, 1.0),
+    "EUR/KW": (POWER_PRICE, 1.0),
+}
+
+# currents of these phases are converted with the voltage of a single phase
+SINGLE_PHASES = ("ONE", "TWO", "THREE")
+
+
+def _column(index: int, default) -> np.ndarray:
+    # indexed by the unit codes, the last entry is looked up by missing codes
+    return np.array([UNIT_TABLE[u][index] for u in UNITS] + [default])
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(
+            "numpy is required for the unit conversion, install pyoscp[numpy]"
+        )
+
+
+def durations(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """
+    returns the hours between two datetime64 arrays, NaN if a time is missing
+    or the interval is empty
+    """
+    hours = (end - start) / np.timedelta64(1, "h")
+    return np.where(hours > 0, hours, np.nan)
+
+
+class UnitConverter(object):
+    """
+    Converts values between the units of OSCP using lookup tables
+    indexed by the unit codes of oscp.columnar.
+
+    Values of the same dimension are scaled. Currents are converted to
+    powers with the `voltage` for single phases and with `phase_count`
+    times the voltage for all (or unknown) phases. Energies are converted
+    to powers by dividing by the duration in hours.
+    Values which can not be converted become NaN.
+    """
+
+    def __init__(self, voltage: float = 230.0, phase_count: int = 3):
+        _require_numpy()
+        self.voltage = voltage
+        self.phase_count = phase_count
+        self._dimensions = _column(0, -1)
+        self._factors = _column(1, np.nan)
+        self._single = np.array([p in SINGLE_PHASES for p in PHASES] + [False])
+
+    def codes(self, units: Union[np.ndarray, Sequence[Optional[str]], str], size=None):
+        """
+        returns the unit codes of unit names, a single name is repeated `size` times
+        """
+        if isinstance(units, str):
+            return np.full(size, UNITS.index(units), dtype=np.int8)
+        if isinstance(units, np.ndarray) and units.dtype.kind == "i":
+            return units
+        return encode(units, UNITS)
+
+    def volts(self, phases: Optional[np.ndarray]) -> Union[np.ndarray, float]:
+        """
+        returns the factor from A to W for the phase codes
+        """
+        if phases is None:
+            return self.voltage * self.phase_count
+        single = self._single[np.where(phases == MISSING, len(PHASES), phases)]
+        return np.where(single, self.voltage, self.voltage * self.phase_count)
+
+    def convert(
+        self,
+        values: np.ndarray,
+        units,
+        to: str,
+        phases: np.ndarray = None,
+        hours: np.ndarray = None,
+    ) -> np.ndarray:
+        """
+        converts values with the given unit codes (or names) to the unit `to`.
+        `phases` are the phase codes for converting currents,
+        `hours` the durations for converting energies.
+        """
+        if to not in UNIT_TABLE:
+            raise ValueError(f"unknown unit {to!r}, expected one of {UNITS}")
+        target, target_factor = UNIT_TABLE[to]
+        values = np.asarray(values, dtype=np.float64)
+        codes = self.codes(units, len(values))
+        lookup = np.where(codes == MISSING, len(UNITS), codes)
+        dimension = self._dimensions[lookup]
+        base = values * self._factors[lookup]
+        if target in ELECTRICAL:
+            volts = self.volts(phases)
+            if hours is None:
+                hours = np.nan
+            with np.errstate(divide="ignore", invalid="ignore"):
+                watts = np.select(
+                    [dimension == CURRENT, dimension == POWER, dimension == ENERGY],
+                    [base * volts, base, base / hours],
+                    np.nan,
+                )
+                if target == CURRENT:
+                    converted = watts / volts
+                elif target == ENERGY:
+                    converted = watts * hours
+                else:
+                    converted = watts
+            # values of the same dimension are only scaled
+            converted = np.where(dimension == target, base, converted)
+        else:
+            converted = np.where(dimension == target, base, np.nan)
+        return converted / target_factor
+
+    def convert_blocks(self, blocks: BlockColumns, unit: str = "KW") -> BlockColumns:
+        """
+        returns the blocks with the capacities converted to `unit`,
+        blocks which can not be converted are kept in their unit
+        """
+        hours = durations(blocks.start, blocks.end)
+        capacity = self.convert(blocks.capacity, blocks.unit, unit, blocks.phase, hours)
+        converted = ~np.isnan(capacity)
+        return replace(
+            blocks,
+            capacity=np.where(converted, capacity, blocks.capacity),
+            unit=np.where(converted, UNITS.index(unit), blocks.unit).astype(np.int8),
+        )
+
+    def convert_measurements(
+        self, measurements: MeasurementColumns, unit: str = "KWH"
+    ) -> MeasurementColumns:
+        """
+        returns the measurements with the values converted to `unit`,
+        measurements which can not be converted are kept in their unit.
+        The durations of energies are taken from initial_measure_time to measure_time.
+        """
+        hours = durations(measurements.initial_measure_time, measurements.measure_time)
+        value = self.convert(
+            measurements.value, measurements.unit, unit, measurements.phase, hours
+        )
+        converted = ~np.isnan(value)
+        return replace(
+            measurements,
+            value=np.where(converted, value, measurements.value),
+            unit=np.where(converted, UNITS.index(unit), measurements.unit).astype(
+                np.int8
+            ),
+        )
+
+    def normalize_forecasts(
+        self, forecasts: Sequence[dict], unit: str = "KW"
+    ) -> List[dict]:
+        """
+        converts the capacities of the forecasted_blocks of all forecasts
+        (GroupCapacityForecast or GroupCapacityPrice) to `unit` at once.
+        Returns copies, blocks which can not be converted (e.g. prices) are kept.
+        """
+        return self._normalize(
+            forecasts, "forecasted_blocks", "capacity", unit, self._convert_blocks
+        )
+
+    def normalize_measurements(
+        self, payloads: Sequence[dict], unit: str = "KWH"
+    ) -> List[dict]:
+        """
+        converts the values of the measurements of all UpdateGroupMeasurements
+        to `unit` at once. Returns copies, measurements which can not be
+        converted are kept.
+        """
+        return self._normalize(
+            payloads, "measurements", "value", unit, self._convert_measurements
+        )
+
+    def normalize(self, payload: dict, unit: str = None) -> dict:
+        """
+        converts a single forecast to KW or UpdateGroupMeasurements to KWH,
+        or to the given unit
+        """
+        if "measurements" in payload:
+            return self.normalize_measurements([payload], unit or "KWH")[0]
+        return self.normalize_forecasts([payload], unit or "KW")[0]
+
+    def _convert_blocks(self, blocks: List[dict], unit: str) -> np.ndarray:
+        columns = BlockColumns.from_blocks(blocks)
+        hours = durations(columns.start, columns.end)
+        return self.convert(columns.capacity, columns.unit, unit, columns.phase, hours)
+
+    def _convert_measurements(self, measurements: List[dict], unit: str) -> np.ndarray:
+        columns = MeasurementColumns.from_measurements(measurements)
+        hours = durations(columns.initial_measure_time, columns.measure_time)
+        return self.convert(columns.value, columns.unit, unit, columns.phase, hours)
+
+    def _normalize(self, payloads, key, field, unit, convert) -> List[dict]:
+        items = [item for payload in payloads for item in payload.get(key) or []]
+        values = convert(items, unit).tolist() if items else []
+        normalized = []
+        position = 0
+        for payload in payloads:
+            if key not in payload:
+                normalized.append(dict(payload))
+                continue
+            end = position + len(payload[key] or [])
+            converted = []
+            for item, value in zip(items[position:end], values[position:end]):
+                if value != value:
+                    # NaN, kept in its unit
+                    converted.append(item)
+                else:
+                    converted.append(dict(item, **{field: value, "unit": unit}))
+            position = end
+            normalized.append(dict(payload, **{key: converted}))
+        return normalized
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import logging
+import numbers
+from http import HTTPStatus
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask_restx import Api
+from flask_restx.errors import abort
+from flask_restx.model import ModelBase
+
+log = logging.getLogger("oscp")
+
+# a check returns None if the value is valid,
+# otherwise a list of (path, message) relative to the value
+Errors = List[Tuple[tuple, str]]
+Check = Callable[[object], Optional[Errors]]
+
+# keywords which do not change the validation result
+ANNOTATIONS = {
+    "$id",
+    "$schema",
+    "definitions",
+    "title",
+    "description",
+    "example",
+    "default",
+    "format",
+    "readOnly",
+    "discriminator",
+}
+
+
+def _is_integer(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) or (isinstance(value, float) and value.is_integer())
+
+
+def _is_draft4_integer(value) -> bool:
+    # draft 4 does not accept floats without a fractional part, e.g. 5.0
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+TYPES = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "integer": _is_integer,
+    "number": _is_number,
+    "boolean": lambda value: isinstance(value, bool),
+    "null": lambda value: value is None,
+}
+DRAFT4_TYPES = dict(TYPES, integer=_is_draft4_integer)
+
+
+def _is_draft4(resolver) -> bool:
+    """
+    returns True if `Model.validate` uses a Draft4Validator with the resolver.
+    Older flask-restx versions pass a jsonschema RefResolver and validate
+    with draft 4, newer ones pass a referencing Registry and validate with
+    the latest draft.
+    """
+    return hasattr(resolver, "resolve")
+
+
+class NotCompilable(Exception):
+    """
+    the schema uses a keyword which is not supported by the compiler
+    """
+
+
+def _prefix(key, errors: Errors) -> Errors:
+    return [((key,) + path, message) for path, message in errors]
+
+
+def _chain(checks: List[Check]) -> Check:
+    """
+    runs all checks and concatenates their errors
+    """
+    if not checks:
+        return lambda value: None
+    if len(checks) == 1:
+        return checks[0]
+
+    def check_all(value):
+        errors = None
+        for check in checks:
+            found = check(value)
+            if found:
+                errors = found if errors is None else errors + found
+        return errors
+
+    return check_all
+
+
+class SchemaCompiler(object):
+    """
+    Compiles the JSON schemas of flask-restx models into plain python checks.
+
+    The checks follow the draft 2020-12 semantics used by `Model.validate`,
+    or draft 4 if `draft4` is True, the errors are reported in the same order
+    and with the same messages.
+    References are resolved by name from `definitions`, the models of the api.
+    """
+
+    def __init__(self, definitions: Dict[str, dict], draft4: bool = False):
+        self.definitions = definitions
+        self.draft4 = draft4
+        self._types = DRAFT4_TYPES if draft4 else TYPES
+        self._compiled: Dict[str, Check] = {}
+
+    def compile_model(self, name: str) -> Check:
+        if name not in self._compiled:
+            if name not in self.definitions:
+                raise NotCompilable(f"unknown model {name}")
+            # register before compiling, so recursive models terminate
+            self._compiled[name] = None
+            try:
+                self._compiled[name] = self.compile(self.definitions[name])
+            except NotCompilable:
+                del self._compiled[name]
+                raise
+        compiled = self._compiled
+
+        def check_ref(value):
+            return compiled[name](value)
+
+        return compiled[name] or check_ref
+
+    def compile(self, schema: dict) -> Check:
+        if not isinstance(schema, dict):
+            raise NotCompilable(f"unsupported schema {schema!r}")
+        if self.draft4 and "$ref" in schema:
+            # draft 4 ignores the other keywords next to a reference
+            return self._keyword_ref(schema["$ref"], schema)
+        checks = []
+        for keyword, argument in schema.items():
+            if keyword in ANNOTATIONS:
+                continue
+            factory = getattr(self, f"_keyword_{keyword.lstrip('$')}", None)
+            if factory is None:
+                raise NotCompilable(f"unsupported keyword {keyword}")
+            checks.append(factory(argument, schema))
+
+        return _chain(checks)
+
+    def _keyword_type(self, types, schema) -> Check:
+        types = types if isinstance(types, list) else [types]
+        try:
+            predicates = [self._types[t] for t in types]
+        except KeyError as e:
+            raise NotCompilable(f"unsupported type {e.args[0]}")
+        reprs = ", ".join(repr(t) for t in types)
+        if len(predicates) == 1:
+            (predicate,) = predicates
+
+            def check_type(value):
+                if not predicate(value):
+                    return [((), f"{value!r} is not of type {reprs}")]
+
+        else:
+
+            def check_type(value):
+                if not any(predicate(value) for predicate in predicates):
+                    return [((), f"{value!r} is not of type {reprs}")]
+
+        return check_type
+
+    def _keyword_enum(self, enums, schema) -> Check:
+        if not all(isinstance(e, str) for e in enums):
+            raise NotCompilable("only string enums are supported")
+        allowed = frozenset(enums)
+
+        def check_enum(value):
+            if not (isinstance(value, str) and value in allowed):
+                return [((), f"{value!r} is not one of {enums!r}")]
+
+        return check_enum
+
+    def _keyword_required(self, required, schema) -> Check:
+        def check_required(value):
+            if not isinstance(value, dict):
+                return None
+            missing = [p for p in required if p not in value]
+            if missing:
+                return [((p,), f"{p!r} is a required property") for p in missing]
+
+        return check_required
+
+    def _keyword_properties(self, properties, schema) -> Check:
+        checks = [(name, self.compile(sub)) for name, sub in properties.items()]
+
+        def check_properties(value):
+            if not isinstance(value, dict):
+                return None
+            errors = None
+            for name, check in checks:
+                if name in value:
+                    found = check(value[name])
+                    if found:
+                        found = _prefix(name, found)
+                        errors = found if errors is None else errors + found
+            return errors
+
+        return check_properties
+
+    def _keyword_items(self, items, schema) -> Check:
+        if not isinstance(items, dict) or "prefixItems" in schema:
+            raise NotCompilable("only a single items schema is supported")
+        check = self.compile(items)
+
+        def check_items(value):
+            if not isinstance(value, list):
+                return None
+            errors = None
+            for index, item in enumerate(value):
+                found = check(item)
+                if found:
+                    found = _prefix(index, found)
+                    errors = found if errors is None else errors + found
+            return errors
+
+        return check_items
+
+    def _keyword_allOf(self, subschemas, schema) -> Check:
+        return _chain([self.compile(sub) for sub in subschemas])
+
+    def _keyword_ref(self, ref, schema) -> Check:
+        prefix = "#/definitions/"
+        if not isinstance(ref, str) or not ref.startswith(prefix):
+            raise NotCompilable(f"unsupported reference {ref}")
+        return self.compile_model(ref[len(prefix) :])
+
+
+def format_errors(errors: Errors) -> dict:
+    """
+    returns the errors keyed by their dotted path like `Model.format_error`
+    """
+    return {".".join(str(p) for p in path): message for path, message in errors}
+
+
+class CompiledValidator(object):
+    """
+    Replacement for `Model.validate` using the checks compiled for each api.
+
+    The models are shared by the blueprints, so the api is recognized by
+    the resolver passed by the resource. Payloads of other apis and payloads
+    validated with a format checker, which the compiled checks do not support,
+    use the jsonschema validation of the model.
+    """
+
+    def __init__(self, model: ModelBase):
+        self.model = model
+        # the checks of each api, for draft 2020-12 and for draft 4
+        self.checks: List[Tuple[Api, Check, Check]] = []
+
+    def __call__(self, data, resolver=None, format_checker=None):
+        check = self._check_for(resolver) if format_checker is None else None
+        if check is None:
+            return type(self.model).validate(self.model, data, resolver, format_checker)
+        errors = check(data)
+        if errors:
+            abort(
+                HTTPStatus.BAD_REQUEST,
+                message="Input payload validation failed",
+                errors=format_errors(errors),
+            )
+
+    def _check_for(self, resolver) -> Optional[Check]:
+        if resolver is None:
+            return None
+        for api, check, draft4_check in self.checks:
+            # the resolver is created on first use and cached by the api
+            if api._refresolver is resolver:
+                return draft4_check if _is_draft4(resolver) else check
+        return None
+
+
+def expected_models(api: Api):
+    """
+    yields the models expected by the resources of the api.
+    These are copies of the models in `api.models`, made by `Namespace.expect`.
+    """
+    for ns in api.namespaces:
+        for resource in ns.resources:
+            for name in dir(resource.resource):
+                doc = getattr(getattr(resource.resource, name), "__apidoc__", None)
+                if not doc:
+                    continue
+                for expect in doc.get("expect", []):
+                    if isinstance(expect, list) and len(expect) == 1:
+                        expect = expect[0]
+                    if isinstance(expect, ModelBase):
+                        yield expect
+
+
+def compileValidators(api: Api):
+    """
+    compiles the expected models of all resources of the api once and
+    uses the compiled checks to validate the payloads of this api.
+    Models which can not be compiled keep the jsonschema validation.
+
+    Must be called after all namespaces are added to the api.
+    """
+    definitions = {name: model.__schema__ for name, model in api.models.items()}
+    # the resolver, which decides the draft, is only created on first use
+    compiler = SchemaCompiler(definitions)
+    draft4_compiler = SchemaCompiler(definitions, draft4=True)
+    compiled = set()
+    for model in expected_models(api):
+        if id(model) in compiled:
+            continue
+        compiled.add(id(model))
+        try:
+            check = compiler.compile(model.__schema__)
+            draft4_check = draft4_compiler.compile(model.__schema__)
+        except NotCompilable as e:
+            log.info(f"using jsonschema validation for {model.name}: {e}")
+            continue
+        validator = model.__dict__.get("validate")
+        if not isinstance(validator, CompiledValidator):
+            validator = model.validate = CompiledValidator(model)
+        validator.checks.append((api, check, draft4_check))
@@ -0,0 +1,8 @@
+from __future__ import annotations
+
+import pytest
+
+
+@pytest.fixture
+def version_urls():
+    return [{"version": "2.0", "base_url": "http://localhost:5000/oscp/fp/2.0"}]
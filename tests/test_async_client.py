@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+import requests
+
+from oscp.async_client import AsyncOscpClient
+from oscp.health import PeerHealth
+from oscp.RegistrationManager import RegistrationSQLiteMan
+
+
+class _Response(object):
+    status_code = 204
+
+
+class FakeClient(object):
+    def __init__(self, down=()):
+        self.health = PeerHealth()
+        self.down = set(down)
+        self.posted = []
+
+    def post(self, base_url, path, token, data=None, correlation=None, headers=None):
+        if base_url in self.down:
+            raise requests.exceptions.ConnectionError(base_url)
+        self.posted.append((base_url, path, token, headers["X-Request-ID"]))
+        return _Response()
+
+
+@pytest.fixture
+def rm(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    for token, group_ids in (("a", ["g1"]), ("b", ["g1", "g2"]), ("c", [])):
+        rm._updateService(token, "client_" + token, f"http://{token}", "2.0")
+        rm._setGroupIds(token, group_ids)
+    return rm
+
+
+def test_send_to_group(rm):
+    client = FakeClient()
+    result = asyncio.run(
+        AsyncOscpClient(rm, client).update_group_measurements(
+            {"group_id": "g2", "measurements": []}
+        )
+    )
+    assert result.ok
+    assert result.token == "b"
+    assert result.status_code == 204
+    assert client.posted == [
+        ("http://b", "/update_group_measurements", "client_b", result.request_id)
+    ]
+
+
+def test_forecasts_are_sent_to_all_peers_of_their_group(rm):
+    client = FakeClient(down={"http://a"})
+    forecasts = [
+        {"group_id": "g1", "type": "CONSUMPTION", "forecasted_blocks": []},
+        {"group_id": "g2", "type": "CONSUMPTION", "forecasted_blocks": []},
+        {"group_id": "unknown", "type": "CONSUMPTION", "forecasted_blocks": []},
+    ]
+    results = asyncio.run(
+        AsyncOscpClient(rm, client).update_group_capacity_forecasts(forecasts)
+    )
+    assert sorted((r.token, r.ok) for r in results) == [
+        ("a", False),
+        ("b", True),
+        ("b", True),
+    ]
+    assert len(client.posted) == 2
+
+
+def test_unknown_peer(rm):
+    result = asyncio.run(
+        AsyncOscpClient(rm, FakeClient()).send("/heartbeat", {}, token="unknown")
+    )
+    assert isinstance(result.error, KeyError)
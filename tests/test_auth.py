@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import Forbidden
+
+from oscp.auth import TokenCache
+from oscp.client import OscpClient
+from oscp.RegistrationManager import (
+    RegistrationDictMan,
+    RegistrationMemoryMan,
+    RegistrationSQLiteMan,
+)
+
+app = Flask(__name__)
+
+
+def test_entries_expire():
+    cache = TokenCache(ttl=0.05, negative_ttl=0.05)
+    cache.put("a", True)
+    cache.put("b", False)
+    assert cache.get("a") is True
+    assert cache.get("b") is False
+    assert cache.get("c") is None
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+
+
+def test_without_ttl_caches_unknown_tokens_only():
+    cache = TokenCache(ttl=0)
+    cache.put("a", True)
+    cache.put("b", False)
+    assert cache.get("a") is None
+    assert cache.get("b") is False
+
+
+def test_invalidate():
+    cache = TokenCache()
+    cache.put("a", True)
+    cache.put("b", False)
+    cache.put("c", True)
+    cache.invalidate("a", "b", None)
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") is True
+
+
+def test_least_recently_used_are_evicted():
+    cache = TokenCache(maxsize=2)
+    cache.put("a", True)
+    cache.put("b", True)
+    cache.get("a")
+    cache.put("c", True)
+    assert cache.get("a") is True
+    assert cache.get("b") is None
+    assert cache.get("c") is True
+
+
+def test_tokens_are_not_stored():
+    cache = TokenCache()
+    cache.put("secret", True)
+    assert "secret" not in repr(cache._positive)
+
+
+def test_shared_registries_do_not_cache_registered_tokens(version_urls, tmp_path):
+    rm = RegistrationDictMan(version_urls, str(tmp_path / "endpoints.json"))
+    assert rm.token_cache.ttl == 0
+    rm.stop()
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    assert rm.token_cache.ttl == 0
+    rm.stop()
+
+
+@pytest.fixture
+def rm(version_urls, tmp_path):
+    rm = RegistrationMemoryMan(
+        version_urls,
+        str(tmp_path / "endpoints.json"),
+        client=OscpClient(retries=0, connect_timeout=0.5),
+    )
+    rm._updateService("a", "client_a", "http://127.0.0.1:9/oscp/fp/2.0", "2.0")
+    yield rm
+    rm.stop()
+
+
+def _check(rm, token):
+    with app.test_request_context(headers={"Authorization": "Token " + token}):
+        return rm._check_access_token()
+
+
+def test_unknown_tokens_are_cached(rm):
+    with pytest.raises(Forbidden):
+        _check(rm, "b")
+    assert rm.token_cache.get("b") is False
+    # registering the token invalidates the negative entry
+    rm._updateService("b", "client_b", "http://b/oscp/fp/2.0", "2.0")
+    assert _check(rm, "b") == "b"
+
+
+def test_unregister_invalidates_token(rm):
+    assert rm.token_cache.ttl > 0
+    assert _check(rm, "a") == "a"
+    assert rm.token_cache.get("a") is True
+    with app.test_request_context(headers={"Authorization": "Token a"}):
+        rm.unregister()
+    with pytest.raises(Forbidden):
+        _check(rm, "a")
+
+
+def test_register_invalidates_replaced_token(rm):
+    assert _check(rm, "a") == "a"
+    payload = {
+        "token": "client_token",
+        "version_url": [{"version": "2.0", "base_url": "http://127.0.0.1:9/oscp/fp"}],
+    }
+    with app.test_request_context(headers={"Authorization": "Token a"}):
+        rm.handleRegister(payload)
+    with pytest.raises(Forbidden):
+        _check(rm, "a")
+    (token,) = rm.getRecords()
+    assert _check(rm, token) == token
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+import requests
+
+from oscp.health import PeerHealth
+from oscp.RegistrationManager import RegistrationMemoryMan, RegistrationSQLiteMan
+
+
+class SlowClient(object):
+    """
+    answers every message after `delay` seconds,
+    messages to the `down` peers fail
+    """
+
+    def __init__(self, delay=0.2, down=()):
+        self.health = PeerHealth()
+        self.delay = delay
+        self.down = set(down)
+        self.posted = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def post(self, base_url, path, token, data=None, correlation=None, headers=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if base_url in self.down:
+                raise requests.exceptions.ConnectionError(base_url)
+            with self.lock:
+                self.posted.append((base_url, path))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def _handshake(rm, token):
+    rm._updateService(token, "client_" + token, f"http://{token}/oscp/fp/2.0", "2.0")
+    rm._setRequiredBehavior(token, {"heartbeat_interval": 30}, new=True)
+
+
+@pytest.fixture(params=[RegistrationSQLiteMan, RegistrationMemoryMan])
+def manager(request, version_urls, tmp_path):
+    managers = []
+
+    def create(client, max_concurrency=8):
+        filename = str(tmp_path / "endpoints")
+        rm = request.param(
+            version_urls, filename, client=client, max_concurrency=max_concurrency
+        )
+        managers.append(rm)
+        return rm
+
+    yield create
+    for rm in managers:
+        rm.stop()
+
+
+def test_endpoints_are_contacted_in_parallel(manager):
+    client = SlowClient(delay=0.2)
+    rm = manager(client, max_concurrency=4)
+    for token in "abcd":
+        _handshake(rm, token)
+
+    start = time.monotonic()
+    rm._background_job()
+    # an ack and a heartbeat per endpoint, four endpoints at a time
+    assert time.monotonic() - start < 0.2 * 8 / 2
+    assert client.max_active == 4
+    assert len(client.posted) == 8
+    for token in "abcd":
+        record = rm.getRecord(token)
+        assert record.new is False
+        assert record.next_heartbeat > time.time()
+
+
+def test_failing_peer_does_not_block_the_others(manager):
+    client = SlowClient(delay=0, down={"http://a/oscp/fp/2.0"})
+    rm = manager(client)
+    _handshake(rm, "a")
+    _handshake(rm, "b")
+
+    rm._background_job()
+    # the failed ack is retried by the next run
+    assert rm.getRecord("a").new is True
+    assert rm.getRecord("b").new is False
+    assert ("http://b/oscp/fp/2.0", "/handshake_acknowledgment") in client.posted
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from oscp.client import OscpClient
+from oscp.health import PeerUnavailable
+
+
+class Peer(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"null")
+        self.server.received.append((self.path, dict(self.headers), body))
+        self.server.ports.add(self.client_address[1])
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def peer():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Peer)
+    server.received = []
+    server.ports = set()
+    server.status = 204
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = f"http://127.0.0.1:{server.server_port}/oscp/fp/2.0"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_connection_is_reused(peer):
+    client = OscpClient()
+    for i in range(3):
+        client.post(peer.base_url, "/heartbeat", "secret", {"n": i}, "c1")
+    assert len(peer.ports) == 1
+    path, headers, body = peer.received[-1]
+    assert path == "/oscp/fp/2.0/heartbeat"
+    assert headers["Authorization"] == "Token secret"
+    assert headers["X-Correlation-ID"] == "c1"
+    assert body == {"n": 2}
+    # every message has its own X-Request-ID
+    assert len({headers["X-Request-ID"] for _, headers, _ in peer.received}) == 3
+    assert client.session(peer.base_url) is client.session(peer.base_url)
+
+    client.close(peer.base_url)
+    assert peer.base_url not in client
+
+
+def test_given_headers_are_sent(peer):
+    OscpClient().post(
+        peer.base_url, "/heartbeat", "secret", {}, headers={"X-Request-ID": "r1"}
+    )
+    assert peer.received[0][1]["X-Request-ID"] == "r1"
+
+
+def test_client_error_does_not_open_breaker(peer):
+    peer.status = 400
+    client = OscpClient()
+    for _ in range(5):
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.post(peer.base_url, "/heartbeat", "secret", {})
+    assert client.health.available(peer.base_url)
+
+
+def test_unreachable_peer_opens_breaker():
+    client = OscpClient(retries=0, connect_timeout=0.5)
+    # nothing listens on the discard port
+    base_url = "http://127.0.0.1:9/oscp/fp/2.0"
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.post(base_url, "/heartbeat", "secret", {})
+    with pytest.raises(PeerUnavailable):
+        client.post(base_url, "/heartbeat", "secret", {})
+
+
+@pytest.mark.parametrize("status, attempts", [(502, 1), (503, 3), (504, 1)])
+def test_only_unavailable_is_retried(peer, status, attempts):
+    peer.status = status
+    client = OscpClient(retries=2, backoff_factor=0)
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.post(peer.base_url, "/heartbeat", "secret", {})
+    assert len(peer.received) == attempts
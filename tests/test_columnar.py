@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from oscp.columnar import (  # noqa: E402
+    PHASES,
+    UNITS,
+    ColumnarForecast,
+    ColumnarMeasurements,
+    _parse_slow,
+    decode,
+    encode,
+    parse_times,
+)
+
+
+def _forecast(*times):
+    return {
+        "group_id": "g1",
+        "type": "CONSUMPTION",
+        "forecasted_blocks": [
+            {
+                "capacity": 10.5,
+                "phase": "ALL",
+                "unit": "KW",
+                "start_time": start,
+                "end_time": end,
+            }
+            for start, end in times
+        ],
+    }
+
+
+def _measurements(*times):
+    return {
+        "group_id": "g1",
+        "measurements": [
+            {
+                "value": 2.5,
+                "phase": "ONE",
+                "unit": "KWH",
+                "energy_type": "TOTAL",
+                "direction": "NET",
+                "measure_time": measure,
+                "initial_measure_time": initial,
+            }
+            for initial, measure in times
+        ],
+    }
+
+
+@pytest.mark.parametrize(
+    "times",
+    [
+        # UTC
+        [("2023-01-01T00:00:00Z", "2023-01-01T00:15:00Z")],
+        # naive
+        [("2023-01-01T00:00:00", "2023-01-01T00:15:00")],
+        # mixed precision
+        [
+            ("2023-01-01T00:00:00", "2023-01-01T00:15:00.250"),
+            ("2023-01-01T00:15:00.250", "2023-01-01T00:30:00"),
+        ],
+        # aware and naive blocks
+        [
+            ("2023-01-01T00:00:00Z", "2023-01-01T00:15:00.500Z"),
+            ("2023-01-01T00:15:00", "2023-01-01T00:30:00"),
+        ],
+    ],
+)
+def test_round_trip(times):
+    payload = _forecast(*times)
+    assert ColumnarForecast.from_payload(payload).to_payload() == payload
+    payload = _measurements(*times)
+    assert ColumnarMeasurements.from_payload(payload).to_payload() == payload
+
+
+def test_offsets_are_written_as_utc():
+    payload = _forecast(("2023-01-01T00:15:00+01:00", "2023-01-01T00:30:00.125-02:00"))
+    forecast = ColumnarForecast.from_payload(payload)
+    assert forecast.blocks.start[0] == np.datetime64("2022-12-31T23:15:00", "ms")
+    (block,) = forecast.to_payload()["forecasted_blocks"]
+    assert block["start_time"] == "2022-12-31T23:15:00Z"
+    assert block["end_time"] == "2023-01-01T02:30:00.125Z"
+
+    payload = _measurements(("2023-01-01T00:00:00+01:00", "2023-01-01T00:15:00+01:00"))
+    (measurement,) = ColumnarMeasurements.from_payload(payload).to_payload()[
+        "measurements"
+    ]
+    assert measurement["initial_measure_time"] == "2022-12-31T23:00:00Z"
+    assert measurement["measure_time"] == "2022-12-31T23:15:00Z"
+
+
+def test_missing_values():
+    payload = {"forecasted_blocks": [{"start_time": "2023-01-01T00:00:00"}]}
+    forecast = ColumnarForecast.from_payload(payload)
+    assert np.isnan(forecast.blocks.capacity[0])
+    assert np.isnat(forecast.blocks.end[0])
+    assert forecast.blocks.phase[0] == -1
+    assert forecast.to_payload() == payload
+
+
+def test_parse_times_mixed_formats():
+    times = parse_times(["2023-01-01T00:00:00", "2023-01-01T01:00:00+01:00", None])
+    assert times[0] == times[1]
+    assert np.isnat(times[2])
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "2023-01-01T00:15:00Z",
+        "2023-01-01T00:15:00z",
+        "2023-01-01T00:15:00.000Z",
+        "2023-01-01T00:15:00.0Z",
+        "2023-01-01T01:15:00.0+01:00",
+    ],
+)
+def test_parse_utc_designator(value):
+    expected = np.datetime64("2023-01-01T00:15:00", "ms")
+    assert _parse_slow(value) == expected
+    assert parse_times([value, "2023-01-01T00:15:00"]).tolist() == [expected.item()] * 2
+
+
+def test_encode_decode():
+    codes = encode(["ALL", None, "ONE"], PHASES)
+    assert codes.dtype == np.int8
+    assert decode(codes, PHASES) == ["ALL", None, "ONE"]
+    assert UNITS.index("KW") >= 0
+    with pytest.raises(ValueError):
+        encode(["FOUR"], PHASES)
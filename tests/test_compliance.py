@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from oscp.client import OscpClient  # noqa: E402
+from oscp.compliance import ComplianceChecker  # noqa: E402
+from oscp.correlation import CorrelationStore  # noqa: E402
+from oscp.RegistrationManager import RegistrationDictMan  # noqa: E402
+
+FORECAST = {
+    "group_id": "g1",
+    "type": "CONSUMPTION",
+    "forecasted_blocks": [
+        {
+            "capacity": 10,
+            "phase": "ALL",
+            "unit": "KW",
+            "start_time": "2024-01-01T00:00:00Z",
+            "end_time": "2024-01-01T01:00:00Z",
+        }
+    ],
+}
+
+
+def _measurement(kwh, phase="ALL", direction="IMPORT"):
+    return {
+        "value": kwh,
+        "phase": phase,
+        "unit": "KWH",
+        "direction": direction,
+        "energy_type": "TOTAL",
+        "initial_measure_time": "2024-01-01T00:00:00Z",
+        "measure_time": "2024-01-01T00:30:00Z",
+    }
+
+
+def _measurements(kwh, phase="ALL", direction="IMPORT"):
+    return {"group_id": "g1", "measurements": [_measurement(kwh, phase, direction)]}
+
+
+def _forecast(type, capacity, phase="ALL"):
+    forecast = dict(FORECAST, type=type)
+    forecast["forecasted_blocks"] = [
+        dict(FORECAST["forecasted_blocks"][0], capacity=capacity, phase=phase)
+    ]
+    return forecast
+
+
+def test_exceeded_block_is_reported():
+    checker = ComplianceChecker()
+    checker.update_forecast(FORECAST, "peer", "r1")
+    assert checker.check(_measurements(4)) == []
+    # 6 kWh in half an hour are 12 kW
+    (report,) = checker.check(_measurements(6))
+    assert report.type == "CONSUMPTION"
+    assert report.blocks() == FORECAST["forecasted_blocks"]
+    assert report.measured.tolist() == [12000.0]
+    assert report.request_id == "r1"
+
+
+def test_unsupported_type():
+    with pytest.raises(ValueError, match="FLEXIBILITY"):
+        ComplianceChecker(types=("CONSUMPTION", "FLEXIBILITY"))
+
+
+def test_single_phases_are_summed_for_all_phases():
+    checker = ComplianceChecker()
+    checker.update_forecast(FORECAST, "peer")
+    # 1.5 kWh in half an hour are 3 kW per phase
+    payload = {
+        "group_id": "g1",
+        "measurements": [_measurement(1.5, phase) for phase in ("ONE", "TWO", "THREE")],
+    }
+    assert checker.check(payload) == []
+
+    # 2 kWh in half an hour are 4 kW per phase
+    for measurement in payload["measurements"]:
+        measurement["value"] = 2
+    (report,) = checker.check(payload)
+    assert report.measured.tolist() == [12000.0]
+    assert report.capacity.tolist() == [10000.0]
+    assert report.blocks() == FORECAST["forecasted_blocks"]
+
+
+def test_single_phase_block():
+    checker = ComplianceChecker()
+    checker.update_forecast(_forecast("CONSUMPTION", 3, "ONE"), "peer")
+    assert checker.check(_measurements(2, "TWO")) == []
+    (report,) = checker.check(_measurements(2, "ONE"))
+    assert report.measured.tolist() == [4000.0]
+
+
+def test_generation_limits_exports():
+    checker = ComplianceChecker()
+    checker.update_forecast(_forecast("GENERATION", 5), "peer")
+    # imports do not count as generation
+    assert checker.check(_measurements(10, direction="IMPORT")) == []
+    assert checker.check(_measurements(2, direction="EXPORT")) == []
+    (report,) = checker.check(_measurements(3, direction="EXPORT"))
+    assert report.type == "GENERATION"
+    assert report.measured.tolist() == [6000.0]
+    # negative net measurements are exports
+    assert checker.check(_measurements(3, direction="NET")) == []
+    (report,) = checker.check(_measurements(-3, direction="NET"))
+    assert report.measured.tolist() == [6000.0]
+
+
+def test_compliance_error_is_sent_to_the_peer(version_urls, tmp_path, monkeypatch):
+    rm = RegistrationDictMan(version_urls, str(tmp_path / "endpoints.json"))
+    try:
+        rm._updateService("peer", "client_peer", "http://peer/oscp/fp/2.0", "2.0")
+        sent = []
+        monkeypatch.setattr(rm, "_post", lambda *args: sent.append(args))
+        correlations = CorrelationStore()
+        # sent by the AsyncOscpClient with X-Request-ID r1
+        correlations.record("r1", FORECAST, "peer")
+        checker = ComplianceChecker(correlations=correlations, registrationmanager=rm)
+
+        assert checker.check(_measurements(4)) == []
+        assert sent == []
+        checker.check(_measurements(6))
+        ((base_url, path, token, payload, correlation),) = sent
+        assert base_url == "http://peer/oscp/fp/2.0"
+        assert path == "/group_capacity_compliance_error"
+        assert token == "client_peer"
+        assert payload["forecasted_blocks"] == FORECAST["forecasted_blocks"]
+        assert "12000 W" in payload["message"]
+        assert correlation == "r1"
+
+        # every block is reported once
+        checker.check(_measurements(8))
+        assert len(sent) == 1
+    finally:
+        rm.stop()
+
+
+def test_failed_compliance_error_is_sent_again(version_urls, tmp_path, monkeypatch):
+    rm = RegistrationDictMan(
+        version_urls,
+        str(tmp_path / "endpoints.json"),
+        client=OscpClient(retries=0, connect_timeout=0.5),
+    )
+    try:
+        rm._updateService("peer", "client_peer", "http://127.0.0.1:9/oscp/cp", "2.0")
+        checker = ComplianceChecker(registrationmanager=rm)
+        checker.update_forecast(FORECAST, "peer", "r1")
+        checker.update_forecast(_forecast("GENERATION", 1), "peer", "r2")
+
+        # the peer is unreachable, the reports are returned anyway
+        reports = checker.check(_measurements(6, direction="NET"))
+        assert [report.type for report in reports] == ["CONSUMPTION"]
+        reports = checker.check(_measurements(-3, direction="NET"))
+        assert [report.type for report in reports] == ["GENERATION"]
+
+        sent = []
+        monkeypatch.setattr(rm, "_post", lambda *args: sent.append(args))
+        checker.check(_measurements(6, direction="NET"))
+        assert [correlation for *_, correlation in sent] == ["r1"]
+    finally:
+        rm.stop()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+from flask import Flask
+
+from oscp.correlation import CorrelationStore
+from oscp.dispatch import Dispatcher, dispatch
+from oscp.RegistrationManager import RegistrationSQLiteMan
+
+FORECAST = {
+    "group_id": "g1",
+    "type": "CONSUMPTION",
+    "forecasted_blocks": [
+        {
+            "capacity": 10,
+            "phase": "ALL",
+            "unit": "KW",
+            "start_time": "2024-01-01T00:00:00Z",
+            "end_time": "2024-01-01T01:00:00Z",
+        }
+    ],
+}
+
+
+@pytest.fixture
+def rm(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(
+        version_urls, str(tmp_path / "endpoints.db"), correlations=CorrelationStore()
+    )
+    rm.correlations.record("r1", FORECAST, "peer")
+    return rm
+
+
+def _error(app, correlation):
+    headers = {"X-Request-ID": "e1", "X-Correlation-ID": correlation}
+    return app.test_request_context(
+        "/oscp/cp/2.0/group_capacity_compliance_error", method="POST", headers=headers
+    )
+
+
+def test_forecast_of_request(rm):
+    app = Flask(__name__)
+    with _error(app, "r1"):
+        assert rm.getCorrelatedForecast("peer").group_id == "g1"
+        # forecasts sent to other peers are not returned
+        assert rm.getCorrelatedForecast("other") is None
+    with _error(app, "unknown"):
+        assert rm.getCorrelatedForecast("peer") is None
+
+
+def test_forecast_in_dispatched_handler(rm):
+    app = Flask(__name__)
+    dispatcher = Dispatcher(workers=1)
+    found = []
+    done = threading.Event()
+
+    def handleGroupCapacityComplianceError(payload, token):
+        found.append(rm.getCorrelatedForecast())
+        done.set()
+
+    with _error(app, "r1"):
+        dispatch(dispatcher, handleGroupCapacityComplianceError, {}, "peer")
+    done.wait(5)
+    dispatcher.close()
+    assert found[0].type == "CONSUMPTION"
+
+
+def test_without_store(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    assert rm.getCorrelatedForecast("peer", "r1") is None
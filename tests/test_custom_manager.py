@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import threading
+
+from oscp.RegistrationManager import RegistrationMan
+
+
+class PeriodicMan(RegistrationMan):
+    """
+    manager written against the periodic background job,
+    which implements neither getRecords nor getEndpoints
+    """
+
+    def __init__(self, version_urls, **kwds):
+        self.runs = 0
+        self.ran = threading.Event()
+        super().__init__(version_urls, **kwds)
+
+    def _background_job(self):
+        self.runs += 1
+        if self.runs >= 2:
+            self.ran.set()
+
+
+class TokensMan(PeriodicMan):
+    def _background_job(self, tokens):
+        assert tokens is None
+        super()._background_job()
+
+
+def test_periodic_background_job_keeps_running(version_urls):
+    rm = PeriodicMan(version_urls, background_interval=0.05)
+    rm.start()
+    try:
+        assert rm.ran.wait(5)
+    finally:
+        rm.stop()
+
+
+def test_background_job_with_required_tokens(version_urls):
+    rm = TokensMan(version_urls, background_interval=0.05)
+    rm.start()
+    try:
+        assert rm.ran.wait(5)
+    finally:
+        rm.stop()
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+from flask import Flask, request
+from werkzeug.exceptions import Forbidden
+
+from oscp import createBlueprint
+from oscp.client import OscpClient
+from oscp.dedup import RequestDedup, idempotent
+from oscp.RegistrationManager import RegistrationMemoryMan
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def _request(app, request_id="r1", token="Token a", path="/oscp/fp/2.0/register"):
+    headers = {"Authorization": token, "X-Request-ID": request_id}
+    return app.test_request_context(path, method="POST", headers=headers)
+
+
+class Handler(object):
+    def __init__(self, status=204):
+        self.calls = 0
+        self.status = status
+
+    def __call__(self):
+        self.calls += 1
+        return {"n": self.calls}, self.status
+
+
+def test_duplicate_request_id_returns_cached_response(app):
+    dedup = RequestDedup()
+    handler = Handler()
+    with _request(app):
+        first = dedup.handle(handler)
+    with _request(app):
+        assert dedup.handle(handler) == first
+    assert handler.calls == 1
+
+    # other request ids, tokens and paths are processed
+    with _request(app, request_id="r2"):
+        dedup.handle(handler)
+    with _request(app, token="Token b"):
+        dedup.handle(handler)
+    with _request(app, path="/oscp/fp/2.0/update_group_measurements"):
+        dedup.handle(handler)
+    assert handler.calls == 4
+
+
+def test_failed_response_is_not_cached(app):
+    dedup = RequestDedup()
+    handler = Handler(status=500)
+    for _ in range(2):
+        with _request(app):
+            dedup.handle(handler)
+    assert handler.calls == 2
+
+
+def test_shared_database(app, tmp_path):
+    filename = str(tmp_path / "requests.db")
+    handler = Handler()
+    with _request(app):
+        first = RequestDedup(filename=filename).handle(handler)
+    # another worker process
+    with _request(app):
+        assert RequestDedup(filename=filename).handle(handler) == first
+    assert handler.calls == 1
+
+
+class Manager(object):
+    dedup = None
+
+    def __init__(self):
+        self.tokens = {"a"}
+
+    def _check_access_token(self):
+        token = request.headers["Authorization"].replace("Token ", "")
+        if token not in self.tokens:
+            raise Forbidden("invalid token")
+        return token
+
+
+class IdempotentResource(object):
+    def __init__(self):
+        self.registrationmanager = Manager()
+        self.calls = 0
+
+    @idempotent
+    def post(self):
+        self.registrationmanager._check_access_token()
+        self.calls += 1
+        return "", 204
+
+
+def test_idempotent_without_dedup(app):
+    resource = IdempotentResource()
+    for _ in range(2):
+        with _request(app):
+            resource.post()
+    assert resource.calls == 2
+
+    resource.registrationmanager.dedup = RequestDedup()
+    for _ in range(2):
+        with _request(app):
+            resource.post()
+    assert resource.calls == 3
+
+
+def test_removed_token_does_not_replay(app):
+    resource = IdempotentResource()
+    resource.registrationmanager.dedup = RequestDedup()
+    with _request(app):
+        resource.post()
+    resource.registrationmanager.tokens.clear()
+    with _request(app):
+        with pytest.raises(Forbidden):
+            resource.post()
+    assert resource.calls == 1
+
+
+def test_retry_of_running_request_is_not_processed_again(app):
+    dedup = RequestDedup(wait=0.05)
+    release = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "", 204
+
+    def first():
+        with _request(app):
+            dedup.handle(slow)
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    try:
+        started.wait(5)
+        with _request(app):
+            data, status, headers = dedup.handle(slow)
+        assert status == 503
+        assert headers == {"Retry-After": "1"}
+    finally:
+        release.set()
+        thread.join()
+    assert len(calls) == 1
+    with _request(app):
+        assert dedup.handle(slow) == ("", 204, {})
+    assert len(calls) == 1
+
+
+def test_request_which_removed_its_token_is_replayed(app, tmp_path):
+    filename = str(tmp_path / "requests.db")
+    manager = Manager()
+
+    def remove_token():
+        manager.tokens.discard("a")
+        return "", 204
+
+    with _request(app):
+        first = RequestDedup(filename=filename).handle(
+            remove_token, manager._check_access_token
+        )
+    manager.tokens.add("b")
+    # another worker process
+    dedup = RequestDedup(filename=filename)
+    with _request(app):
+        assert dedup.handle(remove_token, manager._check_access_token) == first
+    # requests which did not remove the token are not replayed
+    with _request(app, token="Token b"):
+        dedup.handle(lambda: ("", 204), manager._check_access_token)
+    manager.tokens.clear()
+    with _request(app, token="Token b"):
+        with pytest.raises(Forbidden):
+            dedup.handle(remove_token, manager._check_access_token)
+
+
+def test_retried_registration_is_answered(version_urls, tmp_path):
+    rm = RegistrationMemoryMan(
+        version_urls,
+        str(tmp_path / "endpoints.json"),
+        client=OscpClient(retries=0, connect_timeout=0.5),
+        dedup=RequestDedup(),
+    )
+    rm._updateService("tokenA", None, None, None)
+    app = Flask(__name__)
+    app.register_blueprint(createBlueprint({"registrationmanager": rm}, "co"))
+    client = app.test_client()
+    payload = {
+        "token": "tokenB",
+        "version_url": [{"version": "2.0", "base_url": "http://127.0.0.1:9/oscp/fp"}],
+    }
+    headers = {"Authorization": "Token tokenA", "X-Request-ID": "r1"}
+    try:
+        for _ in range(2):
+            response = client.post(
+                "/oscp/co/2.0/register", json=payload, headers=headers
+            )
+            assert response.status_code == 204
+        # registered once, tokenA was replaced by a single tokenC
+        assert not rm.isRegistered("tokenA")
+        assert len(rm.getRecords()) == 1
+        # other requests with tokenA are rejected
+        response = client.post(
+            "/oscp/co/2.0/register",
+            json=payload,
+            headers=dict(headers, **{"X-Request-ID": "r2"}),
+        )
+        assert response.status_code == 403
+    finally:
+        rm.stop()
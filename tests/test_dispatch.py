@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+from flask import Flask
+
+from oscp import createBlueprint
+from oscp.dispatch import Dispatcher, current_message, dispatch
+from oscp.RegistrationManager import RegistrationMemoryMan
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def _post(app, route, headers=None):
+    return app.test_request_context(
+        f"/oscp/fp/2.0/{route}", method="POST", headers=headers or {}
+    )
+
+
+def test_full_queue_answers_503(app):
+    dispatcher = Dispatcher(workers=1, queue_size=2, retry_after=7)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking(payload, token):
+        started.set()
+        release.wait(5)
+
+    try:
+        with _post(app, "update_group_measurements"):
+            assert dispatch(dispatcher, blocking, {}, "a") == ("", 204)
+            started.wait(5)
+            # the worker is busy, two messages wait in the queue
+            assert dispatch(dispatcher, blocking, {}, "a") == ("", 204)
+            assert dispatch(dispatcher, blocking, {}, "a") == ("", 204)
+            body, status, headers = dispatch(dispatcher, blocking, {}, "a")
+            assert status == 503
+            assert headers == {"Retry-After": "7"}
+            assert dispatcher.pending("update_group_measurements") == 2
+        with _post(app, "heartbeat"):
+            # other routes have their own limit
+            assert dispatch(dispatcher, blocking, {}, "a") == ("", 204)
+    finally:
+        release.set()
+        dispatcher.close()
+    assert dispatcher.pending() == 0
+
+
+def test_messages_of_a_group_are_handled_in_order(app):
+    dispatcher = Dispatcher(workers=4)
+    handled = []
+
+    def handler(payload, token):
+        message = current_message()
+        handled.append((payload["group_id"], payload["n"], message.request_id))
+
+    with _post(app, "update_group_capacity_forecast", {"X-Request-ID": "r1"}):
+        for n in range(50):
+            for group_id in ("g1", "g2"):
+                dispatcher.submit(handler, {"group_id": group_id, "n": n}, "a")
+    dispatcher.close()
+
+    assert len(handled) == 100
+    for group_id in ("g1", "g2"):
+        assert [n for g, n, _ in handled if g == group_id] == list(range(50))
+    assert {request_id for _, _, request_id in handled} == {"r1"}
+    assert current_message() is None
+
+
+def test_without_dispatcher_the_handler_is_called_directly(app):
+    handled = []
+    with _post(app, "heartbeat"):
+        assert dispatch(None, handled.append, {"n": 1}) == ("", 204)
+    assert handled == [{"n": 1}]
+
+
+class _Provider(object):
+    def __init__(self):
+        self.forecasts = []
+
+    def handleUpdateGroupCapacityForecast(self, payload, token):
+        self.forecasts.append(payload)
+
+
+@pytest.mark.parametrize("response_encoding", [None, "compat"])
+def test_full_queue_answers_503_through_the_route(
+    version_urls, tmp_path, response_encoding
+):
+    rm = RegistrationMemoryMan(version_urls, str(tmp_path / "endpoints.json"))
+    rm._updateService("a", "client_a", "http://a/oscp/cp/2.0", "2.0")
+    dispatcher = Dispatcher(queue_sizes={"update_group_capacity_forecast": 0})
+    injected = {
+        "flexibilityprovider": _Provider(),
+        "registrationmanager": rm,
+        "dispatcher": dispatcher,
+    }
+    app = Flask(__name__)
+    app.register_blueprint(
+        createBlueprint(injected, "fp", response_encoding=response_encoding)
+    )
+    try:
+        response = app.test_client().post(
+            "/oscp/fp/2.0/update_group_capacity_forecast",
+            json={"group_id": "g1", "type": "CONSUMPTION", "forecasted_blocks": []},
+            headers={"Authorization": "Token a"},
+        )
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "5"
+        assert response.get_json() == {
+            "message": "too many pending update_group_capacity_forecast messages"
+        }
+    finally:
+        dispatcher.close()
+        rm.stop()
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+import pickle
+
+import pytest
+
+from oscp.dedup import RequestDedup
+from oscp.outbox import Outbox
+from oscp.RegistrationManager import RegistrationSQLiteMan
+
+
+@pytest.fixture
+def workers(version_urls, tmp_path):
+    workers = [
+        RegistrationSQLiteMan(
+            version_urls,
+            str(tmp_path / "endpoints.db"),
+            leader_lock=str(tmp_path / "oscp.leader"),
+        )
+        for _ in range(2)
+    ]
+    yield workers
+    for worker in workers:
+        worker.stop()
+
+
+def _scheduled(rm):
+    return set(rm.scheduler._deadlines)
+
+
+def _handshake(rm, token):
+    rm._updateService(token, "client_" + token, f"http://{token}/oscp/fp/2.0", "2.0")
+    rm._setRequiredBehavior(token, {"heartbeat_interval": 30}, new=True)
+
+
+def test_new_leader_reschedules_all_endpoints(workers):
+    leader, follower = workers
+    _handshake(follower, "a")
+    leader._elect()
+    follower._elect()
+    assert leader.isLeader()
+    assert not follower.isLeader()
+    assert _scheduled(leader) == {"a"}
+    assert _scheduled(follower) == set()
+
+
+def test_leader_reschedules_changed_endpoints_only(workers):
+    leader, follower = workers
+    follower._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+    follower._updateService("b", "client_b", "http://b/oscp/fp/2.0", "2.0")
+    leader._elect()
+    leader.scheduler.cancel("a")
+    leader.scheduler.cancel("b")
+
+    leader._elect()
+    assert _scheduled(leader) == set()
+
+    # a handshake received by another process
+    follower._setRequiredBehavior("b", {"heartbeat_interval": 30}, new=True)
+    leader._elect()
+    assert _scheduled(leader) == {"b"}
+
+
+def test_follower_takes_over(workers):
+    leader, follower = workers
+    _handshake(follower, "a")
+    leader._elect()
+    follower._elect()
+    leader.election.release()
+    follower._elect()
+    assert follower.isLeader()
+    assert _scheduled(follower) == {"a"}
+
+
+def _in_child(func):
+    """
+    returns the result of func called in a forked child process
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(write, pickle.dumps(func()))
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read, "rb") as f:
+        result = pickle.loads(f.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+needs_fork = pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+
+
+@needs_fork
+def test_sqlite_connections_are_not_inherited(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    try:
+        # the manager is created before forking, without a connection
+        assert getattr(rm._local, "con", None) is None
+        rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+        inherited = rm._connection()
+
+        def child():
+            return rm._connection() is not inherited, rm.isRegistered("a")
+
+        assert _in_child(child) == (True, True)
+        assert rm._connection() is inherited
+    finally:
+        rm.stop()
+
+
+@needs_fork
+def test_outbox_connection_is_not_inherited(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    assert outbox._connection is None
+    outbox.put("http://a/oscp/fp/2.0", "/heartbeat", "client_a", {})
+    inherited = outbox._con
+
+    def child():
+        return outbox._con is not inherited, len(outbox)
+
+    assert _in_child(child) == (True, 1)
+    assert outbox._con is inherited
+
+
+@needs_fork
+def test_dedup_connection_is_not_inherited(tmp_path):
+    dedup = RequestDedup(filename=str(tmp_path / "requests.db"))
+    assert getattr(dedup._local, "con", None) is None
+    key = dedup.key("Token a", "r1", "/register")
+    dedup.put(key, ({}, 204, {}))
+    inherited = dedup._connection()
+
+    def child():
+        dedup.clear()
+        return dedup._connection() is not inherited, dedup.get(key)
+
+    assert _in_child(child) == (True, (({}, 204, {}), False))
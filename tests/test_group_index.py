@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import pytest
+
+from oscp.records import EndpointRecord
+from oscp.RegistrationManager import (
+    GroupIndex,
+    RegistrationDictMan,
+    RegistrationJournalMan,
+    RegistrationMemoryMan,
+)
+
+
+def test_index_keeps_assignment_order():
+    index = GroupIndex()
+    index.set("a", ["g1", "g2", "g1"])
+    index.set("b", ["g1"])
+    assert index.lookup("g1") == ["a", "b"]
+    assert index.lookup("g2") == ["a"]
+
+    index.set("a", ["g2"])
+    assert index.lookup("g1") == ["b"]
+    index.remove("b")
+    assert index.lookup("g1") == []
+    assert index.lookup("unknown") == []
+
+
+def test_rebuild():
+    index = GroupIndex()
+    index.set("old", ["g1"])
+    index.rebuild(
+        {
+            "a": EndpointRecord("client_a", "http://a", group_ids=["g1"]),
+            "b": EndpointRecord("client_b", "http://b"),
+        }
+    )
+    assert index.lookup("g1") == ["a"]
+
+
+@pytest.fixture(
+    params=[RegistrationDictMan, RegistrationMemoryMan, RegistrationJournalMan]
+)
+def rm(request, version_urls, tmp_path):
+    rm = request.param(version_urls, str(tmp_path / "endpoints.json"))
+    yield rm
+    rm.stop()
+
+
+def test_routing_by_group_id(rm):
+    rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+    rm._updateService("b", "client_b", "http://b/oscp/fp/2.0", "2.0")
+    rm._setGroupIds("a", ["g1", "g2"])
+    rm._setGroupIds("b", ["g2"])
+
+    assert rm._token_by_group_id("g1") == "a"
+    assert rm._token_by_group_id("unknown") is None
+    assert rm.getURL(group_id="g1") == ("http://a/oscp/fp/2.0", "client_a")
+    assert rm.tokens_by_group_ids(["g1", "g2"]) == {"g1": {"a"}, "g2": {"a", "b"}}
+
+    rm._replaceToken("a", "c", "client_c", "http://c/oscp/fp/2.0", "2.0")
+    assert rm.tokens_by_group_ids(["g1", "g2"]) == {"g1": set(), "g2": {"b"}}
+    rm._removeService("b")
+    assert rm._token_by_group_id("g2") is None
+
+
+def test_index_is_rebuilt_on_restart(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.json")
+    rm = RegistrationMemoryMan(version_urls, filename)
+    rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+    rm._setGroupIds("a", ["g1"])
+    rm.stop()
+
+    rm = RegistrationMemoryMan(version_urls, filename)
+    try:
+        assert rm._token_by_group_id("g1") == "a"
+    finally:
+        rm.stop()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from oscp.health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, PeerHealth
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.failure(0)
+    breaker.failure(0)
+    assert breaker.state == CLOSED
+    breaker.success()
+    breaker.failure(0)
+    breaker.failure(0)
+    assert breaker.state == CLOSED
+    breaker.failure(0)
+    assert breaker.state == OPEN
+    assert not breaker.acquire(10)
+
+
+def test_breaker_probe_closes():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.failure(0)
+    assert not breaker.available(29)
+    assert breaker.available(30)
+    # only a single probe is let through
+    assert breaker.acquire(30)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.acquire(30)
+    breaker.success()
+    assert breaker.state == CLOSED
+    assert breaker.acquire(30)
+
+
+def test_breaker_failed_probe_opens_again():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.trip(0)
+    assert breaker.acquire(30)
+    breaker.failure(30)
+    assert breaker.state == OPEN
+    assert not breaker.available(59)
+    assert breaker.available(60)
+
+
+def test_peer_offline_and_online():
+    health = PeerHealth(reset_timeout=30)
+    assert health.acquire("http://peer")
+    health.offline("http://peer", offline_at=1)
+    assert health.any_open()
+    assert not health.acquire("http://peer")
+    assert health.available("http://other")
+
+    # a heartbeat lets the next message probe the peer
+    health.online("http://peer")
+    assert health.acquire("http://peer")
+    health.success("http://peer")
+    assert not health.any_open()
+    assert health.state("http://peer") == {"state": CLOSED, "failures": 0}
+
+
+def test_missed_deadline_opens_once():
+    health = PeerHealth(reset_timeout=0)
+    health.offline("http://peer", offline_at=1)
+    assert health.acquire("http://peer")
+    health.success("http://peer")
+    # the same missed deadline does not open the breaker again
+    health.offline("http://peer", offline_at=1)
+    assert not health.any_open()
+    health.offline("http://peer", offline_at=2)
+    assert health.any_open()
+
+
+def test_peer_failures():
+    health = PeerHealth(failure_threshold=2, reset_timeout=60)
+    health.failure("http://peer")
+    assert health.state("http://peer") == {"state": CLOSED, "failures": 1}
+    health.failure("http://peer")
+    assert health.state("http://peer")["state"] == OPEN
+    assert not health.available("http://peer")
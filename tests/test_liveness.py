@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from oscp.liveness import LivenessTracker
+from oscp.RegistrationManager import RegistrationDictMan, RegistrationSQLiteMan
+
+
+def test_beat_returns_interval():
+    liveness = LivenessTracker()
+    assert liveness.beat("a", time.time() + 60) is None
+    time.sleep(0.01)
+    assert 0 < liveness.beat("a", time.time() + 60) < 1
+    assert liveness.is_online("a")
+    assert set(liveness.take_changes()) == {"a"}
+    assert liveness.take_changes() == {}
+
+
+@pytest.fixture
+def rm(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(
+        version_urls,
+        str(tmp_path / "endpoints.db"),
+        liveness_interval=60,
+        leader_lock=str(tmp_path / "oscp.leader"),
+    )
+    rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+    yield rm
+    rm.stop()
+
+
+def test_leader_does_not_cache_registered_tokens(rm):
+    assert rm.token_cache.ttl == 0
+
+
+def test_stored_offline_at_has_grace(rm):
+    now = time.time()
+    rm._setOfflineAt("a", now - 30)
+    endpoint = rm.getRecord("a")
+    # another process might not have persisted the next heartbeat yet
+    assert rm._offlineAt("a", endpoint) == (endpoint.offline_at, 60)
+    assert rm._next_deadline("a", endpoint) > time.monotonic() + 25
+
+    rm.liveness.beat("a", now - 30)
+    assert rm._offlineAt("a", endpoint) == (now - 30, 0)
+    assert rm._next_deadline("a", endpoint) is None
+
+
+def test_dict_man_persists_all_heartbeats_at_once(version_urls, tmp_path, monkeypatch):
+    rm = RegistrationDictMan(version_urls, str(tmp_path / "endpoints.json"))
+    try:
+        for token in ("a", "b", "c"):
+            rm._updateService(token, "client_" + token, "http://a/oscp/fp/2.0", "2.0")
+        writes = []
+        write = rm.writeJson
+        monkeypatch.setattr(rm, "writeJson", lambda e: writes.append(write(e)))
+        now = time.time()
+        rm.liveness.beat("a", now + 60)
+        rm.liveness.beat("b", now + 90)
+        rm.liveness.beat("d", now + 90)
+        rm.persistLiveness()
+        assert len(writes) == 1
+        records = rm.getRecords()
+        assert records["a"].offline_at == pytest.approx(now + 60)
+        assert records["b"].offline_at == pytest.approx(now + 90)
+        assert records["c"].offline_at is None
+        assert "d" not in records
+    finally:
+        rm.stop()
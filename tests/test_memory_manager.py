@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import gc
+import json
+import os
+import weakref
+
+import pytest
+
+from oscp.RegistrationManager import RegistrationJournalMan, RegistrationMemoryMan
+
+
+def _register(rm, token, url="http://peer/oscp/fp/2.0"):
+    rm._updateService(token, "client_" + token, url, "2.0")
+
+
+def test_memory_man_reloads_previous_run(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.json")
+    rm = RegistrationMemoryMan(version_urls, filename)
+    _register(rm, "a")
+    rm.stop()
+
+    rm = RegistrationMemoryMan(version_urls, filename)
+    try:
+        assert rm.isRegistered("a")
+    finally:
+        rm.stop()
+
+
+def test_memory_man_reset(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.json")
+    rm = RegistrationMemoryMan(version_urls, filename)
+    _register(rm, "a")
+    rm.stop()
+
+    rm = RegistrationMemoryMan(version_urls, filename, reset=True)
+    try:
+        assert not rm.isRegistered("a")
+    finally:
+        rm.stop()
+
+
+def test_journal_man_reset(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.json")
+    rm = RegistrationJournalMan(version_urls, filename)
+    _register(rm, "a")
+    rm.stop()
+
+    rm = RegistrationJournalMan(version_urls, filename)
+    assert rm.isRegistered("a")
+    rm.stop()
+
+    rm = RegistrationJournalMan(version_urls, filename, reset=True)
+    try:
+        assert not rm.isRegistered("a")
+    finally:
+        rm.stop()
+
+
+def test_journal_replay_after_interrupted_compaction(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.json")
+    rm = RegistrationJournalMan(version_urls, filename, compact_threshold=1000)
+    _register(rm, "a")
+    _register(rm, "b")
+    # stops the flush thread without compacting
+    RegistrationMemoryMan.stop(rm)
+    rm._journal.close()
+    # crash after rotating the journal, before the snapshot was written
+    os.replace(rm.journal_filename, rm.journal_filename + ".old")
+    with open(rm.journal_filename, "w") as f:
+        f.write(json.dumps(["b", None]) + "\n")
+        f.write(json.dumps(["c", {"client_token": "client_c"}]) + "\n")
+        # incomplete record of the crash
+        f.write('["d", {"client_tok')
+
+    rm = RegistrationJournalMan(version_urls, filename)
+    try:
+        assert rm.isRegistered("a")
+        assert not rm.isRegistered("b")
+        assert rm.isRegistered("c")
+        assert not rm.isRegistered("d")
+        # the compaction was finished
+        assert not os.path.exists(rm.journal_filename + ".old")
+        with open(filename) as f:
+            assert sorted(json.load(f)) == ["a", "c"]
+    finally:
+        rm.stop()
+
+    rm = RegistrationJournalMan(version_urls, filename)
+    try:
+        assert sorted(rm.getRecords()) == ["a", "c"]
+    finally:
+        rm.stop()
+
+
+def test_offline_at_keeps_version(version_urls, tmp_path):
+    rm = RegistrationMemoryMan(version_urls, str(tmp_path / "endpoints.json"))
+    try:
+        _register(rm, "a")
+        version = rm._versions["a"]
+        rm._setOfflineAt("a", 1700000000)
+        assert rm._versions["a"] == version
+        assert rm.getRecord("a").offline_at is not None
+    finally:
+        rm.stop()
+
+
+def test_unknown_token_raises_key_error(version_urls, tmp_path):
+    rm = RegistrationMemoryMan(version_urls, str(tmp_path / "endpoints.json"))
+    try:
+        with pytest.raises(KeyError):
+            rm._removeService("unknown")
+        with pytest.raises(KeyError):
+            rm._setRequiredBehavior("unknown", {}, new=True)
+    finally:
+        rm.stop()
+
+
+def test_stop_releases_instance(version_urls, tmp_path):
+    rm = RegistrationMemoryMan(version_urls, str(tmp_path / "endpoints.json"))
+    rm.stop()
+    rm.flush_thread.join(1)
+    ref = weakref.ref(rm)
+    del rm
+    gc.collect()
+    assert ref() is None
+
+
+def test_journal_closed_after_stop(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.json")
+    rm = RegistrationJournalMan(version_urls, filename)
+    _register(rm, "a")
+    rm.stop()
+    assert rm._journal.closed
+    assert os.path.getsize(rm.journal_filename) == 0
+    with open(filename) as f:
+        assert list(json.load(f)) == ["a"]
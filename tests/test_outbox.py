@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+import requests
+
+from oscp.health import PeerHealth
+from oscp.outbox import Outbox
+from oscp.RegistrationManager import RegistrationSQLiteMan
+
+
+class FakeClient(object):
+    """
+    records the posted messages and answers with the given errors first
+    """
+
+    def __init__(self, errors=()):
+        self.health = PeerHealth()
+        self.errors = list(errors)
+        self.posted = []
+        self.lock = threading.Lock()
+
+    def post(self, base_url, path, token, data=None, correlation=None, headers=None):
+        with self.lock:
+            self.posted.append((base_url, path, headers["X-Request-ID"]))
+            if self.errors:
+                raise self.errors.pop(0)
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(response=response)
+
+
+def _wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            pytest.fail("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / "outbox.db")
+
+
+def test_retry_keeps_request_id(filename):
+    client = FakeClient([requests.exceptions.ConnectionError("down")])
+    outbox = Outbox(filename, client, backoff=0.05)
+    request_id = outbox.put("http://peer", "/register", "token", {})
+    outbox.start()
+    try:
+        _wait_for(lambda: len(outbox) == 0)
+    finally:
+        outbox.stop()
+    assert [r for _, _, r in client.posted] == [request_id, request_id]
+
+
+def test_rejected_message_is_dropped(filename):
+    client = FakeClient([_http_error(400)])
+    outbox = Outbox(filename, client)
+    outbox.put("http://peer", "/register", "token", {})
+    outbox.start()
+    try:
+        _wait_for(lambda: len(outbox) == 0)
+    finally:
+        outbox.stop()
+    assert len(client.posted) == 1
+
+
+def test_queued_heartbeat_is_replaced(filename):
+    outbox = Outbox(filename, FakeClient())
+    outbox.put("http://peer", "/heartbeat", "token", {})
+    outbox.put("http://peer", "/heartbeat", "token", {})
+    outbox.put("http://other", "/heartbeat", "token", {})
+    assert len(outbox) == 2
+
+
+def test_claimed_message_is_not_sent_twice(filename):
+    first = Outbox(filename, FakeClient(), claim_timeout=60)
+    second = Outbox(filename, FakeClient(), claim_timeout=60)
+    first.put("http://peer", "/register", "token", {})
+
+    messages, _ = first._next_messages(time.monotonic())
+    assert len(messages) == 1
+    assert second._next_messages(time.monotonic()) == ([], None)
+
+
+def test_expired_claim_is_taken_over(filename):
+    first = Outbox(filename, FakeClient(), claim_timeout=0)
+    second = Outbox(filename, FakeClient(), claim_timeout=60)
+    first.put("http://peer", "/register", "token", {})
+
+    messages, _ = first._next_messages(time.monotonic())
+    assert len(messages) == 1
+    time.sleep(0.01)
+    messages, _ = second._next_messages(time.monotonic())
+    assert len(messages) == 1
+
+
+def test_open_breaker_is_skipped(filename):
+    client = FakeClient()
+    outbox = Outbox(filename, client)
+    outbox.put("http://peer", "/register", "token", {})
+    client.health.offline("http://peer")
+    assert outbox._next_messages(time.monotonic()) == ([], None)
+
+
+def test_outbox_uses_client_of_registration_manager(version_urls, filename, tmp_path):
+    outbox = Outbox(filename)
+    rm = RegistrationSQLiteMan(
+        version_urls, str(tmp_path / "endpoints.db"), outbox=outbox
+    )
+    assert outbox.client is rm.client
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+from oscp.records import toEpoch
+from oscp.RegistrationManager import (
+    RegistrationDictMan,
+    RegistrationJournalMan,
+    RegistrationMan,
+    RegistrationMemoryMan,
+    RegistrationSQLiteMan,
+    parseOfflineModeAt,
+)
+
+
+class LegacyMan(RegistrationMan):
+    """
+    manager written before EndpointRecord, which implements getEndpoints
+    """
+
+    def getEndpoints(self):
+        return {
+            "a": {
+                "register": {"token": "client_a", "base_url": "http://a/oscp/fp/2.0"},
+                "required_behavior": {"heartbeat_interval": 30},
+                "group_ids": ["g1"],
+                "new": True,
+                "next_heartbeat": "2024-01-01T00:00:00",
+            }
+        }
+
+
+def test_records_of_legacy_manager(version_urls):
+    rm = LegacyMan(version_urls)
+    record = rm.getRecord("a")
+    assert record.client_token == "client_a"
+    assert record.base_url == "http://a/oscp/fp/2.0"
+    assert record.heartbeat_interval == 30
+    assert record.group_ids == ["g1"]
+    assert record.new
+    assert isinstance(record.next_heartbeat, float)
+    assert rm.getURL(token="a") == ("http://a/oscp/fp/2.0", "client_a")
+
+
+def test_manager_without_records(version_urls):
+    rm = RegistrationMan(version_urls)
+    with pytest.raises(NotImplementedError):
+        rm.getRecords()
+
+
+def test_to_epoch():
+    local = datetime(2024, 1, 1, 12, 30).timestamp()
+    assert toEpoch(None) is None
+    assert toEpoch(1700000000.5) == 1700000000.5
+    assert toEpoch(1700000000) == 1700000000.0
+    assert toEpoch("1700000000.5") == 1700000000.5
+    assert toEpoch("2024-01-01T12:30:00") == local
+    assert toEpoch(datetime(2024, 1, 1, 12, 30)) == local
+    utc = datetime(2024, 1, 1, 11, 30, tzinfo=timezone.utc).timestamp()
+    assert toEpoch("2024-01-01T12:30:00+01:00") == utc
+    # other formats are parsed by dateutil
+    assert toEpoch("Jan 1 2024 12:30") == local
+
+
+def test_parse_offline_mode_at():
+    expected = datetime(2024, 3, 5, 7, 8, 9).timestamp()
+    assert parseOfflineModeAt("2024-03-05 07:08:09") == expected
+    for value in ("2024-02-30 00:00:00", "2024-03-05T07:08:09", "yesterday"):
+        with pytest.raises(ValueError):
+            parseOfflineModeAt(value)
+
+
+def test_load_registry_with_iso_timestamps(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.json")
+    next_heartbeat = datetime(2024, 1, 1, 12, 0, 30)
+    offline_at = datetime(2024, 1, 1, 12, 1, 30, 500000)
+    with open(filename, "w") as f:
+        json.dump(
+            {
+                "a": {
+                    "register": {"token": "client_a", "base_url": "http://a/oscp/fp"},
+                    "required_behavior": {"heartbeat_interval": 30},
+                    "next_heartbeat": next_heartbeat.isoformat(),
+                    "offline_at": offline_at.isoformat(),
+                }
+            },
+            f,
+        )
+
+    rm = RegistrationDictMan(version_urls, filename, reset=False)
+    try:
+        record = rm.getRecord("a")
+        assert record.next_heartbeat == next_heartbeat.timestamp()
+        assert record.offline_at == offline_at.timestamp()
+        # loading does not rewrite the file
+        with open(filename) as f:
+            stored = json.load(f)["a"]
+        assert stored["next_heartbeat"] == next_heartbeat.isoformat()
+        assert stored["offline_at"] == offline_at.isoformat()
+
+        endpoint = rm.getEndpoints()["a"]
+        assert endpoint["next_heartbeat"] == next_heartbeat.isoformat()
+        assert endpoint["offline_at"] == offline_at.isoformat()
+        assert endpoint["register"] == {
+            "token": "client_a",
+            "base_url": "http://a/oscp/fp",
+        }
+        assert "breaker" in endpoint
+    finally:
+        rm.stop()
+
+
+@pytest.mark.parametrize(
+    "manager", [RegistrationDictMan, RegistrationMemoryMan, RegistrationJournalMan]
+)
+def test_timestamps_are_persisted_as_iso_strings(version_urls, tmp_path, manager):
+    filename = str(tmp_path / "endpoints.json")
+    offline_at = datetime(2024, 1, 1, 12, 1, 30, 500000)
+    rm = manager(version_urls, filename)
+    rm._updateService("a", "client_a", "http://a/oscp/fp", "2.0")
+    rm._setOfflineAt("a", offline_at.timestamp())
+    if manager is RegistrationJournalMan:
+        with open(filename + ".journal") as f:
+            _, record = json.loads(f.readlines()[-1])
+        assert record["offline_at"] == offline_at.isoformat()
+    rm.stop()
+    with open(filename) as f:
+        stored = json.load(f)["a"]
+    assert stored["offline_at"] == offline_at.isoformat()
+
+    rm = manager(version_urls, filename, reset=False)
+    try:
+        assert rm.getRecord("a").offline_at == offline_at.timestamp()
+    finally:
+        rm.stop()
+
+
+def test_sqlite_timestamps_are_persisted_as_iso_strings(version_urls, tmp_path):
+    filename = str(tmp_path / "endpoints.db")
+    offline_at = datetime(2024, 1, 1, 12, 1, 30, 500000)
+    rm = RegistrationSQLiteMan(version_urls, filename)
+    try:
+        rm._updateService("a", "client_a", "http://a/oscp/fp", "2.0")
+        rm._setOfflineAt("a", offline_at.timestamp())
+        con = sqlite3.connect(filename)
+        (stored,) = con.execute("SELECT offline_at FROM endpoints").fetchone()
+        con.close()
+        assert stored == offline_at.isoformat()
+        assert rm.getRecord("a").offline_at == offline_at.timestamp()
+    finally:
+        rm.stop()
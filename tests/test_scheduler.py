@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import threading
+import time
+
+from oscp.scheduler import DeadlineScheduler
+
+
+def test_due_keys_in_deadline_order():
+    scheduler = DeadlineScheduler()
+    now = time.monotonic()
+    scheduler.schedule("b", now - 1)
+    scheduler.schedule("a", now - 2)
+    scheduler.schedule("later", now + 60)
+    assert scheduler.wait() == ["a", "b"]
+    assert len(scheduler) == 1
+
+
+def test_earlier_deadline_is_kept():
+    scheduler = DeadlineScheduler()
+    now = time.monotonic()
+    scheduler.schedule("a", now - 1)
+    scheduler.schedule("a", now + 60)
+    assert scheduler.wait() == ["a"]
+    assert len(scheduler) == 0
+
+
+def test_rescheduling_earlier_replaces_the_deadline():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("a", time.monotonic() + 60)
+    scheduler.schedule("a")
+    assert scheduler.wait() == ["a"]
+    assert len(scheduler) == 0
+
+
+def test_cancel():
+    scheduler = DeadlineScheduler()
+    now = time.monotonic()
+    scheduler.schedule("a", now - 1)
+    scheduler.schedule("b", now - 1)
+    scheduler.cancel("a")
+    assert scheduler.wait() == ["b"]
+
+
+def test_wait_wakes_up_for_earlier_deadline():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("later", time.monotonic() + 60)
+    result = []
+    worker = threading.Thread(target=lambda: result.append(scheduler.wait()))
+    worker.start()
+    time.sleep(0.05)
+    scheduler.schedule("now")
+    worker.join(5)
+    assert result == [["now"]]
+
+
+def test_stop_releases_waiting_worker():
+    scheduler = DeadlineScheduler()
+    result = []
+    worker = threading.Thread(target=lambda: result.append(scheduler.wait()))
+    worker.start()
+    scheduler.stop()
+    worker.join(5)
+    assert result == [[]]
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import BadRequest
+
+from oscp import createBlueprint
+from oscp.async_client import AsyncOscpClient
+from oscp.RegistrationManager import RegistrationSQLiteMan
+from oscp.segmentation import SegmentBuffer, merge_segments, split_message
+
+
+def _forecast(blocks):
+    return {
+        "group_id": "g1",
+        "type": "CONSUMPTION",
+        "forecasted_blocks": [{"capacity": i} for i in range(blocks)],
+    }
+
+
+def test_split_and_merge():
+    forecast = _forecast(5)
+    segments = split_message(forecast, 2)
+    assert [len(s["forecasted_blocks"]) for s in segments] == [2, 2, 1]
+    assert all(s["group_id"] == "g1" for s in segments)
+    assert merge_segments(segments) == forecast
+    assert split_message(forecast, 5) == [forecast]
+
+
+def test_reassembly_in_any_order():
+    buffer = SegmentBuffer()
+    segments = split_message(_forecast(5), 2)
+    assert buffer.add("a", 3, 3, segments[2], 10) is None
+    assert buffer.add("a", 1, 3, segments[0], 10) is None
+    # a retried segment replaces the first one
+    assert buffer.add("a", 1, 3, segments[0], 10) is None
+    assert buffer.size == 20
+    assert buffer.add("a", 2, 3, segments[1], 10) == _forecast(5)
+    assert len(buffer) == 0
+    assert buffer.size == 0
+
+
+def test_invalid_segment():
+    with pytest.raises(BadRequest):
+        SegmentBuffer().add("a", 3, 2, {})
+
+
+def test_incomplete_message_expires():
+    buffer = SegmentBuffer(ttl=0.01)
+    buffer.add("a", 1, 2, {})
+    time.sleep(0.02)
+    buffer.add("b", 1, 2, {})
+    assert len(buffer) == 1
+    # the second segment of the expired message starts a new one
+    assert buffer.add("a", 2, 2, {}) is None
+
+
+def test_oldest_message_is_evicted():
+    buffer = SegmentBuffer(max_size=25)
+    buffer.add("a", 1, 2, {}, 10)
+    buffer.add("b", 1, 2, {}, 10)
+    buffer.add("c", 1, 2, {}, 10)
+    assert len(buffer) == 2
+    assert buffer.size == 20
+    assert buffer.add("a", 2, 2, {}, 10) is None
+
+
+class _Response(object):
+    status_code = 204
+
+
+class _Client(object):
+    def __init__(self):
+        self.posted = []
+
+    def post(self, base_url, path, token, data=None, correlation=None, headers=None):
+        self.posted.append((data, correlation, headers))
+        return _Response()
+
+
+def test_segments_sent_by_async_client_are_reassembled(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    rm._updateService("peer", "client", "http://peer/oscp/fp/2.0", "2.0")
+    rm.client = client = _Client()
+    forecast = _forecast(5)
+    result = asyncio.run(
+        AsyncOscpClient(rm, segment_size=2).send(
+            "/update_group_capacity_forecast", forecast, "peer", correlation="c1"
+        )
+    )
+    assert len(client.posted) == 3
+    assert {headers["X-Segment-ID"] for _, _, headers in client.posted} == {
+        result.request_id
+    }
+    # the X-Correlation-ID of the message is kept
+    assert {correlation for _, correlation, _ in client.posted} == {"c1"}
+
+    app = Flask(__name__)
+    reassembled = []
+    for segment, _, headers in client.posted:
+        body = json.dumps(segment)
+        with app.test_request_context(
+            "/update_group_capacity_forecast", method="POST", data=body, headers=headers
+        ):
+            reassembled.append(rm.reassemble(segment, "peer"))
+    assert reassembled == [None, None, forecast]
+    assert rm.segments.size == 0
+
+
+def test_segments_require_segment_id(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    headers = {"X-Segment-Index": "1", "X-Segment-Count": "2"}
+    with Flask(__name__).test_request_context(method="POST", headers=headers):
+        with pytest.raises(BadRequest):
+            rm.reassemble({}, "peer")
+
+
+class _Optimizer(object):
+    def __init__(self):
+        self.forecasts = []
+
+    def handleUpdateGroupCapacityForecast(self, payload):
+        self.forecasts.append(payload)
+
+
+def test_segments_require_a_registered_token(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    rm._updateService("peer", "client", "http://peer/oscp/fp/2.0", "2.0")
+    optimizer = _Optimizer()
+    app = Flask(__name__)
+    injected = {"capacityoptimizer": optimizer, "registrationmanager": rm}
+    app.register_blueprint(createBlueprint(injected, "co"))
+    client = app.test_client()
+    forecast = _forecast(4)
+    segments = split_message(forecast, 2)
+
+    def post(index, token):
+        headers = {
+            "Authorization": f"Token {token}",
+            "X-Segment-ID": "s1",
+            "X-Segment-Index": str(index + 1),
+            "X-Segment-Count": "2",
+        }
+        return client.post(
+            "/oscp/co/2.0/update_group_capacity_forecast",
+            json=segments[index],
+            headers=headers,
+        )
+
+    assert post(0, "unknown").status_code == 403
+    assert len(rm.segments) == 0
+    assert post(0, "peer").status_code == 204
+    assert post(1, "peer").status_code == 204
+    assert optimizer.forecasts == [forecast]
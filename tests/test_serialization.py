@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime, timezone
+
+import pytest
+from flask import Blueprint, Flask
+from flask_restx import Api, Namespace, Resource, marshal
+
+from oscp.ep_models import ExtForecastedBlock, GroupCapacityPrice
+from oscp.json_models import ForecastedBlock, GroupCapacityForecast
+from oscp.serialization import (
+    ModelSerializer,
+    ResponseSerializer,
+    marshal_with,
+    output_orjson,
+)
+
+ns = Namespace(name="serialization", path="/serialization")
+for model in (ForecastedBlock, GroupCapacityForecast, ExtForecastedBlock):
+    ns.models[model.name] = model
+ns.models[GroupCapacityPrice.name] = GroupCapacityPrice
+
+
+@ns.route("/forecast")
+class Forecast(Resource):
+    def __init__(self, api=None, *args, **kwargs):
+        self.serializer = kwargs.get("serializer")
+        self.response = kwargs["response"]
+        super().__init__(api, *args, **kwargs)
+
+    @marshal_with(ns, GroupCapacityForecast)
+    def post(self):
+        return self.response(), 200, {"X-Test": "1"}
+
+
+@ns.route("/price")
+class Price(Resource):
+    def __init__(self, api=None, *args, **kwargs):
+        self.serializer = kwargs.get("serializer")
+        self.response = kwargs["response"]
+        super().__init__(api, *args, **kwargs)
+
+    @marshal_with(ns, GroupCapacityPrice)
+    def post(self):
+        return self.response()
+
+
+def forecast(blocks: int = 3) -> dict:
+    return {
+        "group_id": "g1",
+        "type": "CONSUMPTION",
+        "forecasted_blocks": [
+            {
+                "capacity": 11 + i / 3,
+                "phase": "ALL",
+                "unit": "KW",
+                "start_time": f"2023-01-01T00:{15 * i:02d}:00",
+                "end_time": datetime(2023, 1, 1, 0, 15 * i + 14, 59, 250000),
+            }
+            for i in range(blocks)
+        ],
+    }
+
+
+RESPONSES = {
+    "forecast": forecast,
+    "forecast with missing fields": lambda: {
+        "forecasted_blocks": [{"capacity": 3}, {}, {"start_time": None}]
+    },
+    "forecast with aware times": lambda: {
+        "group_id": "g1",
+        "forecasted_blocks": [
+            {
+                "capacity": 1e-7,
+                "start_time": datetime(2023, 1, 1, tzinfo=timezone.utc),
+                "end_time": "2023-01-01T00:15:00+01:00",
+            }
+        ],
+    },
+    "forecasts": lambda: [forecast(1), forecast(2)],
+    "empty": lambda: {},
+}
+
+
+def _app(response, serializer=None):
+    app = Flask(__name__)
+    blueprint = Blueprint("api", __name__)
+    api = Api(blueprint)
+    injected = {"response": response}
+    if serializer is not None:
+        injected["serializer"] = serializer
+    for resource in ns.resources:
+        resource.kwargs["resource_class_kwargs"] = injected
+    api.add_namespace(ns)
+    if serializer is not None:
+        serializer.install(api)
+    app.register_blueprint(blueprint)
+    # registered resources keep the injected objects
+    ns.apis.remove(api)
+    return app.test_client()
+
+
+@pytest.mark.parametrize("name", list(RESPONSES))
+@pytest.mark.parametrize("path", ["/serialization/forecast", "/serialization/price"])
+def test_compat_output_is_identical(name, path):
+    response = RESPONSES[name]
+    expected = _app(response).post(path)
+    actual = _app(response, ResponseSerializer("compat")).post(path)
+    assert actual.status_code == expected.status_code == 200
+    assert actual.get_data() == expected.get_data()
+    assert actual.headers.get("X-Test") == expected.headers.get("X-Test")
+
+
+@pytest.mark.parametrize("name", list(RESPONSES))
+def test_model_serializer_matches_marshal(name):
+    data = RESPONSES[name]()
+    serializer = ModelSerializer()
+    for model in (GroupCapacityForecast, GroupCapacityPrice):
+        assert json.dumps(serializer.marshal(data, model)) == json.dumps(
+            marshal(data, model)
+        )
+
+
+def test_mask_uses_standard_marshalling():
+    client = _app(forecast, ResponseSerializer("compat"))
+    response = client.post("/serialization/forecast", headers={"X-Fields": "group_id"})
+    assert response.get_json() == {"group_id": "g1"}
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        ResponseSerializer("json")
+
+
+def test_fast_output_is_equivalent():
+    pytest.importorskip("orjson")
+    compat = _app(forecast).post("/serialization/forecast")
+    fast = _app(forecast, ResponseSerializer("fast")).post("/serialization/forecast")
+    assert fast.get_data() != compat.get_data()
+    assert fast.get_data().endswith(b"\n")
+    assert json.loads(fast.get_data()) == json.loads(compat.get_data())
+
+
+def test_orjson_encodes_datetimes_and_floats():
+    pytest.importorskip("orjson")
+    app = Flask(__name__)
+    data = {
+        "time": datetime(2023, 1, 1, 0, 15, 0, 250000),
+        "floats": [0.1, 1 / 3, 1e-7, 1e20, 11.0],
+    }
+    with app.test_request_context():
+        response = output_orjson(data, 200, {"X-Test": "1"})
+    assert response.headers["X-Test"] == "1"
+    decoded = json.loads(response.get_data())
+    assert decoded["time"] == "2023-01-01T00:15:00.250000"
+    assert decoded["floats"] == data["floats"]
+
+
+def test_orjson_falls_back_to_json():
+    pytest.importorskip("orjson")
+    app = Flask(__name__)
+    with app.test_request_context():
+        # orjson only encodes string keys
+        response = output_orjson({1: "a"}, 200)
+    assert json.loads(response.get_data()) == {"1": "a"}
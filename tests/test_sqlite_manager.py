@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import pytest
+
+from oscp.RegistrationManager import RegistrationSQLiteMan
+
+
+@pytest.fixture
+def rm(version_urls, tmp_path):
+    rm = RegistrationSQLiteMan(version_urls, str(tmp_path / "endpoints.db"))
+    yield rm
+    rm.stop()
+
+
+def test_register_and_remove(rm):
+    rm._updateService("a", "client_a", "http://peer/oscp/fp/2.0", "2.0")
+    assert rm.isRegistered("a")
+    assert rm.getURL(token="a") == ("http://peer/oscp/fp/2.0", "client_a")
+
+    rm._removeService("a")
+    assert not rm.isRegistered("a")
+    assert rm.getRecord("a") is None
+
+
+def test_group_ids(rm):
+    rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+    rm._updateService("b", "client_b", "http://b/oscp/fp/2.0", "2.0")
+    rm._setGroupIds("a", ["g1", "g2"])
+    rm._setGroupIds("b", ["g2"])
+
+    assert rm._token_by_group_id("g1") == "a"
+    assert rm.tokens_by_group_ids(["g1", "g2", "g3"]) == {
+        "g1": {"a"},
+        "g2": {"a", "b"},
+        "g3": set(),
+    }
+    assert sorted(rm.getRecord("a").group_ids) == ["g1", "g2"]
+
+    # group ids are removed with the endpoint
+    rm._removeService("a")
+    assert rm.tokens_by_group_ids(["g1", "g2"]) == {"g1": set(), "g2": {"b"}}
+
+
+def test_required_behavior(rm):
+    rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+    behavior = {"heartbeat_interval": 30}
+    rm._setRequiredBehavior("a", behavior, new=True)
+    record = rm.getRecord("a")
+    assert record.required_behavior == behavior
+    assert record.new
+
+
+def test_unknown_token_raises_key_error(rm):
+    with pytest.raises(KeyError):
+        rm._setRequiredBehavior("unknown", {}, new=True)
+    with pytest.raises(KeyError):
+        rm._setOfflineAt("unknown", 0)
+    with pytest.raises(KeyError):
+        rm._setGroupIds("unknown", ["g1"])
+    with pytest.raises(KeyError):
+        rm._removeService("unknown")
+    with pytest.raises(KeyError):
+        rm._replaceToken("unknown", "b", "client_b", "http://b/oscp/fp/2.0", "2.0")
+    assert not rm.isRegistered("b")
+
+
+def test_offline_at_keeps_version(rm):
+    rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+    version = rm._rows_by_tokens(["a"])["a"]["version"]
+    rm._setOfflineAt("a", 1700000000)
+    row = rm._rows_by_tokens(["a"])["a"]
+    assert row["version"] == version
+    assert rm.getRecord("a").offline_at is not None
+
+
+class _InsertingConnection(object):
+    """
+    inserts an endpoint with another manager right after the endpoints are read
+    """
+
+    def __init__(self, con, other):
+        self.con = con
+        self.other = other
+
+    def execute(self, sql, *args):
+        cur = self.con.execute(sql, *args)
+        if sql == RegistrationSQLiteMan.SELECT_ENDPOINTS:
+            rows = cur.fetchall()
+            self.other._updateService("b", "client_b", "http://b/oscp/fp/2.0", "2.0")
+            self.other._setGroupIds("b", ["g1"])
+            return iter(rows)
+        return cur
+
+
+def test_get_records_reads_a_snapshot(version_urls, tmp_path, rm):
+    other = RegistrationSQLiteMan(version_urls, rm.filename)
+    try:
+        rm._updateService("a", "client_a", "http://a/oscp/fp/2.0", "2.0")
+        rm._setGroupIds("a", ["g1"])
+        rm._local.con = _InsertingConnection(rm._connection(), other)
+
+        records = rm.getRecords()
+        assert list(records) == ["a"]
+        assert records["a"].group_ids == ["g1"]
+        assert "b" in rm.getRecords()
+    finally:
+        other.stop()
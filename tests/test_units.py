@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from oscp.columnar import PHASES, UNITS, BlockColumns, MeasurementColumns  # noqa: E402
+from oscp.units import UnitConverter, durations  # noqa: E402
+
+
+def _phases(*phases):
+    return np.array([PHASES.index(p) for p in phases], dtype=np.int8)
+
+
+@pytest.fixture
+def converter():
+    return UnitConverter(voltage=230, phase_count=3)
+
+
+def test_scaling(converter):
+    assert converter.convert([1.5, 2000], ["KW", "W"], "W").tolist() == [1500, 2000]
+    assert converter.convert([1.5, 2000], ["KWH", "WH"], "KWH").tolist() == [1.5, 2]
+    assert converter.convert([2500], "W", "KW").tolist() == [2.5]
+
+
+def test_current_uses_voltage_and_phase_count(converter):
+    phases = _phases("ONE", "TWO", "THREE", "ALL")
+    watts = converter.convert([10, 10, 10, 10], "A", "W", phases)
+    assert watts.tolist() == [2300, 2300, 2300, 6900]
+    amps = converter.convert(watts, "W", "A", phases)
+    assert amps.tolist() == [10, 10, 10, 10]
+    # without phases, all phases are assumed
+    assert converter.convert([1], "A", "KW").tolist() == [0.69]
+    assert UnitConverter(voltage=120, phase_count=1).convert(
+        [10], "A", "W", _phases("ALL")
+    ).tolist() == [1200]
+
+
+def test_energy_uses_duration(converter):
+    hours = np.array([0.5, 2, np.nan])
+    kw = converter.convert([3, 3, 3], "KWH", "KW", hours=hours)
+    assert kw[:2].tolist() == [6, 1.5]
+    assert np.isnan(kw[2])
+    assert np.isnan(converter.convert([3], "KWH", "KW")[0])
+    assert converter.convert([6], "KW", "KWH", hours=np.array([0.5])).tolist() == [3]
+    # 2.3 kWh in an hour on one phase are 10 A
+    assert converter.convert(
+        [2.3], "KWH", "A", _phases("ONE"), np.array([1.0])
+    ).tolist() == pytest.approx([10])
+
+
+def test_other_dimensions_are_not_converted(converter):
+    values = converter.convert([1, 2, 3, 4], ["EUR", "EUR/KWH", "EUR/KW", None], "KW")
+    assert np.isnan(values).all()
+    assert converter.convert([0.3], "EUR/KWH", "EUR/KWH").tolist() == [0.3]
+    assert np.isnan(converter.convert([1], "KW", "EUR")[0])
+
+
+def test_unknown_units(converter):
+    with pytest.raises(ValueError, match="unknown unit 'MW'"):
+        converter.convert([1], "KW", "MW")
+    with pytest.raises(ValueError, match="unknown value 'MW'"):
+        converter.convert([1], ["MW"], "KW")
+    with pytest.raises(ValueError):
+        converter.normalize_forecasts(
+            [{"forecasted_blocks": [{"capacity": 1, "unit": "MW"}]}]
+        )
+
+
+def test_durations():
+    start = np.array(["2024-01-01T00:00", "2024-01-01T01:00", "NaT"], "datetime64[ms]")
+    end = np.array(["2024-01-01T00:15", "2024-01-01T01:00", "2024-01-01"], "M8[ms]")
+    hours = durations(start, end)
+    assert hours[0] == 0.25
+    assert np.isnan(hours[1:]).all()
+
+
+def test_normalize_forecasts(converter):
+    forecasts = [
+        {
+            "group_id": "g1",
+            "forecasted_blocks": [
+                {
+                    "capacity": 1500,
+                    "unit": "W",
+                    "phase": "ALL",
+                    "start_time": "2024-01-01T00:00:00",
+                    "end_time": "2024-01-01T00:30:00",
+                },
+                {
+                    "capacity": 2,
+                    "unit": "KWH",
+                    "start_time": "2024-01-01T00:00:00",
+                    "end_time": "2024-01-01T00:30:00",
+                },
+                {"capacity": 10, "unit": "A", "phase": "ONE"},
+                {"capacity": 0.3, "unit": "EUR/KWH"},
+            ],
+        },
+        {"group_id": "g2"},
+        {"group_id": "g3", "forecasted_blocks": []},
+    ]
+    normalized = converter.normalize_forecasts(forecasts, "KW")
+    blocks = normalized[0]["forecasted_blocks"]
+    assert [(b["capacity"], b["unit"]) for b in blocks] == [
+        (1.5, "KW"),
+        (4, "KW"),
+        (2.3, "KW"),
+        (0.3, "EUR/KWH"),
+    ]
+    assert blocks[0]["start_time"] == "2024-01-01T00:00:00"
+    assert normalized[1:] == forecasts[1:]
+    # the payloads are not modified
+    assert forecasts[0]["forecasted_blocks"][0]["unit"] == "W"
+
+
+def test_normalize_measurements(converter):
+    payload = {
+        "group_id": "g1",
+        "measurements": [
+            {
+                "value": 4,
+                "unit": "KW",
+                "phase": "ALL",
+                "initial_measure_time": "2024-01-01T00:00:00",
+                "measure_time": "2024-01-01T00:15:00",
+            },
+            {"value": 500, "unit": "WH"},
+            {"value": 10, "unit": "A"},
+        ],
+    }
+    measurements = converter.normalize(payload)["measurements"]
+    assert [(m["value"], m["unit"]) for m in measurements] == [
+        (1, "KWH"),
+        (0.5, "KWH"),
+        # the duration is unknown
+        (10, "A"),
+    ]
+
+
+def test_convert_columns(converter):
+    blocks = BlockColumns.from_blocks(
+        [
+            {"capacity": 10, "unit": "A", "phase": "ONE"},
+            {"capacity": 1, "unit": "EUR/KW"},
+        ]
+    )
+    converted = converter.convert_blocks(blocks, "W")
+    assert converted.capacity.tolist() == [2300, 1]
+    assert converted.unit.tolist() == [UNITS.index("W"), UNITS.index("EUR/KW")]
+    assert converted.unit.dtype == np.int8
+
+    measurements = MeasurementColumns.from_measurements(
+        [
+            {
+                "value": 250,
+                "unit": "WH",
+                "initial_measure_time": "2024-01-01T00:00:00",
+                "measure_time": "2024-01-01T00:15:00",
+            }
+        ]
+    )
+    converted = converter.convert_measurements(measurements, "KW")
+    assert converted.value.tolist() == [1]
+    assert converted.unit.tolist() == [UNITS.index("KW")]
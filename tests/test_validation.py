@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import copy
+import warnings
+
+import pytest
+from flask import Blueprint, Flask
+from flask_restx import Api, Namespace, Resource, fields
+from werkzeug.exceptions import BadRequest
+
+from oscp.co_endpoints import cap_optimizer_ns
+from oscp.cp_endpoints import cap_provider_ns
+from oscp.ep_endpoints import addPrice
+from oscp.epc_endpoints import addForPriceCalculation
+from oscp.fp_endpoints import flex_provider_ns
+from oscp.validation import CompiledValidator, compileValidators, expected_models
+
+VALUES = {
+    "string": "x",
+    "number": 1.5,
+    "integer": 1,
+    "boolean": True,
+}
+# a value of another type for each type
+WRONG_TYPES = {
+    "string": 12,
+    "number": "x",
+    "integer": 1.5,
+    "boolean": "x",
+    "array": {"x": 1},
+    "object": [1],
+}
+
+
+# the OSCP models have no required fields
+required_ns = Namespace(name="required", validate=True, path="/required")
+Item = required_ns.model(
+    "RequiredItem",
+    {
+        "unit": fields.String(required=True, enum=["W", "KW"]),
+        "value": fields.Float(required=True),
+        "count": fields.Integer(),
+        "active": fields.Boolean(required=True),
+    },
+)
+Message = required_ns.model(
+    "RequiredMessage",
+    {
+        "id": fields.String(required=True),
+        "item": fields.Nested(Item, required=True),
+        "items": fields.List(fields.Nested(Item), required=True),
+    },
+)
+
+
+@required_ns.route("/message")
+class RequiredMessageResource(Resource):
+    @required_ns.expect(Message)
+    def post(self):
+        return "", 204
+
+
+@pytest.fixture(scope="module", params=["registry", "refresolver"])
+def api(request):
+    app = Flask(__name__)
+    blueprint = Blueprint("api", __name__, url_prefix="/oscp")
+    api = Api(blueprint)
+    for namespace in (cap_provider_ns, flex_provider_ns, cap_optimizer_ns, required_ns):
+        api.add_namespace(namespace)
+    # the price endpoints are added to new namespaces, as they modify them
+    ep = Namespace(name="ep_validation", validate=True, path="/ep_validation")
+    addPrice(ep)
+    api.add_namespace(ep)
+    epc = Namespace(name="epc_validation", validate=True, path="/epc_validation")
+    addForPriceCalculation(epc)
+    api.add_namespace(epc)
+    compileValidators(api)
+    app.register_blueprint(blueprint)
+    with app.test_request_context():
+        if request.param == "refresolver":
+            # older flask-restx versions validate with draft 4
+            jsonschema = pytest.importorskip("jsonschema")
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                api._refresolver = jsonschema.RefResolver.from_schema(api.__schema__)
+        api.resolver = api.refresolver
+        yield api
+
+
+def _resolve(api, schema):
+    while "$ref" in schema or "allOf" in schema:
+        if "$ref" in schema:
+            schema = api.models[schema["$ref"].split("/")[-1]].__schema__
+        else:
+            (schema,) = schema["allOf"]
+    return schema
+
+
+def _type(schema):
+    if "properties" in schema:
+        return "object"
+    return schema.get("type")
+
+
+def _valid(api, schema):
+    """
+    returns a payload containing every property of the schema
+    """
+    schema = _resolve(api, schema)
+    kind = _type(schema)
+    if kind == "object":
+        return {
+            name: _valid(api, sub) for name, sub in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [_valid(api, schema["items"]), _valid(api, schema["items"])]
+    if "enum" in schema:
+        return schema["enum"][-1]
+    return VALUES[kind]
+
+
+def _invalid(api, schema, payload, path=()):
+    """
+    yields (path, payload) with one invalid value below path each
+    """
+    schema = _resolve(api, schema)
+    kind = _type(schema)
+    yield path + ("type",), WRONG_TYPES[kind]
+    if kind == "integer":
+        # only valid since draft 6
+        yield path + ("float",), 5.0
+    if "enum" in schema:
+        yield path + ("enum",), "BAD"
+    if kind == "object":
+        for name in schema.get("required", []):
+            yield path + (name, "missing"), {
+                k: v for k, v in payload.items() if k != name
+            }
+        for name, sub in schema.get("properties", {}).items():
+            for subpath, value in _invalid(api, sub, payload[name], path + (name,)):
+                yield subpath, dict(payload, **{name: value})
+    if kind == "array":
+        # only the last item is invalid
+        for subpath, value in _invalid(api, schema["items"], payload[-1], path):
+            yield subpath, payload[:-1] + [value]
+
+
+def _errors(validate, payload):
+    try:
+        validate(copy.deepcopy(payload))
+    except BadRequest as e:
+        return list(e.data["errors"].items())
+    return None
+
+
+def _payloads(api, model):
+    valid = _valid(api, model.__schema__)
+    yield ("valid",), valid
+    yield from _invalid(api, model.__schema__, valid)
+    # several errors in one payload
+    yield ("all",), {name: 12 for name in valid}
+
+
+def test_all_expected_models_are_compiled(api):
+    models = list(expected_models(api))
+    assert {model.name for model in models} >= {
+        "GroupCapacityForecast",
+        "GroupCapacityComplianceError",
+        "UpdateGroupMeasurements",
+        "UpdateGroupCapacityPrice",
+        "Register",
+        "Handshake",
+        "Heartbeat",
+        "RequiredMessage",
+    }
+    for model in models:
+        assert isinstance(model.validate, CompiledValidator), model.name
+
+
+def test_compiled_errors_match_jsonschema(api):
+    compared = 0
+    for model in expected_models(api):
+        for path, payload in _payloads(api, model):
+
+            def jsonschema(data):
+                type(model).validate(model, data, api.resolver)
+
+            expected = _errors(jsonschema, payload)
+            compiled = _errors(lambda data: model.validate(data, api.resolver), payload)
+            assert compiled == expected, (model.name, path)
+            if path != ("valid",) and path[-1] != "float":
+                assert expected, (model.name, path)
+            compared += 1
+    assert compared > 50
+
+
+@pytest.mark.parametrize("payload", [None, [], "x", 1])
+def test_non_object_payloads(api, payload):
+    for model in expected_models(api):
+        expected = _errors(
+            lambda data: type(model).validate(model, data, api.resolver), payload
+        )
+        assert (
+            _errors(lambda data: model.validate(data, api.resolver), payload)
+            == expected
+        )